@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from protein_class import Protein
+from array import array
+import configparser
+import contextlib
+import platform
+import argparse
+import random
+import timeit
+import copy
+import time
+import json
+import io
+import numpy as np
+import utils
+import progress
+
+
+LENGTHS = (11, 64, 200) # default chain lengths: prefixes of the sequence of the configuration
+EVOLUTIONS = { # end-to-end evolutions: engine and multiple_try of each one
+    'evolution' : ('list', 1),
+    'evolution_array' : ('array', 1),
+    'evolution_mtm4' : ('list', 4),
+}
+
+
+def benchmark_config(config : utils.Configuration, n : int, steps : int, engine : str = 'list',
+                     multiple_try : int = 1) -> utils.Configuration:
+    '''
+    Copy of the configuration for a benchmark: the first n monomers of its sequence, a plain Metropolis evolution of
+    steps steps at constant temperature with nothing saved or reported.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    n : int
+        Length of the chain.
+    steps : int
+        Steps of the evolution.
+    engine : str, optional
+        Structure storage, list or array. The default is 'list'.
+    multiple_try : int, optional
+        Candidates of each step of the evolution. The default is 1.
+
+    Returns
+    -------
+    utils.Configuration
+        The configuration of the benchmark.
+    '''
+    if n > len(config.seq):
+        raise ValueError(f'The sequence of the configuration has {len(config.seq)} monomers, {n} are required')
+    config = copy.copy(config)
+    config.seq = config.seq[:n]
+    config.use_struct = False
+    config.folds = steps
+    config.annealing = False
+    config.gif = False
+    config.debug = False
+    config.engine = engine
+    config.multiple_try = multiple_try
+    config.pull_weight = 0. if multiple_try > 1 else config.pull_weight
+    config.cache_size = 0
+    config.trajectory = None
+    config.checkpoint = None
+    config.progress = 'silent'
+    config.profile = False
+    return config
+
+
+def time_call(func, number : int, repeat : int = 5) -> dict:
+    '''
+    Time number calls of func, repeated repeat times: the best repetition is the least disturbed by the other
+    processes of the machine, so it is the one to compare between versions.
+
+    Returns
+    -------
+    dict
+        Seconds per call of the best and of the mean repetition, calls per second (from the best) and calls timed.
+    '''
+    times = timeit.repeat(func, number=number, repeat=repeat)
+    best = min(times)/number
+    return {
+        'best_s' : best,
+        'mean_s' : float(np.mean(times))/number,
+        'per_second' : 1/best if best > 0 else float('inf'),
+        'number' : number,
+        'repeat' : repeat,
+    }
+
+
+def folded_protein(config : utils.Configuration, seed : int, warmup : int) -> Protein:
+    '''
+    Protein of the configuration evolved for warmup steps, so the hot paths are timed on a compact structure with
+    contacts (the linear initial one has none).
+    '''
+    random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()): # the conversion of the sequence is printed
+        prot = Protein(benchmark_config(config, len(config.seq), warmup))
+    prot.evolution()
+    prot.counter = array('l') # the folds of the warmup are not counted
+    return prot
+
+
+def benchmark_length(config : utils.Configuration, n : int, seed : int = 0, warmup : int = 2000,
+                     steps : int = 2000, number : int = 1000, repeat : int = 5) -> dict:
+    '''
+    Benchmark the hot paths of the folding for the chain of the first n monomers of the sequence: the methods
+    energy, compactness, get_neig_of and random_fold of Protein, utils.is_valid_struct and utils.tail_fold on a
+    structure folded by warmup steps, and the steps per second of the end-to-end evolutions (see EVOLUTIONS).
+
+    Returns
+    -------
+    dict
+        Timings of each benchmark (see time_call).
+    '''
+    config = benchmark_config(config, n, steps)
+    prot = folded_protein(config, seed, warmup)
+    struct = prot.struct
+    index = n//2 # pivot of the tail folds
+    tail = [[x - struct[index][0], y - struct[index][1]] for x,y in struct[index:]]
+    previous = [struct[index-1][0] - struct[index][0], struct[index-1][1] - struct[index][1]]
+    cycle = {'neig' : 0, 'method' : 0}
+
+    def get_neig_of():
+        cycle['neig'] = (cycle['neig'] + 1) % n
+        prot.get_neig_of(cycle['neig'])
+
+    def tail_fold():
+        cycle['method'] = cycle['method'] % 7 + 1
+        utils.tail_fold(tail, cycle['method'], previous)
+
+    def energy():
+        prot._hh = None # the H-H contacts are counted again at each call
+        prot.energy()
+
+    results = {'n' : n, 'sequence' : prot.seq, 'energy_of_struct' : prot.energy()}
+    random.seed(seed)
+    results['energy'] = time_call(energy, number, repeat)
+    results['compactness'] = time_call(prot.compactness, number, repeat)
+    results['get_neig_of'] = time_call(get_neig_of, number, repeat)
+    results['random_fold'] = time_call(prot.random_fold, number, repeat)
+    results['random_fold']['folds_per_proposal'] = float(np.mean(prot.counter)) # tries per valid fold
+    results['is_valid_struct'] = time_call(lambda: utils.is_valid_struct(struct), number, repeat)
+    results['tail_fold'] = time_call(tail_fold, number, repeat)
+
+    for name,(engine,multiple_try) in EVOLUTIONS.items():
+        evo_config = benchmark_config(config, n, steps, engine, multiple_try)
+        random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            evo = Protein(evo_config)
+        evo.struct = np.array(struct, dtype=int) if engine == 'array' else [list(site) for site in struct]
+        evo.reset_records()
+        evo.reporter = progress.get_reporter('silent')
+        start = time.perf_counter()
+        evo.evolution()
+        elapsed = time.perf_counter() - start
+        results[name] = {'steps' : steps, 'time_s' : elapsed, 'steps_per_second' : steps/elapsed}
+    return results
+
+
+def run_benchmarks(config : utils.Configuration, lengths : tuple = LENGTHS, **kwargs) -> dict:
+    '''
+    Run the benchmarks at each chain length (see benchmark_length for the keyword arguments).
+
+    Returns
+    -------
+    dict
+        Environment of the run (Python and numpy versions, machine) and the timings of each length.
+    '''
+    start = time.perf_counter()
+    results = {
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'machine' : platform.platform(),
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings' : kwargs,
+        'lengths' : {},
+    }
+    for n in lengths:
+        results['lengths'][str(n)] = benchmark_length(config, n, **kwargs)
+    results['wall_time'] = time.perf_counter() - start
+    return results
+
+
+def rates(results : dict) -> dict:
+    '''
+    Calls (or steps) per second of each benchmark, keyed by (length, benchmark).
+    '''
+    out = {}
+    for n,benches in results['lengths'].items():
+        for name,bench in benches.items():
+            if isinstance(bench, dict):
+                out[(n, name)] = bench.get('per_second', bench.get('steps_per_second'))
+    return out
+
+
+def compare(old : dict, new : dict) -> dict:
+    '''
+    Speedup of the new results with respect to the old ones (ratio of the calls per second, > 1 is faster) for
+    each benchmark present in both, keyed by 'length/benchmark'.
+    '''
+    old_rates, new_rates = rates(old), rates(new)
+    return {f'{n}/{name}' : new_rates[(n, name)]/old_rates[(n, name)]
+            for n,name in new_rates if (n, name) in old_rates and old_rates[(n, name)]}
+
+
+def print_results(results : dict, baseline : dict = None) -> None:
+    '''
+    Print a table of the calls per second of each benchmark (and the speedup with respect to baseline).
+    '''
+    speedup = compare(baseline, results) if baseline is not None else {}
+    for (n, name),rate in rates(results).items():
+        line = f'n = {n:>4}  {name:<18} {rate:14.1f} /s'
+        if f'{n}/{name}' in speedup:
+            line += f'  x{speedup[f"{n}/{name}"]:.2f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the folding at several chain lengths')
+    parser.add_argument('configuration_file', help='file from which takes the sequence', default = 'config_test.txt', nargs='?')
+    parser.add_argument('--lengths', type=int, nargs='+', default=LENGTHS, help='chain lengths (prefixes of the sequence)')
+    parser.add_argument('--number', type=int, default=1000, help='calls of each timing')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions of each timing (the best is kept)')
+    parser.add_argument('--steps', type=int, default=2000, help='steps of the evolutions')
+    parser.add_argument('--output', default='data/benchmark.json', help='json file where to save the results')
+    parser.add_argument('--compare', default=None, help='json file of previous results to compare with')
+    args = parser.parse_args()
+
+    configuration = configparser.ConfigParser()
+    configuration.read(args.configuration_file)
+    config = utils.Configuration(configuration)
+
+    results = run_benchmarks(config, tuple(args.lengths), seed=config.seed, steps=args.steps,
+                             number=args.number, repeat=args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"It took {results['wall_time']:.3f} seconds, results saved in {args.output}")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+import math
+import time
+import utils
+import progress
+
+
+class BranchAndBound():
+    '''
+    Depth first branch and bound search of the ground state of the protein in the square lattice, growing the chain
+    monomer by monomer (with the first bond and the first turn fixed by the symmetries of the lattice).\n
+    A partial chain is discarded if its energy minus an upper bound of the H-H contacts that the remaining monomers
+    can still make is not lower than the best energy found. The bound is admissible (it never underestimates), so
+    when the search ends the best structure is a proven ground state. It uses the parity of the lattice: a contact
+    joins an even and an odd monomer, each remaining H monomer has at most 2 free neighbour sites (3 the last one),
+    and the placed H monomers only the free sites next to them. The contacts of the remaining even H monomers are
+    bounded by the free slots of the odd ones (remaining or placed), and the ones of the remaining odd H monomers
+    with the placed even H monomers by the free sites next to them.\n
+    The search stops after time_limit seconds (but not before the first complete chain is found): the best
+    structure is then reported with a proven lower bound of the ground state energy (the lowest bound of the
+    partial chains not explored yet).
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def __init__(self, config : utils.Configuration) -> None:
+        if utils.is_valid_sequence(config.seq):
+            self.seq = config.seq
+        else:
+            self.seq = utils.hp_sequence_transform(config.seq) # the 20 amino acids are coded in HP
+        self.n = len(self.seq)
+        self.time_limit = config.bb_time_limit
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval)
+
+        self.best_energy = math.inf # energy of the best structure found
+        self.best_struct = None # best structure found (list of [x,y])
+        self.lower_bound = -float(utils.max_hh_contacts(self.seq)) # proven lower bound of the ground state energy
+        self.optimal = False # True if the search ended, i.e. best_energy is the ground state energy
+        self.nodes = 0 # partial chains expanded
+        self.time = 0.
+
+        # slots of contacts of the H monomers from the k-th to the last, by parity of the index
+        self._slots = ([0]*(self.n + 1), [0]*(self.n + 1))
+        for i in range(self.n - 1, -1, -1):
+            for parity in (0, 1):
+                self._slots[parity][i] = self._slots[parity][i+1]
+            if self.seq[i] == 'H':
+                self._slots[i % 2][i] += 3 if i in (0, self.n - 1) else 2
+
+
+    def bound(self, k : int, free_even : int, free_odd : int) -> int:
+        '''
+        Upper bound of the H-H contacts that the monomers from the k-th to the last can still make, given the
+        number of free sites next to the placed even and odd H monomers (one for each H monomer - site pair).
+        '''
+        slots_even = self._slots[0][k]
+        slots_odd = self._slots[1][k]
+        return min(slots_even, slots_odd + free_odd) + min(slots_odd, free_even)
+
+
+    def run(self) -> None:
+        '''
+        Search the ground state until the whole tree is explored (or pruned) or the time limit is reached.
+
+        Returns
+        -------
+        None.
+        '''
+        start = time.perf_counter()
+        seq = self.seq
+        n = self.n
+        is_h = [mon == 'H' for mon in seq]
+        path = [(0,0), (1,0)] # sites of the current chain
+        occ = {(0,0) : 0, (1,0) : 1} # site -> monomer index of the current chain
+        free = [0, 0] # free sites next to the placed H monomers, by parity
+        for i,(x,y) in enumerate(path):
+            if is_h[i]:
+                free[i % 2] += sum(1 for site in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)) if site not in occ)
+        # partial chains to expand: (monomer index, its site, energy, lower bound, free sites even, free sites odd)
+        stack = [(1, (1,0), 0, -self.bound(2, *free), *free)]
+        self.reporter.start(0)
+
+        while stack:
+            # the time is checked only once the first descent has found a complete chain, so one is always reported
+            if self.best_struct is not None and self.nodes % 1000 == 0 and time.perf_counter() - start > self.time_limit:
+                break
+            k, site, en, lb, free_even, free_odd = stack.pop()
+            if lb >= self.best_energy: # pruned by a structure found after it was pushed
+                continue
+            self.nodes += 1
+            while len(path) > k: # back to the prefix of the chain
+                del occ[path.pop()]
+            if len(path) == k:
+                path.append(site)
+                occ[site] = k
+
+            k += 1 # monomer to place
+            if k == n:
+                self.best_energy = float(en)
+                self.best_struct = [list(s) for s in path]
+                self.reporter.update(self.nodes, en=en, best=en)
+                continue
+
+            x, y = site
+            bent = y != 0 or any(s[1] != 0 for s in path) # the first turn is to +y (reflection symmetry)
+            children = []
+            for s in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)) if bent else ((x+1,y),(x,y+1)):
+                if s in occ:
+                    continue
+                s_x, s_y = s
+                d_en = 0
+                child_free = [free_even, free_odd]
+                empty = 0
+                for nb in ((s_x+1,s_y),(s_x,s_y+1),(s_x-1,s_y),(s_x,s_y-1)):
+                    j = occ.get(nb)
+                    if j is None:
+                        empty += 1
+                    elif is_h[j]:
+                        child_free[j % 2] -= 1 # the site is no more free for the j-th monomer
+                        if is_h[k] and j < k-1:
+                            d_en -= 1
+                if is_h[k]:
+                    child_free[k % 2] += empty
+                child_lb = en + d_en - self.bound(k+1, *child_free)
+                if child_lb < self.best_energy:
+                    children.append((k, s, en + d_en, child_lb, *child_free))
+            children.sort(key=lambda c: (c[3], c[2]), reverse=True) # the most promising child is expanded first
+            stack.extend(children)
+
+        self.optimal = not stack or all(entry[3] >= self.best_energy for entry in stack)
+        if self.optimal:
+            self.lower_bound = self.best_energy
+        else:
+            self.lower_bound = max(self.lower_bound, float(min(self.best_energy, min(entry[3] for entry in stack))))
+        self.reporter.finish()
+        self.time = time.perf_counter() - start
+
+
+    def report(self) -> None:
+        '''
+        Print the best structure energy and the proven bound.
+        '''
+        if self.optimal:
+            print(f'Ground state energy {self.best_energy} (proven optimal, {self.nodes} nodes in {self.time:.2f} s)')
+        else:
+            print(f'Best energy {self.best_energy}, ground state energy >= {self.lower_bound} '
+                  f'(time limit reached, {self.nodes} nodes in {self.time:.2f} s)')
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from collections import OrderedDict
+
+
+class ConformationCache():
+    '''
+    Bounded LRU cache of the properties of the conformations (e.g. validity and H-H contacts), keyed on their
+    canonical key (utils.canonical_key), so all the rigid images of a conformation share the same entry.
+    When the cache is full the least recently used entry is discarded. The hits and misses are counted.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Max number of entries. The default is 100000.
+    '''
+
+    def __init__(self, maxsize : int = 100000) -> None:
+        if maxsize < 1:
+            raise ValueError('The size of the cache must be at least 1')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key : bytes) -> bool:
+        return key in self._entries
+
+
+    def get(self, key : bytes):
+        '''
+        Value stored for the key (which becomes the most recently used), None if missing.
+        '''
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+
+    def put(self, key : bytes, value) -> None:
+        '''
+        Store the value of the key, discarding the least recently used entry if the cache is full.
+        '''
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+    @property
+    def hit_rate(self) -> float:
+        '''
+        Fraction of the lookups found in the cache (0 if none).
+        '''
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.
+
+
+    def stats(self) -> dict:
+        '''
+        Statistics of the cache: size, maxsize, hits, misses and hit_rate.
+        '''
+        return {'size' : len(self), 'maxsize' : self.maxsize, 'hits' : self.hits, 'misses' : self.misses,
+                'hit_rate' : self.hit_rate}
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from protein_class import Protein
+from multiprocessing import Pool
+import configparser
+import contextlib
+import argparse
+import random
+import time
+import json
+import os
+import io
+import numpy as np
+import utils
+import progress
+
+
+def run_seeds(seed : int, runs : int) -> list:
+    '''
+    Independent and reproducible seeds of the runs of an ensemble, spawned from the seed of the configuration.
+    The seed of the k-th run depends only on the configuration seed and on k.
+
+    Parameters
+    ----------
+    seed : int
+        Seed of the configuration.
+    runs : int
+        Number of runs.
+
+    Returns
+    -------
+    list
+        Seeds of the runs.
+    '''
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(runs)]
+
+
+def run_ensemble(config : utils.Configuration, runs : int, workers : int = 0) -> dict:
+    '''
+    Evolve runs independent proteins of the configuration in a pool of processes, each one with its own seed.
+    Nothing is plotted: the results of the runs are collected in a summary.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    runs : int
+        Number of independent runs.
+    workers : int, optional
+        Number of processes, 0 means one per core (up to the number of runs). The default is 0.
+
+    Returns
+    -------
+    dict
+        Summary of the ensemble: per run seed, best energy and structure, final energy and timings,
+        plus the best run and the statistics of the best energies.
+    '''
+    if runs < 1:
+        raise ValueError('The ensemble needs at least 1 run')
+    workers = workers if workers > 0 else min(runs, os.cpu_count() or 1)
+    start = time.perf_counter()
+
+    tasks = [(config, k, seed) for k,seed in enumerate(run_seeds(config.seed, runs))]
+    with Pool(workers) as pool:
+        results = pool.map(_run_chain, tasks, chunksize=1)
+
+    best_energies = [res['best_energy'] for res in results]
+    best = min(range(runs), key=lambda k: best_energies[k])
+    return {
+        'sequence' : results[0]['sequence'],
+        'steps' : config.folds,
+        'seed' : config.seed,
+        'runs' : results,
+        'best_run' : best,
+        'best_energy' : best_energies[best],
+        'best_struct' : results[best]['best_struct'],
+        'mean_best_energy' : float(np.mean(best_energies)),
+        'std_best_energy' : float(np.std(best_energies)),
+        'wall_time' : time.perf_counter() - start,
+        'workers' : workers,
+    }
+
+
+def _run_chain(task : tuple) -> dict:
+    '''
+    Evolve one protein of the ensemble with its own seed, discarding the terminal output. Each run saves its
+    checkpoints (if any) in its own file, <checkpoint>.<k>.
+    '''
+    config, k, seed = task
+    random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        prot = Protein(config)
+        prot.gif = False
+        if prot.checkpoint is not None: # the runs must not write the same file
+            prot.checkpoint = f'{prot.checkpoint}.{k}'
+        prot.reporter = progress.get_reporter('silent')
+        prot.evolution()
+        elapsed = time.perf_counter() - start
+    return {
+        'run' : k,
+        'seed' : seed,
+        'sequence' : prot.seq,
+        'best_energy' : prot.min_en,
+        'best_struct' : np.asarray(prot.min_en_struct).tolist(),
+        'final_energy' : prot.energy(),
+        'max_compactness' : prot.max_comp,
+        'time' : elapsed,
+        'steps_per_second' : prot.steps/elapsed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an ensemble of independent foldings of the configured protein')
+    parser.add_argument('configuration_file', help='file from which takes the configuration', default = 'config.txt', nargs='?')
+    parser.add_argument('--runs', type=int, default=8, help='number of independent runs')
+    parser.add_argument('--workers', type=int, default=0, help='number of processes (0 = one per core)')
+    parser.add_argument('--output', default='data/ensemble_summary.json', help='json file where to save the summary')
+    args = parser.parse_args()
+
+    configuration = configparser.ConfigParser()
+    configuration.read(args.configuration_file)
+    config = utils.Configuration(configuration)
+    print(f'The random seed used is {config.seed}')
+
+    summary = run_ensemble(config, args.runs, args.workers)
+    with open(args.output, 'w') as f:
+        json.dump(summary, f)
+
+    for res in summary['runs']:
+        print(f"run {res['run']:3d}  seed {res['seed']:10d}  best energy {res['best_energy']:7.1f}  time {res['time']:.2f} s")
+    print(f"Best energy {summary['best_energy']} (run {summary['best_run']}), "
+          f"mean {summary['mean_best_energy']:.2f} +- {summary['std_best_energy']:.2f}")
+    print(f"It took {summary['wall_time']:.3f} seconds, summary saved in {args.output}")
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from multiprocessing import Pool
+import time
+import os
+import utils
+import progress
+
+
+class ExactEnumeration():
+    '''
+    Exact enumeration of all the conformations (self avoiding walks) of the protein in the square lattice, to find
+    its true ground state energy, the degeneracy of the ground state and all the optimal structures, together with
+    the number of conformations at each energy (exact density of states).\n
+    The conformations are enumerated up to the 8 symmetries of the lattice: the first bond is fixed ([0,0] -> [1,0])
+    and the first turn of the chain is to the left (+y), so each conformation is counted once (the degeneracy is
+    the number of different conformations modulo rotations and reflections). The search tree is split by prefix:
+    the walks of the first monomers are enumerated in this process and their completions by a pool of processes.\n
+    The number of walks grows as about 2.64^n, so the enumeration is practical only for short chains
+    (n <= ~20 in pure Python, with the time divided by the number of cores).
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def __init__(self, config : utils.Configuration) -> None:
+        if utils.is_valid_sequence(config.seq):
+            self.seq = config.seq
+        else:
+            self.seq = utils.hp_sequence_transform(config.seq)
+        self.n = len(self.seq)
+        self.workers = config.exact_workers if config.exact_workers > 0 else os.cpu_count() or 1
+        self.max_structs = config.exact_max_structs # max number of optimal structures kept
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval)
+
+        self.min_energy = 0. # ground state energy
+        self.degeneracy = 0 # number of ground state conformations (modulo the lattice symmetries)
+        self.structs = [] # ground state structures (lists of [x,y], at most max_structs)
+        self.counts = {} # number of conformations at each energy
+        self.walks = 0 # number of conformations enumerated
+        self.prefixes = 0 # number of tasks of the search tree
+        self.time = 0.
+
+
+    @property
+    def energies(self) -> list:
+        '''
+        Energies of the conformations, in increasing order (see counts).
+        '''
+        return sorted(self.counts)
+
+
+    def run(self) -> None:
+        '''
+        Enumerate all the conformations. The prefixes are completed in a pool of workers processes (in this process
+        if workers = 1) and their results merged as soon as they are available: the progress reporter receives the
+        best energy found after each prefix.
+
+        Returns
+        -------
+        None.
+        '''
+        start = time.perf_counter()
+        prefixes = _prefixes(self.n, 16*self.workers) # a few tasks per worker to balance the load
+        self.prefixes = len(prefixes)
+        self.reporter.start(len(prefixes))
+        tasks = [(self.seq, prefix, self.max_structs) for prefix in prefixes]
+        if self.workers == 1:
+            for k,task in enumerate(tasks):
+                self._merge(_complete(task))
+                self.reporter.update(k+1, best=self.min_energy)
+        else:
+            with Pool(min(self.workers, len(tasks))) as pool:
+                for k,result in enumerate(pool.imap_unordered(_complete, tasks)):
+                    self._merge(result)
+                    self.reporter.update(k+1, best=self.min_energy)
+        self.reporter.finish()
+        self.structs.sort()
+        self.time = time.perf_counter() - start
+
+
+    def _merge(self, result : tuple) -> None:
+        '''
+        Merge the results of a prefix: energy counts, ground state energy and structures.
+        '''
+        counts, min_en, structs = result
+        for en,count in counts.items():
+            self.counts[en] = self.counts.get(en, 0) + count
+            self.walks += count
+        if not structs:
+            return
+        if not self.structs or min_en < self.min_energy:
+            self.min_energy = min_en
+            self.structs = []
+        if min_en == self.min_energy:
+            self.structs.extend(structs[:self.max_structs - len(self.structs)])
+        self.degeneracy = self.counts[self.min_energy]
+
+
+    def report(self) -> None:
+        '''
+        Print the ground state found.
+        '''
+        print(f'Ground state energy {self.min_energy}, degeneracy {self.degeneracy} '
+              f'({self.walks} conformations enumerated in {self.time:.2f} s)')
+
+
+def _prefixes(n : int, tasks : int) -> list:
+    '''
+    Walks of the first monomers (up to the lattice symmetries) used as tasks: the prefix length is increased
+    until there are at least tasks prefixes (or the prefixes are complete walks).
+    '''
+    prefixes = [[(0,0), (1,0)]]
+    while len(prefixes) < tasks and len(prefixes[0]) < n:
+        longer = []
+        for prefix in prefixes:
+            occ = set(prefix)
+            x, y = prefix[-1]
+            bent = any(site[1] != 0 for site in prefix)
+            for site in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)) if bent else ((x+1,y),(x,y+1)):
+                if site not in occ:
+                    longer.append(prefix + [site])
+        prefixes = longer
+    return prefixes
+
+
+def _complete(task : tuple) -> tuple:
+    '''
+    Enumerate all the completions of a prefix (depth first).
+
+    Parameters
+    ----------
+    task : tuple
+        HP sequence, prefix (list of sites) and max number of min energy structures kept.
+
+    Returns
+    -------
+    tuple
+        Number of conformations at each energy (dict), min energy and min energy structures.
+    '''
+    seq, prefix, max_structs = task
+    n = len(seq)
+    is_h = [mon == 'H' for mon in seq]
+    path = list(prefix)
+    occ = {site : i for i,site in enumerate(path)}
+    en = 0
+    for i,(x,y) in enumerate(path): # contacts of the prefix, each found from its higher index monomer
+        if is_h[i]:
+            for site in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)):
+                j = occ.get(site)
+                if j is not None and j < i-1 and is_h[j]:
+                    en -= 1
+
+    counts = {}
+    best = [0, []] # min energy and its structures
+    bent = any(site[1] != 0 for site in path)
+
+    def grow(k : int, en : int, bent : bool) -> None:
+        if k == n:
+            counts[en] = counts.get(en, 0) + 1
+            if en < best[0] or not best[1]:
+                best[0] = en
+                best[1] = [[list(site) for site in path]]
+            elif en == best[0] and len(best[1]) < max_structs:
+                best[1].append([list(site) for site in path])
+            return
+        x, y = path[-1]
+        for site in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)) if bent else ((x+1,y),(x,y+1)):
+            if site in occ:
+                continue
+            d_en = 0
+            if is_h[k]:
+                s_x, s_y = site
+                for nb in ((s_x+1,s_y),(s_x,s_y+1),(s_x-1,s_y),(s_x,s_y-1)):
+                    j = occ.get(nb)
+                    if j is not None and j < k-1 and is_h[j]:
+                        d_en -= 1
+            occ[site] = k
+            path.append(site)
+            grow(k+1, en + d_en, bent or site[1] != 0)
+            path.pop()
+            del occ[site]
+
+    grow(len(path), en, bent)
+    return ({float(e) : c for e,c in counts.items()}, float(best[0]), best[1])
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+import numpy as np
+
+
+class History():
+    '''
+    Compact record of the evolution of the protein: energy, compactness and temperature of the accepted state
+    stored in preallocated numpy arrays (float64, 8 bytes per value) instead of growing lists of Python floats.\n
+    One record is taken every stride steps (the state at the end of each window). If aggregate is True the min,
+    mean and max of the energy and of the compactness over the steps of each window are recorded too.
+    The arrays are enlarged (doubling their size) if more records than expected are added.
+
+    Parameters
+    ----------
+    steps : int
+        Expected number of steps, used to preallocate the arrays.
+    stride : int, optional
+        Number of steps between two records. The default is 1.
+    aggregate : bool, optional
+        If True record also the min, mean and max of each window. The default is False.
+    '''
+
+    FIELDS = ('step', 'energy', 'compactness', 'T')
+    AGGREGATES = ('energy_min', 'energy_mean', 'energy_max', 'compactness_min', 'compactness_mean', 'compactness_max')
+
+    def __init__(self, steps : int, stride : int = 1, aggregate : bool = False) -> None:
+        if stride < 1:
+            raise ValueError('The recording stride must be at least 1')
+        self.stride = stride
+        self.aggregate = aggregate
+        self.size = 0 # number of records
+        self._arrays = {}
+        capacity = steps//stride + 2 # initial state, full windows and the last partial one
+        for name in self.FIELDS + (self.AGGREGATES if aggregate else ()):
+            self._arrays[name] = np.empty(capacity, dtype=np.int64 if name == 'step' else float)
+        self._reset_window()
+
+
+    def __getstate__(self) -> dict:
+        '''
+        Only the records (the first size elements of the arrays) are pickled, e.g. in the checkpoints, with the
+        capacity to preallocate again when the history is loaded.
+        '''
+        state = self.__dict__.copy()
+        state['_capacity'] = len(self._arrays['step'])
+        state['_arrays'] = {name : arr[:self.size].copy() for name,arr in self._arrays.items()}
+        return state
+
+
+    def __setstate__(self, state : dict) -> None:
+        capacity = state.pop('_capacity')
+        self.__dict__.update(state)
+        for name,arr in self._arrays.items():
+            self._arrays[name] = np.empty(capacity, dtype=arr.dtype)
+            self._arrays[name][:self.size] = arr
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    def __getattr__(self, name : str) -> np.ndarray:
+        '''
+        Recorded series (view of the first size elements), e.g. history.energy or history.energy_min.
+        '''
+        arrays = self.__dict__.get('_arrays', {})
+        if name in arrays:
+            return arrays[name][:self.size]
+        raise AttributeError(f"'History' object has no attribute '{name}'")
+
+
+    def _reset_window(self) -> None:
+        self._count = 0 # steps in the current window
+        self._en_sum = self._comp_sum = 0.
+        self._en_min = self._comp_min = np.inf
+        self._en_max = self._comp_max = -np.inf
+
+
+    def record(self, step : int, en : float, comp : float, T : float) -> None:
+        '''
+        Record a single state, e.g. the initial one (its aggregates are the values themselves).
+        '''
+        if self.size == len(self._arrays['step']):
+            for name,arr in self._arrays.items():
+                self._arrays[name] = np.resize(arr, 2*len(arr))
+        k = self.size
+        arrays = self._arrays
+        arrays['step'][k] = step
+        arrays['energy'][k] = en
+        arrays['compactness'][k] = comp
+        arrays['T'][k] = T
+        if self.aggregate:
+            arrays['energy_min'][k] = min(self._en_min, en)
+            arrays['energy_mean'][k] = self._en_sum/self._count if self._count else en
+            arrays['energy_max'][k] = max(self._en_max, en)
+            arrays['compactness_min'][k] = min(self._comp_min, comp)
+            arrays['compactness_mean'][k] = self._comp_sum/self._count if self._count else comp
+            arrays['compactness_max'][k] = max(self._comp_max, comp)
+        self.size += 1
+        self._reset_window()
+
+
+    def add(self, step : int, en : float, comp : float, T : float) -> None:
+        '''
+        Add the state of a step of the evolution: it is recorded at the end of each window of stride steps.
+        '''
+        self._count += 1
+        if self.aggregate:
+            self._en_sum += en
+            self._comp_sum += comp
+            if en < self._en_min: self._en_min = en
+            if en > self._en_max: self._en_max = en
+            if comp < self._comp_min: self._comp_min = comp
+            if comp > self._comp_max: self._comp_max = comp
+        if self._count == self.stride:
+            self.record(step, en, comp, T)
+        else:
+            self._last = (step, en, comp, T)
+
+
+    def flush(self) -> None:
+        '''
+        Record the last state of an incomplete window (called at the end of the evolution).
+        '''
+        if self._count:
+            self.record(*self._last)
+
+
+def reduce_windows(values : np.ndarray, size : int, how : str = 'mean') -> np.ndarray:
+    '''
+    Reduce the consecutive windows of size values of a series: 'mean', 'min', 'max' or 'last' of each window.
+    The last window can be shorter (ragged tail), so no value is dropped whatever the length of the series.
+    '''
+    values = np.asarray(values)
+    if size <= 1 or len(values) == 0:
+        return values
+    starts = np.arange(0, len(values), size)
+    if how == 'last':
+        return values[np.minimum(starts + size, len(values)) - 1]
+    if how == 'mean':
+        counts = np.diff(np.append(starts, len(values)))
+        return np.add.reduceat(values, starts)/counts
+    if how == 'min':
+        return np.minimum.reduceat(values, starts)
+    if how == 'max':
+        return np.maximum.reduceat(values, starts)
+    raise ValueError(f'Reduction {how} not recognized, it must be mean, min, max or last')
+
+
+def minmax_indices(values : np.ndarray, buckets : int) -> np.ndarray:
+    '''
+    Indices (sorted) of the min and of the max value in each of about buckets consecutive buckets of the series,
+    used to plot long series with at most 2*buckets points: every peak and valley of the series is kept, unlike
+    with a plain decimation. The last bucket can be shorter. All the indices are returned for short series.
+    '''
+    values = np.asarray(values)
+    n = len(values)
+    if n <= 2*buckets:
+        return np.arange(n)
+    size = -(-n//buckets) # ceil division
+    padded = np.pad(values, (0, -n % size), mode='edge').reshape(-1, size) # padding with the last value
+    offsets = np.arange(0, padded.shape[0]*size, size)
+    indices = np.concatenate((offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)))
+    return np.unique(np.minimum(indices, n - 1)) # an index in the padding has the value of the last one
@@ -3,85 +3,288 @@
 @author: Tommaso Giacometti
 """
 from protein_class import Protein
+from protein_3d import Protein3D
 import random
 import time
 import configparser
 import argparse
+import json
+import sys
+import os
+import numpy as np
 import utils
-import matplotlib.pyplot as plt
-import plots
 
 
-# Parser to get from terminal the configuration file
-parser = argparse.ArgumentParser()
-# the filename is optional, the default is the config.txt
-parser.add_argument('configuration_file', help='file from which takes the configuration', default = 'config.txt', nargs='?')
+# Command line interface, e.g.:
+#   python -m main fold config.txt --plot       fold the protein, save the results and the plots in data/
+#   python -m main fold config.txt --resume     continue the evolution from the checkpoint file of the configuration
+#   python -m main plot data/protein.pkl        plot the results of a previous fold
+#   python -m main ensemble config.txt --runs 8 independent foldings in a pool of processes
+#   python -m main bench config_test.txt        benchmark the hot paths at n = 11, 64 and 200 (json in data/)
+# Without a command the fold is assumed (python main.py config.txt). Matplotlib is imported only when plotting,
+# with the non interactive Agg backend unless --show is used.
+COMMANDS = ('fold', 'plot', 'ensemble', 'bench')
 
-args = parser.parse_args() # get the args written in the terminal
-filename = args.configuration_file # assign filename
 
-# setting the parameters from configuration file
-configuration = configparser.ConfigParser()
-configuration.read(filename)
+def read_config(filename : str) -> utils.Configuration:
+    '''
+    Read the configuration file.
+    '''
+    configuration = configparser.ConfigParser()
+    if not configuration.read(filename):
+        raise FileNotFoundError(f'Configuration file {filename} not found')
+    return utils.Configuration(configuration)
 
-config = utils.Configuration(configuration) # class to get the save the configuration from the file
 
-#Random seed setting
-random.seed(config.seed)
-print(f'The random seed used is {config.seed}')
+def import_plots(show : bool = False):
+    '''
+    Import the plots module (and matplotlib) only when required. The Agg backend is used if the plots are not shown,
+    so no display is needed.
+    '''
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import plots
+    return plots
 
-prot = Protein(config) # Protein class 
 
-plots.view(protein=prot, tit='Initial configuration') # plot the structure of the protein
+def fold(args) -> dict:
+    '''
+    Fold the protein with the mode of the configuration, save the results (results.json and the protein in
+    protein.pkl) in the output folder and, if required, the plots.
+    '''
+    config = read_config(args.configuration_file)
+    os.makedirs(args.output, exist_ok=True)
+    plots = import_plots(args.show) if args.plot or args.show else None
+    if plots is not None:
+        plots.OUTPUT_DIR = args.output
+    view = None if plots is None else plots.view_3d if config.dimension == 3 else plots.view
 
-start = time.time() 
+    #Random seed setting
+    random.seed(config.seed)
+    print(f'The random seed used is {config.seed}')
 
-print('--------------------')
-print('Evolution started...')
-prot.evolution() # evolve the protein with folds foldings
-print('Evolution ended')
-print('---------------')
+    if args.resume: # the protein, its records and the random generator are restored from the checkpoint
+        if config.checkpoint is None or config.mode != 'metropolis':
+            raise ValueError('The evolution can be resumed only in metropolis mode with a checkpoint file in the configuration')
+        prot = Protein.load_checkpoint(config.checkpoint)
+        print(f'Evolution resumed from step {prot.evo_step} of {prot.steps}')
+    else:
+        prot = Protein3D(config) if config.dimension == 3 else Protein(config)
+        if view is not None:
+            view(protein=prot, tit='Initial configuration') # plot the initial structure of the protein
 
-# various plots:
-plots.view(protein=prot, save=False, tit='Final configuration')
-plots.view_min_en(protein=prot)
-plots.view_max_comp(protein=prot)
-plots.plot_energy(protein=prot, avg=10)
-plots.plot_compactness(protein=prot, avg=10)
+    start = time.time()
+    results = {'mode' : config.mode, 'sequence' : prot.seq, 'seed' : config.seed}
 
-print(f'It took {time.time()-start:.3f} seconds')
+    if config.mode == 'replica': # replica exchange: the min energy structure of all the replicas is kept
+        from replica_exchange import ReplicaExchange
+        print('Replica exchange started...')
+        rex = ReplicaExchange(config)
+        rex.run()
+        rex.report()
+        prot.struct = rex.best_struct
+        results.update(temperatures=rex.temperatures, swap_acceptance=rex.swap_acceptance())
 
-plt.show() # to let the let plots on screen at the end
+    elif config.mode == 'wang_landau': # density of states: thermodynamics at all the temperatures from one run
+        from wang_landau import WangLandau
+        print('Wang-Landau started...')
+        wl = WangLandau(config)
+        wl.run()
+        prot.struct = wl.min_en_struct
+        results.update(steps=wl.steps, energies=wl.energies.tolist(), log_dos=wl.log_dos.tolist())
+        if plots is not None:
+            plots.plot_thermodynamics(wl)
 
-if config.gif:
-    plots.create_gif(protein=prot)
+    elif config.mode == 'perm': # chain growth: the best structure grown is kept
+        from perm import PERM
+        print('PERM started...')
+        growth = PERM(config)
+        growth.run()
+        if growth.best_structs:
+            prot.struct = growth.best_structs[0]
+        else: # the initial structure is kept
+            print('\033[41mPERM did not complete any chain within the tours and the time limit of the configuration, '
+                  'the initial structure is kept \033[0;0m')
+        results.update(tours=growth.tours, chains=growth.chains)
 
+    elif config.mode == 'exact': # exact enumeration: the first ground state structure is kept
+        from exact import ExactEnumeration
+        print('Exact enumeration started...')
+        enum = ExactEnumeration(config)
+        enum.run()
+        enum.report()
+        prot.struct = enum.structs[0]
+        results.update(degeneracy=enum.degeneracy, ground_structs=enum.structs, walks=enum.walks,
+                       energies=enum.energies, counts=[enum.counts[en] for en in enum.energies])
 
-from mpl_toolkits.mplot3d import Axes3D
+    elif config.mode == 'branch_bound': # ground state search: the best structure is kept with a proven bound
+        from branch_bound import BranchAndBound
+        print('Branch and bound started...')
+        search = BranchAndBound(config)
+        search.run()
+        search.report()
+        prot.struct = search.best_struct
+        results.update(lower_bound=search.lower_bound, optimal=search.optimal, nodes=search.nodes)
 
-def view_3d(protein, save=False, tit='3D Structure'):
-    fig = plt.figure()
-    ax = fig.add_subplot(111, projection='3d')
+    else:
+        if config.trajectory is not None and not args.resume: # the structures are streamed on disk during the evolution
+            from trajectory import TrajectoryWriter
+            prot.trajectory = TrajectoryWriter(config.trajectory, prot.seq, config.dimension, config.trajectory_stride)
+        print('Evolution started...')
+        prot.evolution() # evolve the protein with folds foldings
+        if prot.trajectory is not None:
+            prot.trajectory.close()
+        results.update(steps=prot.steps, final_energy=prot.energy(), final_struct=np.asarray(prot.struct).tolist(),
+                       max_compactness=prot.max_comp, max_comp_struct=np.asarray(prot.max_comp_struct).tolist())
+        if prot.cache is not None:
+            results['cache'] = prot.cache.stats()
+            print(f"Conformation cache hit rate: {results['cache']['hit_rate']:.2%}")
+        if prot.profiler is not None:
+            prot.profiler.print_report()
+            with open(os.path.join(args.output, 'profile.json'), 'w') as f:
+                json.dump(prot.profiler.report(), f, indent=1)
 
-    # Assuming the Protein class has these methods to get coordinates
-    x = protein.get_x_coordinates()
-    y = protein.get_y_coordinates()
-    z = protein.get_z_coordinates()
+    if config.mode == 'metropolis':
+        results.update(min_energy=prot.min_en, min_en_struct=np.asarray(prot.min_en_struct).tolist())
+    else:
+        results.update(min_energy=prot.energy(), min_en_struct=np.asarray(prot.struct).tolist())
+    results['time'] = time.time() - start
+    print(f"Min energy found: {results['min_energy']}")
+    print(f"It took {results['time']:.3f} seconds")
 
-    # Plot the 3D trajectory of the protein
-    ax.plot(x, y, z, label='Protein Structure')
-    ax.scatter(x, y, z)  # Mark the points for clarity
+    with open(os.path.join(args.output, 'results.json'), 'w') as f:
+        json.dump(results, f)
+    prot.save_checkpoint(os.path.join(args.output, 'protein.pkl')) # to plot the results later
 
-    # Labeling
-    ax.set_title(tit)
-    ax.set_xlabel('X Axis')
-    ax.set_ylabel('Y Axis')
-    ax.set_zlabel('Z Axis')
-    ax.legend()
+    if plots is not None:
+        plot_protein(plots, prot, config.mode, config.gif, args.show, workers=config.render_workers)
+    return results
 
-    if save:
-        plt.savefig(f'{tit}.png')
 
-    plt.show()
+def plot_protein(plots, prot : Protein, mode : str = 'metropolis', gif : bool = False, show : bool = False,
+                 snapshots : bool = False, workers : int = 1) -> None:
+    '''
+    Plot (and save) the final structure and, for an evolution, the best structures and the records, the gif
+    and the png snapshots of the frames, rendered by workers processes.
+    '''
+    import matplotlib.pyplot as plt
+    view = plots.view_3d if isinstance(prot, Protein3D) else plots.view
+    view(protein=prot, tit='Final configuration' if mode == 'metropolis' else 'Min energy structure',
+         filename='final_view_3d.png' if isinstance(prot, Protein3D) else 'final_view.png')
+    if mode == 'metropolis':
+        if not isinstance(prot, Protein3D):
+            plots.view_min_en(protein=prot)
+            plots.view_max_comp(protein=prot)
+        plots.plot_energy(protein=prot, avg=10)
+        plots.plot_compactness(protein=prot, avg=10)
+    if show:
+        plt.show() # to let the let plots on screen at the end
+    plt.close('all')
+    if mode == 'metropolis' and not isinstance(prot, Protein3D):
+        if gif:
+            plots.create_gif(protein=prot, workers=workers)
+        if snapshots:
+            plots.save_snapshots(protein=prot, workers=workers)
 
-plots.view_3d(protein=prot, tit='3D Structure of Protein')
\ No newline at end of file
+
+def plot(args) -> None:
+    '''
+    Plot the results of a previous fold from the protein saved in its output folder.
+    '''
+    plots = import_plots(args.show)
+    plots.OUTPUT_DIR = os.path.dirname(args.protein_file) or '.'
+    prot = Protein.load_checkpoint(args.protein_file)
+    with open(os.path.join(plots.OUTPUT_DIR, 'results.json')) as f:
+        mode = json.load(f)['mode']
+    plot_protein(plots, prot, mode, args.gif, args.show, args.snapshots, args.workers)
+
+
+def ensemble(args) -> None:
+    '''
+    Run an ensemble of independent foldings and save its summary.
+    '''
+    import ensemble as ens
+    config = read_config(args.configuration_file)
+    print(f'The random seed used is {config.seed}')
+    summary = ens.run_ensemble(config, args.runs, args.workers)
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'ensemble_summary.json'), 'w') as f:
+        json.dump(summary, f)
+    print(f"Best energy {summary['best_energy']} (run {summary['best_run']}), "
+          f"mean {summary['mean_best_energy']:.2f} +- {summary['std_best_energy']:.2f}")
+    print(f"It took {summary['wall_time']:.3f} seconds")
+
+
+def bench(args) -> None:
+    '''
+    Benchmark the hot paths of the folding and save the timings (compared with a previous json if given).
+    '''
+    import benchmark
+    config = read_config(args.configuration_file)
+    results = benchmark.run_benchmarks(config, tuple(args.lengths), seed=config.seed, steps=args.steps,
+                                       number=args.number, repeat=args.repeat)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    benchmark.print_results(results, baseline)
+    print(f"It took {results['wall_time']:.3f} seconds, results saved in {args.output}")
+
+
+def main(argv : list = None) -> None:
+    '''
+    Parse the command line and run the command.
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')): # fold is the default command
+        argv = ['fold'] + argv
+
+    parser = argparse.ArgumentParser(prog='python -m main', description='Folding of HP proteins in the lattice')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_fold = commands.add_parser('fold', help='fold the protein with the mode of the configuration file')
+    # the filename is optional, the default is the config.txt
+    parser_fold.add_argument('configuration_file', help='file from which takes the configuration', default = 'config.txt', nargs='?')
+    # continue the evolution interrupted at the last checkpoint saved in the checkpoint file of the configuration
+    parser_fold.add_argument('--resume', action='store_true', help='resume the evolution from the checkpoint file')
+    parser_fold.add_argument('--output', default='data', help='folder where the results and the plots are saved')
+    parser_fold.add_argument('--plot', action='store_true', help='save the plots (and the gif if create_gif is TRUE)')
+    parser_fold.add_argument('--show', action='store_true', help='show the plots on screen (implies --plot)')
+    parser_fold.set_defaults(func=fold)
+
+    parser_plot = commands.add_parser('plot', help='plot the results of a previous fold')
+    parser_plot.add_argument('protein_file', help='protein.pkl saved by fold', default = 'data/protein.pkl', nargs='?')
+    parser_plot.add_argument('--gif', action='store_true', help='create also the gif of the evolution')
+    parser_plot.add_argument('--snapshots', action='store_true', help='save the frames of the gif as png files')
+    parser_plot.add_argument('--workers', type=int, default=1, help='processes rendering the frames (0 = one per core)')
+    parser_plot.add_argument('--show', action='store_true', help='show the plots on screen')
+    parser_plot.set_defaults(func=plot)
+
+    parser_ens = commands.add_parser('ensemble', help='run independent foldings in a pool of processes')
+    parser_ens.add_argument('configuration_file', help='file from which takes the configuration', default = 'config.txt', nargs='?')
+    parser_ens.add_argument('--runs', type=int, default=8, help='number of independent runs')
+    parser_ens.add_argument('--workers', type=int, default=0, help='number of processes (0 = one per core)')
+    parser_ens.add_argument('--output', default='data', help='folder where the summary is saved')
+    parser_ens.set_defaults(func=ensemble)
+
+    parser_bench = commands.add_parser('bench', help='benchmark the hot paths of the folding at several chain lengths')
+    parser_bench.add_argument('configuration_file', help='file from which takes the sequence', default = 'config_test.txt', nargs='?')
+    parser_bench.add_argument('--lengths', type=int, nargs='+', default=[11, 64, 200], help='chain lengths (prefixes of the sequence)')
+    parser_bench.add_argument('--number', type=int, default=1000, help='calls of each timing')
+    parser_bench.add_argument('--repeat', type=int, default=5, help='repetitions of each timing (the best is kept)')
+    parser_bench.add_argument('--steps', type=int, default=2000, help='steps of the evolutions')
+    parser_bench.add_argument('--output', default='data/benchmark.json', help='json file where to save the results')
+    parser_bench.add_argument('--compare', default=None, help='json file of previous results to compare with')
+    parser_bench.set_defaults(func=bench)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+# the script is guarded since the replica exchange starts new processes that import this module
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+import random
+import math
+import time
+import utils
+import progress
+
+
+class PERM():
+    '''
+    Pruned-enriched Rosenbluth method (Grassberger 1997) to find low energy structures of the protein by chain growth.\n
+    The chain is grown monomer by monomer on the free sites next to its last monomer, each one chosen with probability
+    proportional to its Boltzmann factor exp(-dE/T) (same HP energy of the Protein class), and the weight of the chain
+    is multiplied by the sum of the factors (Rosenbluth weight). A chain is enriched (two copies with half weight) if its
+    weight is larger than c_plus times the mean weight at its length, and pruned with probability 1/2 (or doubled) if
+    lower than c_minus times the mean. The weights are stored as logarithms, since they grow exponentially with the
+    number of contacts. The growth is depth first, so only one chain is stored at a time.\n
+    The grown structures are self avoiding walks with unit bonds, as required by utils.is_valid_struct, and the best
+    ones are stored as lists of [x,y] that can be used as Protein structures.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def __init__(self, config : utils.Configuration) -> None:
+        if utils.is_valid_sequence(config.seq):
+            self.seq = config.seq
+        else:
+            self.seq = utils.hp_sequence_transform(config.seq)
+        self.n = len(self.seq)
+        self.T = config.perm_T
+        self.max_tours = config.perm_tours
+        self.time_limit = config.perm_time_limit
+        self.c_plus = config.perm_c_plus
+        self.c_minus = config.perm_c_minus
+        self.keep = config.perm_keep
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval)
+
+        self.ln_Z = [-math.inf]*(self.n + 1) # ln of the sum of the weights of the chains grown up to each length
+        self.tours = 0 # number of tours (growths started from the first monomer)
+        self.chains = 0 # number of complete chains grown
+        self.best = [] # best structures found: list of (energy, structure) ordered by energy
+        self.best_energy = 0.
+
+
+    @property
+    def best_structs(self) -> list:
+        '''
+        Best structures found, ordered by energy (the first has the min energy).
+        '''
+        return [struct for en,struct in self.best]
+
+
+    def run(self) -> None:
+        '''
+        Grow tours of chains until the max number of tours or the time limit is reached.
+
+        Returns
+        -------
+        None.
+        '''
+        start = time.perf_counter()
+        self.reporter.start(self.max_tours)
+        while self.tours < self.max_tours and time.perf_counter() - start < self.time_limit:
+            self.tours += 1
+            self._tour(start)
+            self.reporter.update(self.tours, best=self.best_energy if self.best else None)
+        self.reporter.finish()
+        for struct in self.best_structs:
+            if not utils.is_valid_struct(struct):
+                raise AssertionError('PERM generated a structure that is not a self avoid walk')
+
+
+    def _tour(self, start : float) -> None:
+        '''
+        One tour of the PERM: depth first growth of the chains starting from the first bond
+        ([0,0] -> [1,0], fixed by symmetry).
+        '''
+        seq = self.seq
+        n = self.n
+        path = [(0,0), (1,0)] # sites of the current chain
+        occ = {(0,0) : 0, (1,0) : 1} # site -> monomer index of the current chain
+        stack = [(2, 0., 0.)] # chains to continue: (length, ln weight, energy); they share the prefix of path
+        ln_2 = math.log(2)
+        ln_c_plus = math.log(self.c_plus)
+        ln_c_minus = math.log(self.c_minus)
+
+        while stack:
+            length, ln_W, en = stack.pop()
+            while len(path) > length: # back to the prefix of the chain
+                del occ[path.pop()]
+
+            if length == n:
+                self._record(en, path)
+                continue
+            if time.perf_counter() - start > self.time_limit:
+                return
+
+            x, y = path[-1]
+            sites = [] # free sites for the next monomer and their energy variation
+            for site in ((x+1,y),(x,y+1),(x-1,y),(x,y-1)):
+                if site not in occ:
+                    d_en = 0
+                    if seq[length] == 'H':
+                        s_x, s_y = site
+                        for nb in ((s_x+1,s_y),(s_x,s_y+1),(s_x-1,s_y),(s_x,s_y-1)):
+                            j = occ.get(nb)
+                            if j is not None and j != length-1 and seq[j] == 'H':
+                                d_en -= 1
+                    sites.append((site, d_en))
+            if not sites: # dead end: the chain is trapped
+                continue
+
+            factors = [math.exp(-d_en/self.T) for site,d_en in sites]
+            tot = sum(factors)
+            site, d_en = random.choices(sites, weights=factors)[0]
+            path.append(site)
+            occ[site] = length
+            length += 1
+            ln_W += math.log(tot) # Rosenbluth weight (in log, since it grows exponentially with the contacts)
+            en += d_en
+            self.ln_Z[length] = _log_add(self.ln_Z[length], ln_W)
+
+            ln_mean_W = self.ln_Z[length] - math.log(self.tours) # estimate of the mean weight at this length
+            if ln_W > ln_c_plus + ln_mean_W: # enrichment: two copies with half weight
+                stack.append((length, ln_W - ln_2, en))
+                stack.append((length, ln_W - ln_2, en))
+            elif ln_W < ln_c_minus + ln_mean_W: # pruning with probability 1/2, the survivors double the weight
+                if random.random() < 0.5:
+                    stack.append((length, ln_W + ln_2, en))
+            else:
+                stack.append((length, ln_W, en))
+
+
+    def _record(self, en : float, path : list) -> None:
+        '''
+        Record a complete chain, keeping the best keep structures (different ones) ordered by energy.
+        '''
+        self.chains += 1
+        if len(self.best) == self.keep and en >= self.best[-1][0]:
+            return
+        struct = [list(site) for site in path]
+        if any(struct == other for e,other in self.best if e == en):
+            return
+        self.best.append((en, struct))
+        self.best.sort(key=lambda b: b[0])
+        del self.best[self.keep:]
+        self.best_energy = self.best[0][0]
+
+
+def _log_add(ln_a : float, ln_b : float) -> float:
+    '''
+    ln(a + b) from ln a and ln b, without overflows.
+    '''
+    if ln_a < ln_b:
+        ln_a, ln_b = ln_b, ln_a
+    if ln_b == -math.inf:
+        return ln_a
+    return ln_a + math.log1p(math.exp(ln_b - ln_a))
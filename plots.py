@@ -4,41 +4,82 @@
 """
 from protein_class import Protein
 import matplotlib.pyplot as plt
-from matplotlib.animation import PillowWriter
 import numpy as np
-import utils
+from trajectory import TrajectoryReader
+from history import reduce_windows, minmax_indices
+import render
+import os
 
-def view(protein : Protein, save = True, tit = None):
+
+OUTPUT_DIR = 'data' # folder where the plots are saved
+PLOT_POINTS = 2000 # max buckets of the plotted series (2 points each, about the pixels of the figure)
+
+def view(protein : Protein, save = True, tit = None, filename = 'prot_view.png'):
     '''
     Function to plot the protein structure with matplotlib.
     As first argument the protein class instance of the desired protein is needed.
     Title can be optionally inserted.
-    If save == True the plot will be also saved as pdf.
+    If save == True the plot will be also saved as png (filename in the OUTPUT_DIR folder).
     '''
-    x = [] # x coordinates of the monomers (ordered)
-    y = [] # y coordinates of the monomers (ordered)
-    
+    _view_struct(protein.struct, protein.seq, tit, protein.energy(), protein.compactness(), protein.max_comp)
+    if save:
+        plt.savefig(os.path.join(OUTPUT_DIR, filename), format="png", bbox_inches="tight", dpi = 200)
+
+
+def _view_struct(struct, seq : str, tit : str, en : float, comp : float, max_comp : float) -> None:
+    '''
+    Plot a structure of the square lattice with its energy and compactness (normalised to max_comp).
+    The monomers are drawn as two scatter collections (H and P markers), not with one artist per monomer,
+    so the time of the plot does not depend on the length of the protein.
+    '''
+    struct = np.asarray(struct) # works both for list and numpy structures
+    x = struct[:,0] # x coordinates of the monomers (ordered)
+    y = struct[:,1] # y coordinates of the monomers (ordered)
+    h = np.array([mon == 'H' for mon in seq])
+
     fig, ax = plt.subplots()
-    for i in range(protein.n):
-        x.append(protein.struct[i][0])
-        y.append(protein.struct[i][1])    
     ax.plot(x,y, alpha = 0.5)
-    for i, coord in enumerate(protein.struct):
-        ax.scatter(x[i], y[i], marker='$'+protein.seq[i]+'$', s=20, color = 'red')
+    ax.scatter(x[h], y[h], marker='$H$', s=20, color = 'red')
+    ax.scatter(x[~h], y[~h], marker='$P$', s=20, color = 'red')
     ax.set_xlim(min(x)-6,max(x)+6)
     ax.set_ylim(min(y)-6,max(y)+6)
     ax.grid(alpha=0.2)
     if tit is not None:
         ax.set_title(tit)
-    en = protein.energy()
-    comp = protein.compactness()
     string = f'Energy: {en}'
-    string_comp = f'Compactness: {comp/(max(protein.comp_evo)+10e-15):.2f}' # the +10e-15 is used for numerical stability (avoid division by 0)
+    string_comp = f'Compactness: {comp/(max_comp+10e-15):.2f}' # the +10e-15 is used for numerical stability (avoid division by 0)
     ax.text(0.01,0.99, string, ha='left', va='top', transform=ax.transAxes)
     ax.text(0.01,0.95, string_comp, ha='left', va='top', transform=ax.transAxes)
     plt.show(block=False)
+
+
+def view_3d(protein, save = True, tit = None, filename = 'prot_view_3d.png'):
+    '''
+    Function to plot the structure of a protein in the cubic lattice (Protein3D) with matplotlib.
+    Title can be optionally inserted.
+    If save == True the plot will be also saved as png (filename in the OUTPUT_DIR folder).
+    '''
+    x = protein.get_x_coordinates()
+    y = protein.get_y_coordinates()
+    z = protein.get_z_coordinates()
+    h = [mon == 'H' for mon in protein.seq]
+
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+    ax.plot(x, y, z, alpha = 0.5)
+    ax.scatter(np.compress(h, x), np.compress(h, y), np.compress(h, z), color = 'red', label = 'H')
+    ax.scatter(np.compress(np.logical_not(h), x), np.compress(np.logical_not(h), y), np.compress(np.logical_not(h), z),
+               color = 'blue', label = 'P')
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    ax.set_zlabel('z')
+    ax.legend()
+    if tit is not None:
+        ax.set_title(tit)
+    ax.text2D(0.01,0.99, f'Energy: {protein.energy()}', ha='left', va='top', transform=ax.transAxes)
+    plt.show(block=False)
     if save:
-        plt.savefig("data/prot_view.png", format="png", bbox_inches="tight", dpi = 200)
+        plt.savefig(os.path.join(OUTPUT_DIR, filename), format="png", bbox_inches="tight", dpi = 200)
 
 
 def view_min_en(protein, save = True):
@@ -47,29 +88,10 @@ def view_min_en(protein, save = True):
     As first argument the protein class instance of the desired protein is needed.
     The plot can be saved with save = True as pdf
     '''
-    x = [] # x coordinates of the monomers (ordered)
-    y = [] # y coordinates of the monomers (ordered)
-    
-    fig, ax = plt.subplots()
-    for i in range(protein.n):
-        x.append(protein.min_en_struct[i][0])
-        y.append(protein.min_en_struct[i][1])    
-    ax.plot(x,y, alpha = 0.5)
-    for i, coord in enumerate(protein.struct):
-        ax.scatter(x[i], y[i], marker='$'+protein.seq[i]+'$', s=20, color = 'red')
-    ax.set_xlim(min(x)-6,max(x)+6)
-    ax.set_ylim(min(y)-6,max(y)+6)
-    ax.grid(alpha=0.2)
-    en = min(protein.en_evo)
-    comp = protein.comp_evo[protein.en_evo.index(en)]
-    string = f'Energy: {en}'
-    string_comp = f'Compactness: {comp/(max(protein.comp_evo)+10e-15):.2f}' # + 10e-15 for numerical stability (avoid division by 0)
-    ax.text(0.01,0.99, string, ha='left', va='top', transform=ax.transAxes)
-    ax.text(0.01,0.95, string_comp, ha='left', va='top', transform=ax.transAxes)
-    ax.set_title('Min energy structure')
-    plt.show(block=False)
+    # compactness of the first structure with the min energy
+    _view_struct(protein.min_en_struct, protein.seq, 'Min energy structure', protein.min_en, protein.min_en_comp, protein.max_comp)
     if save:
-        plt.savefig("data/min_energy_view.png", format="png", bbox_inches="tight", dpi = 200)
+        plt.savefig(os.path.join(OUTPUT_DIR, 'min_energy_view.png'), format="png", bbox_inches="tight", dpi = 200)
 
             
 def view_max_comp(protein, save = True):
@@ -79,146 +101,181 @@ def view_max_comp(protein, save = True):
     The plot can be saved with save = True as pdf
 
     '''
-    x = [] # x coordinates of the monomers (ordered)
-    y = [] # y coordinates of the monomers (ordered)
-    
-    fig, ax = plt.subplots()
-    for i in range(protein.n):
-        x.append(protein.max_comp_struct[i][0])
-        y.append(protein.max_comp_struct[i][1])    
-    ax.plot(x,y, alpha = 0.5)
-    for i, coord in enumerate(protein.struct):
-        ax.scatter(x[i], y[i], marker='$'+protein.seq[i]+'$', s=20, color = 'red')
-    ax.set_xlim(min(x)-6,max(x)+6)
-    ax.set_ylim(min(y)-6,max(y)+6)
-    ax.grid(alpha=0.2)
-    ax.set_title('Max compactness structure')
-    comp = max(protein.comp_evo)
-    en = protein.en_evo[protein.comp_evo.index(comp)]
-    string = f'Energy: {en}'
-    string_comp = f'Compactness: {comp/(max(protein.comp_evo)+10e-15):.2f}' # the +10e-15 is used for numerical stability (avoid division by 0)
-    ax.text(0.01,0.99, string, ha='left', va='top', transform=ax.transAxes)
-    ax.text(0.01,0.95, string_comp, ha='left', va='top', transform=ax.transAxes)
-    plt.show(block=False)
+    # energy of the first structure with the max compactness
+    _view_struct(protein.max_comp_struct, protein.seq, 'Max compactness structure', protein.max_comp_en, protein.max_comp, protein.max_comp)
     if save:
-        plt.savefig("data/max_compactness_view.png", format="png", bbox_inches="tight", dpi = 200)
+        plt.savefig(os.path.join(OUTPUT_DIR, 'max_compactness_view.png'), format="png", bbox_inches="tight", dpi = 200)
 
     
 
 def plot_energy(protein, avg : int = 1, save = True) -> None:
     '''
-    plot the energy evolution of the system.
+    plot the energy evolution of the system, read from the records of protein.history.
     As first argument the protein class instance of the desired protein is needed.
+    If the history aggregates the windows, the band between the min and max energy of each window is also shown.
     The plot can be saved with save = True as pdf
 
     Parameters
     ----------
     avg : int, optional
-        The energy will be averaged every avg steps. The default is 1.
+        The energy will be averaged every avg records. The default is 1.
 
     Returns
     -------
     Plot
     '''
-    en_evo = np.array(protein.en_evo[1:].copy())
-    T = np.array(protein.T[1:])
-    x = np.arange(0, len(en_evo), avg)
-    try:
-        en_evo = en_evo.reshape(-1,avg).mean(axis=1)
-        T = T.reshape(-1,avg).mean(axis=1)
-    except:
-        print(f'Mean procedure skipped since the number of time steps is not a multiple of the avarage required: {avg}')
-    fig, ax = plt.subplots()
-    ax.set_title(f'Energy evolution of the system averaged by {avg} time steps')
-    ax.set_xlabel('Time step')
-    ax.set_ylabel('Energy', color = 'b')
-    ax.tick_params(axis='y', labelcolor='b')
-    ax.plot(x, en_evo, color ='b')
-    ax_tw = ax.twinx()
-    ax_tw.set_ylabel('T', color = 'r')
-    ax_tw.tick_params(axis='y', labelcolor='r')
-    ax_tw.plot(x, T, color = 'r')
-    fig.tight_layout()
-    plt.show(block=False)
+    _plot_history(protein.history, 'energy', 'Energy', avg)
     if save:
-        plt.savefig("data/energy_evolution.png", format="png", bbox_inches="tight", dpi = 200)
+        plt.savefig(os.path.join(OUTPUT_DIR, 'energy_evolution.png'), format="png", bbox_inches="tight", dpi = 200)
     
     
 def plot_compactness(protein, avg : int = 1, save = True) -> None:
     '''
-    plot the compactness evolution of the system.
+    plot the compactness evolution of the system (normalised to its max), read from the records of protein.history.
     As first argument the protein class instance of the desired protein is needed.
+    If the history aggregates the windows, the band between the min and max compactness of each window is also shown.
     The plot can be saved with save = True as pdf
 
     Parameters
     ----------
     avg : int, optional
-        The compactness will be averaged every avg steps. The default is 1.
+        The compactness will be averaged every avg records. The default is 1.
 
     Returns
     -------
     Plot
     '''
-    comp = np.array(protein.comp_evo[1:].copy())
-    comp = comp/max(comp)
-    T = np.array(protein.T[1:])
-    x = np.arange(0, len(comp), avg)
-    try:
-        comp = comp.reshape(-1,avg).mean(axis=1)
-        T = T.reshape(-1,avg).mean(axis=1)
-    except:
-        print(f'Mean procedure skipped since the number of time steps is not a multiple of the avarage required: {avg}')
+    _plot_history(protein.history, 'compactness', 'Compactness', avg, norm=True)
+    if save:
+        plt.savefig(os.path.join(OUTPUT_DIR, 'compactness_evolution.png'), format="png", bbox_inches="tight", dpi = 200)
+
+
+def _plot_history(history, field : str, label : str, avg : int, norm : bool = False) -> None:
+    '''
+    Plot a recorded series of the history (without the initial state) and the temperature against the step.
+    The records are averaged every avg (the last group can be shorter), then long series are downsampled to about
+    PLOT_POINTS buckets keeping the min and the max of each one (history.minmax_indices), so the plot of a run of
+    millions of steps keeps every peak but draws only a few thousand points.
+    '''
+    series = {'x' : history.step[1:], 'y' : getattr(history, field)[1:], 'T' : history.T[1:]}
+    if history.aggregate:
+        series['low'] = getattr(history, field + '_min')[1:]
+        series['high'] = getattr(history, field + '_max')[1:]
+    scale = (series['high'] if history.aggregate else series['y']).max(initial=0) if norm else 1
+    scale = scale or 1 # avoid division by 0
+    reduce = {'x' : 'last', 'y' : 'mean', 'T' : 'mean', 'low' : 'min', 'high' : 'max'} # reduction of each group of avg records
+    series = {key : reduce_windows(val, avg, reduce[key]) for key,val in series.items()}
+
+    band = None
+    if history.aggregate: # band between the min and the max of each bucket, drawn on the whole bucket
+        size = max(1, -(-len(series['x'])//PLOT_POINTS))
+        if size == 1:
+            band = (series['x'], series['low'], series['high'])
+        else:
+            band = (np.stack((series['x'][::size], reduce_windows(series['x'], size, 'last')), axis=1).ravel(),
+                    np.repeat(reduce_windows(series['low'], size, 'min'), 2),
+                    np.repeat(reduce_windows(series['high'], size, 'max'), 2))
+    indices = minmax_indices(series['y'], PLOT_POINTS)
+    x, y, T = series['x'][indices], series['y'][indices], series['T'][indices]
+
     fig, ax = plt.subplots()
-    ax.set_title(f'Compactness evolution of the system averaged by {avg} time steps')
+    ax.set_title(f'{label} evolution of the system averaged by {avg*history.stride} time steps')
     ax.set_xlabel('Time step')
-    ax.set_ylabel('Compactness', color = 'b')
+    ax.set_ylabel(label, color = 'b')
     ax.tick_params(axis='y', labelcolor='b')
-    ax.plot(x, comp, color ='b')
+    if band is not None:
+        ax.fill_between(band[0], band[1]/scale, band[2]/scale, color = 'b', alpha = 0.2, linewidth = 0)
+    ax.plot(x, y/scale, color ='b')
     ax_tw = ax.twinx()
     ax_tw.set_ylabel('T', color = 'r')
     ax_tw.tick_params(axis='y', labelcolor='r')
     ax_tw.plot(x, T, color = 'r')
     fig.tight_layout()
     plt.show(block=False)
-    if save:
-        plt.savefig("data/compactness_evolution.png", format="png", bbox_inches="tight", dpi = 200)
 
 
-def create_gif(protein):
+def create_gif(protein, workers : int = 1):
     '''
     Function to create a gif of the evolution process.\n
     As first argument the protein class instance of the desired protein is needed.\n
     The gif will have more o less 100 frames with fps = 5.
+    If a trajectory has been saved during the evolution (protein.trajectory, already closed) the frames are read
+    from its file, otherwise the structures kept in protein.gif_struct are used.
+    The frames are rendered by render.render_frames (artists built once, optionally in a pool of workers processes).
     The gif will not be visible with the other plots but it will be saved in the /data folder.\n
     To control the creation or not of the gif you can set TRUE or FALSE for the variable 'create_gif' in the configuration file.
     '''
     print('---------------')
     print('Creating gif...')
 
-    fig, ax = plt.subplots()
+    steps, structures = _evolution_frames(protein)
+    frames = render.render_frames(protein.seq, structures, dpi=200, workers=workers, reporter=protein.reporter)
+    render.save_gif(frames, os.path.join(OUTPUT_DIR, 'evo.gif'), fps=5)
+    
+    print('Gif created')
+    print('-----------')
 
-    writer =  PillowWriter(fps=5)
 
-    with writer.saving(fig, 'data/evo.gif', 200):
+def save_snapshots(protein, workers : int = 1) -> list:
+    '''
+    Save the structures of the frames of the gif as png files structure_step_{step}.png in the snapshots
+    subfolder of OUTPUT_DIR (rendered as in create_gif).
 
-        for i,structure in enumerate(protein.gif_struct):
-            utils.progress_bar(i+1, len(protein.gif_struct))
+    Returns
+    -------
+    list
+        Names of the saved files.
+    '''
+    steps, structures = _evolution_frames(protein)
+    return render.save_snapshots(protein.seq, structures, steps, os.path.join(OUTPUT_DIR, 'snapshots'), workers=workers)
 
-            x = []
-            y = []
 
-            for i in range(protein.n):
-                x.append(structure[i][0])
-                y.append(structure[i][1])
-            ax.plot(x,y, alpha = 0.5)
-            for i, coord in enumerate(structure):
-                ax.scatter(x[i], y[i], marker='$'+protein.seq[i]+'$', s=20, color = 'red')
-            ax.set_xlim(min(x)-6,max(x)+6)
-            ax.set_ylim(min(y)-6,max(y)+6)
-            ax.grid(alpha=0.2)
+def _evolution_frames(protein) -> tuple:
+    '''
+    Steps and structures of about 100 frames of the evolution, read from the trajectory file if saved
+    (one frame at a time), otherwise from protein.gif_struct.
+    '''
+    if protein.trajectory is not None:
+        reader = TrajectoryReader(protein.trajectory.path)
+        frames = [reader[k] for k in range(0, len(reader), max(1, len(reader)//100))]
+        return [frame[0] for frame in frames], [frame[3] for frame in frames]
+    stride = max(1, int(protein.steps/100)) # stride of the structures kept in gif_struct
+    return [k*stride + 1 for k in range(len(protein.gif_struct))], protein.gif_struct
 
-            writer.grab_frame()
-            ax.clear()
-    
-    print('Gif created')
-    print('-----------')
\ No newline at end of file
+
+def plot_thermodynamics(wl, T_max : float = 3., save = True) -> None:
+    '''
+    Plot the density of states estimated by the Wang-Landau sampling and the mean energy and specific heat
+    computed from it as functions of the temperature.
+    As first argument the WangLandau class instance already run is needed.
+    The plot can be saved with save = True as png
+
+    Parameters
+    ----------
+    T_max : float, optional
+        Max temperature of the curves. The default is 3.
+
+    Returns
+    -------
+    Plot
+    '''
+    T = np.linspace(0.05, T_max, 300)
+    thermo = wl.thermodynamics(T)
+    fig, (ax_g, ax) = plt.subplots(1, 2, figsize=(11, 4))
+    ax_g.set_title('Density of states')
+    ax_g.set_xlabel('Energy')
+    ax_g.set_ylabel('ln g(E)')
+    ax_g.plot(wl.energies, wl.log_dos, 'o-')
+    ax.set_title('Thermodynamics from the density of states')
+    ax.set_xlabel('T')
+    ax.set_ylabel('Mean energy', color = 'b')
+    ax.tick_params(axis='y', labelcolor='b')
+    ax.plot(T, thermo['U'], color = 'b')
+    ax_tw = ax.twinx()
+    ax_tw.set_ylabel('Specific heat', color = 'r')
+    ax_tw.tick_params(axis='y', labelcolor='r')
+    ax_tw.plot(T, thermo['C'], color = 'r')
+    fig.tight_layout()
+    plt.show(block=False)
+    if save:
+        plt.savefig(os.path.join(OUTPUT_DIR, 'thermodynamics.png'), format="png", bbox_inches="tight", dpi = 200)
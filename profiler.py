@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+import cProfile
+import pstats
+import tracemalloc
+import time
+import io
+
+
+class EvolutionProfiler():
+    '''
+    Opt-in instrumentation of Protein.evolution: cumulative time of each phase of the steps and counters of the
+    proposals, optionally with a cProfile of the whole evolution and the tracemalloc peak and top allocations.\n
+    The phases are:
+        proposal: generation of the valid fold (the multiple try step as a whole, batches included)
+        collisions: folds discarded at a collision with the fixed monomers, and redrawn
+        energy: contacts broken and created by the fold
+        acceptance: Metropolis test and update of the structure, occupancy and contacts
+        bookkeeping: compactness, best structures, history, trajectory, gif and checkpoints
+        progress: report of the progress
+    The evolution measures a phase only if a profiler is attached (Protein.profiler is not None), so without it
+    the cost is a comparison with None per phase. The counters are taken from Protein.counter and the accepted
+    moves at the end, with no cost during the steps.
+
+    Parameters
+    ----------
+    cprofile : bool, optional
+        If True the evolution is also profiled by cProfile. The default is False.
+    tracemalloc : bool, optional
+        If True the memory allocations are traced by tracemalloc. The default is False.
+    top : int, optional
+        Number of functions (cProfile) and lines (tracemalloc) reported. The default is 20.
+    '''
+
+    PHASES = ('proposal', 'collisions', 'energy', 'acceptance', 'bookkeeping', 'progress')
+
+    def __init__(self, cprofile : bool = False, tracemalloc : bool = False, top : int = 20) -> None:
+        self.cprofile = cprofile
+        self.tracemalloc = tracemalloc
+        self.top = top
+        self.times = dict.fromkeys(self.PHASES, 0.) # cumulative seconds of each phase
+        self.wall_time = 0. # seconds of the evolutions profiled
+        self.steps = 0
+        self.proposals = 0 # folds generated, the ones discarded at a collision included
+        self.collisions = 0 # folds discarded at a collision
+        self.metropolis_rejections = 0 # valid folds rejected by the Metropolis test
+        self.accepted = 0
+        self.functions = [] # top functions by cumulative time (cProfile)
+        self.memory = {} # peak and top allocations (tracemalloc)
+        self._profile = None
+        self._start = 0.
+
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_profile'] = None # the active cProfile is not saved in the checkpoints
+        return state
+
+
+    def lap(self, phase : str, t : float) -> float:
+        '''
+        Add the time from t to now to the phase and return now, the start of the next phase.
+        '''
+        now = time.perf_counter()
+        self.times[phase] += now - t
+        return now
+
+
+    def start(self) -> None:
+        '''
+        Start the profiling of an evolution (cProfile and tracemalloc, if required).
+        '''
+        if self.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._start = time.perf_counter()
+
+
+    def stop(self, steps : int, proposals : int, valid : int, accepted : int) -> None:
+        '''
+        Stop the profiling of an evolution of steps steps, with proposals folds generated (Protein.counter), valid
+        of them without collisions (one per step, multiple_try with the multiple try Metropolis) and accepted
+        moves, collecting the cProfile and tracemalloc results.
+        '''
+        self.wall_time += time.perf_counter() - self._start
+        self.steps += steps
+        self.proposals += proposals
+        self.collisions += proposals - valid
+        self.metropolis_rejections += steps - accepted
+        self.accepted += accepted
+        if self._profile is not None:
+            self._profile.disable()
+            stats = pstats.Stats(self._profile, stream=io.StringIO()).sort_stats('cumulative')
+            self.functions = []
+            for (filename, line, name),(_, calls, tottime, cumtime, _) in stats.stats.items():
+                self.functions.append({'function' : f'{filename}:{line}({name})', 'calls' : calls,
+                                       'tottime' : tottime, 'cumtime' : cumtime})
+            self.functions = sorted(self.functions, key=lambda f: f['cumtime'], reverse=True)[:self.top]
+            self._profile = None
+        if self.tracemalloc and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+            tracemalloc.stop()
+            self.memory = {'current_bytes' : current, 'peak_bytes' : peak,
+                           'top' : [{'line' : str(stat.traceback), 'bytes' : stat.size, 'blocks' : stat.count}
+                                    for stat in top]}
+
+
+    def report(self) -> dict:
+        '''
+        Report of the profiling: seconds and fraction of the wall time of each phase (other is the time not
+        measured by any phase), counters and, if collected, the cProfile functions and tracemalloc allocations.
+        '''
+        measured = sum(self.times.values())
+        times = dict(self.times, other=max(self.wall_time - measured, 0.))
+        return {
+            'wall_time' : self.wall_time,
+            'steps' : self.steps,
+            'us_per_step' : 1e6*self.wall_time/self.steps if self.steps else 0.,
+            'times' : times,
+            'fractions' : {phase : t/self.wall_time if self.wall_time else 0. for phase,t in times.items()},
+            'proposals' : self.proposals,
+            'collisions' : self.collisions,
+            'metropolis_rejections' : self.metropolis_rejections,
+            'accepted' : self.accepted,
+            'functions' : self.functions,
+            'memory' : self.memory,
+        }
+
+
+    def print_report(self) -> None:
+        '''
+        Print the time of each phase, the counters and the top functions and allocations.
+        '''
+        report = self.report()
+        print(f"Profile of {report['steps']} steps in {report['wall_time']:.3f} s ({report['us_per_step']:.1f} us/step)")
+        for phase,t in report['times'].items():
+            print(f"  {phase:<12} {t:10.4f} s  {100*report['fractions'][phase]:5.1f} %")
+        print(f"  {report['proposals']} folds proposed, {report['collisions']} collisions, "
+              f"{report['metropolis_rejections']} Metropolis rejections, {report['accepted']} accepted")
+        for f in report['functions']:
+            print(f"  {f['cumtime']:10.4f} s  {f['calls']:9d} calls  {f['function']}")
+        if report['memory']:
+            print(f"  memory peak {report['memory']['peak_bytes']/2**20:.2f} MiB")
+            for stat in report['memory']['top']:
+                print(f"  {stat['bytes']/2**10:10.1f} KiB  {stat['line']}")
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+import time
+import json
+import sys
+import utils
+
+
+class Reporter():
+    '''
+    Progress reporter of a loop (evolution, gif creation, ...). The loop calls start with the total number of steps,
+    update at each step and finish at the end. The updates are rate limited: the output is produced at most once
+    every interval seconds (and at the last step), so the cost of a step without output is a time comparison.\n
+    This base class does not print anything (silent mode, e.g. for the batch workers); the subclasses
+    implement report.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Min time in seconds between two reports. The default is 0.2.
+    '''
+
+    def __init__(self, interval : float = 0.2) -> None:
+        self.interval = interval
+        self.total = 0
+        self.first = 0
+        self._start = self._next = 0.
+
+
+    def start(self, total : int, first : int = 0) -> None:
+        '''
+        Start the report of a loop of total steps, starting after the step first (e.g. a resumed evolution).
+        '''
+        self.total = total
+        self.first = first
+        self._start = time.perf_counter()
+        self._next = self._start + self.interval
+
+
+    def update(self, step : int, accepted : int = 0, en : float = None, best : float = None, T : float = None) -> None:
+        '''
+        Update the progress at the step (1 to total): number of accepted moves, current and best energy and
+        temperature, when available. The report is done only if interval seconds passed from the last one.
+        '''
+        now = time.perf_counter()
+        if now >= self._next or step == self.total:
+            self._next = now + self.interval
+            self.report(step, now - self._start, accepted, en, best, T)
+
+
+    def report(self, step : int, elapsed : float, accepted : int, en : float, best : float, T : float) -> None:
+        pass
+
+
+    def finish(self) -> None:
+        '''
+        End the report of the loop.
+        '''
+        pass
+
+
+class BarReporter(Reporter):
+    '''
+    Progress bar on terminal (utils.progress_bar), redrawn at most once every interval seconds.
+    '''
+
+    def report(self, step : int, elapsed : float, accepted : int, en : float, best : float, T : float) -> None:
+        utils.progress_bar(step, self.total)
+
+
+class LogReporter(Reporter):
+    '''
+    Structured report: one json line for each report with the step, the steps per second, the acceptance rate,
+    the current and best energy and the temperature (the ones not available are null).
+
+    Parameters
+    ----------
+    interval : float, optional
+        Min time in seconds between two reports. The default is 5.
+    stream : file, optional
+        Stream where the lines are written. The default is sys.stdout.
+    '''
+
+    def __init__(self, interval : float = 5., stream = None) -> None:
+        super().__init__(interval)
+        self.stream = stream
+
+
+    def report(self, step : int, elapsed : float, accepted : int, en : float, best : float, T : float) -> None:
+        line = {
+            'step' : step,
+            'total' : self.total,
+            'steps_per_second' : (step - self.first)/elapsed if elapsed > 0 else None,
+            'acceptance' : accepted/(step - self.first) if step > self.first else None,
+            'energy' : en,
+            'best_energy' : best,
+            'T' : T,
+        }
+        stream = self.stream if self.stream is not None else sys.stdout
+        print(json.dumps(line), file=stream, flush=True)
+
+
+REPORTERS = {'silent' : Reporter, 'bar' : BarReporter, 'log' : LogReporter}
+
+
+def get_reporter(kind : str = 'bar', interval : float = None) -> Reporter:
+    '''
+    Build a reporter by name: 'silent', 'bar' or 'log'.
+
+    Parameters
+    ----------
+    kind : str, optional
+        Type of reporter. The default is 'bar'.
+    interval : float, optional
+        Min time in seconds between two reports, if None the default of the reporter is used. The default is None.
+
+    Returns
+    -------
+    Reporter
+        The reporter.
+    '''
+    if kind not in REPORTERS:
+        raise ValueError(f'Progress {kind} not recognized, it must be silent, bar or log')
+    return REPORTERS[kind]() if interval is None else REPORTERS[kind](interval)
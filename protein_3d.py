@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from protein_class import Protein
+from itertools import permutations, product
+import random
+import time
+
+
+# the lattice sites are hashed as packed integers: key = (x*STRIDE + y)*STRIDE + z, unique for |x|,|y|,|z| < STRIDE/2
+STRIDE = 1 << 21
+NEIG_OFFSETS = (1, -1, STRIDE, -STRIDE, STRIDE*STRIDE, -STRIDE*STRIDE) # key offsets of the 6 neighbours of a site
+
+# the 48 rotations/reflections of the cubic lattice as (permutation of the axes, signs): (x,y,z) -> sign*(coords[perm])
+CUBIC_SYMMETRIES = [(perm, signs) for perm in permutations(range(3)) for signs in product((1, -1), repeat=3)]
+PIVOT_SYMMETRIES = [sym for sym in CUBIC_SYMMETRIES if sym != ((0, 1, 2), (1, 1, 1))] # the identity is excluded
+
+
+def pack(x : int, y : int, z : int) -> int:
+    '''
+    Packed integer key of the lattice site (x,y,z).
+    '''
+    return (x*STRIDE + y)*STRIDE + z
+
+
+def linear_struct_3d(seq : str) -> list:
+    '''
+    Create the linear structure (along the x axis) of the length of the input sequence in the cubic lattice.
+
+    Parameters
+    ----------
+    seq : str
+        Sequence which need a linear structure
+
+    Returns
+    -------
+    list :
+        Linear structure
+    '''
+    print('\033[43mLinear initial structure assumed \033[0;0m')
+    return [[i,0,0] for i in range(len(seq))]
+
+
+class Protein3D(Protein):
+    '''
+    Protein in the cubic lattice, with the same interface and Metropolis evolution of the Protein class.\n
+    The structure is a list of [x,y,z] and the occupied sites are hashed as packed integers, so each neighbour
+    lookup is an integer sum and a dict access. The folds are pivots of the tail with one of the 47 non trivial
+    elements of the symmetry group of the cube (48 rotations/reflections), or the move of a corner monomer on the
+    opposite corner of its square. Both are rigid moves, so the energy is updated with the cross contacts only.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def _linear_struct(self) -> list:
+        '''
+        Linear initial structure along the x axis of the cubic lattice.
+        '''
+        return linear_struct_3d(self.seq)
+
+
+    def _check_struct(self, struct : list) -> None:
+        '''
+        Check that the structure given in the configuration has the length of the sequence and x, y, z coordinates.
+        '''
+        if len(struct) != self.n or any(len(mon) != 3 for mon in struct):
+            raise AssertionError('The structure must have the length of the sequence and x, y, z coordinates')
+
+
+    def _lattice_setup(self) -> None:
+        '''
+        Only pivot and corner moves in the cubic lattice: no pull moves and no multiple try Metropolis (its batched
+        candidates are square lattice folds), so no conformation cache.
+        '''
+        self.pivot_weight = 1.
+        self.pull_weight = 0.
+        self.multiple_try = 1
+        self.cache = None
+
+
+    def _site_keys(self, struct : list) -> list:
+        '''
+        Keys of the occupancy map of the sites of the structure: the sites packed as integers (see pack).
+        '''
+        return [pack(x, y, z) for x,y,z in struct]
+
+    def _neighbour_keys(self, key : int) -> tuple:
+        '''
+        Keys of the 6 sites next to the packed site key.
+        '''
+        return tuple(key + off for off in NEIG_OFFSETS)
+
+
+    def get_neig_of(self, i : int) -> str:
+        '''
+        Function to see which are the neighbors of the i-th monomer of the protein sequence.
+        The bounded monomer are not considered neighbors.\n
+        The function return a string with the type of neighbour monomers: H/P.
+
+        Parameters
+        ----------
+        i : int
+            Monomer position in the sequence for which we want the neighbors.
+
+        Returns
+        -------
+        str
+            Neighbors type H/P.
+        '''
+        neig = ''
+        key = pack(*self.struct[i])
+        for off in NEIG_OFFSETS:
+            ind = self._occupancy.get(key + off)
+            if ind is not None and abs(ind - i) != 1:
+                neig += self.seq[ind]
+        return neig
+
+
+    def get_x_coordinates(self) -> list:
+        '''
+        x coordinates of the monomers (ordered).
+        '''
+        return [mon[0] for mon in self.struct]
+
+    def get_y_coordinates(self) -> list:
+        '''
+        y coordinates of the monomers (ordered).
+        '''
+        return [mon[1] for mon in self.struct]
+
+    def get_z_coordinates(self) -> list:
+        '''
+        z coordinates of the monomers (ordered).
+        '''
+        return [mon[2] for mon in self.struct]
+
+
+    def _cross_contacts(self, struct : list, start : int, stop : int) -> list:
+        '''
+        List the contacts (i,j), i<j, between the monomers from start to stop-1, placed as in struct, and the other
+        monomers, placed as in the current structure (backbone bonds excluded).
+        '''
+        pairs = []
+        occ = self._occupancy
+
+        for i in range(start, stop):
+            x,y,z = struct[i]
+            key = pack(x, y, z)
+            for off in NEIG_OFFSETS:
+                j = occ.get(key + off)
+                if j is not None and (j < start or j >= stop) and abs(j - i) != 1:
+                    pairs.append((j,i) if j < i else (i,j))
+
+        return pairs
+
+
+    def accept_fold(self, fold) -> None:
+        '''
+        Accept a fold generated by propose_fold: the occupancy map and the contact set are updated only for
+        the moved monomers.
+
+        Parameters
+        ----------
+        fold : Fold
+            Fold proposed for the current structure.
+        '''
+        occ = self._occupancy
+        for x,y,z in self._struct[fold.start:fold.stop]:
+            del occ[pack(x, y, z)]
+        for i,(x,y,z) in enumerate(fold.struct[fold.start:fold.stop], fold.start):
+            occ[pack(x, y, z)] = i
+        self._struct = fold.struct
+        self._contacts.difference_update(fold.old_pairs)
+        self._contacts.update(fold.new_pairs)
+        if self._hh is not None:
+            self._hh += fold.d_hh
+
+
+    def random_fold(self) -> list:
+        '''
+        Randomly choose a monomer in the protein (exluding the first and the last) and fold the tail after it with
+        a random element of the cubic symmetry group, or move it on the opposite corner if it is in a corner
+        (probability 1/48). The proposal is discarded at the first collision and repeated until a valid structure
+        is found.
+
+        Returns
+        -------
+        list
+            The new protein structure randomly folded (valid).
+        '''
+        c = 0 # counter of the number of folding until a valid sequence is founded
+        struct = self.struct
+        occ = self._occupancy
+        prof = self.profiler
+        if prof is not None: t = time.perf_counter()
+
+        while True:
+            c += 1
+            if prof is not None and c > 1: t = prof.lap('collisions', t) # the previous fold was discarded
+            index = random.randint(1, self.n-2)
+            x_p, y_p, z_p = struct[index-1]
+            x, y, z = struct[index]
+            x_f, y_f, z_f = struct[index+1]
+
+            corner = abs(x_p-x_f) + abs(y_p-y_f) + abs(z_p-z_f) == 2 and (x_p-x_f, y_p-y_f, z_p-z_f).count(0) == 1
+            if corner and random.randint(1, 48) == 48: # move on the opposite corner of the square
+                site = [x_p+x_f-x, y_p+y_f-y, z_p+z_f-z]
+                if pack(*site) in occ:
+                    continue
+                start, stop, tail = index, index+1, [site]
+                break
+
+            (a, b, d), (s_a, s_b, s_d) = random.choice(PIVOT_SYMMETRIES)
+            tail = []
+            for mon in struct[index+1:]: # the monomers are transformed one at a time, up to the first collision
+                rel = (mon[0]-x, mon[1]-y, mon[2]-z)
+                site = [x + s_a*rel[a], y + s_b*rel[b], z + s_d*rel[d]]
+                j = occ.get(pack(*site))
+                if j is not None and j <= index:
+                    tail = None
+                    break
+                tail.append(site)
+            if tail is None: # collision
+                continue
+            start, stop = index+1, self.n
+            break
+
+        self.counter.append(c) # counter of the number of foldings
+        self._moved = (start, stop, True) # monomers moved rigidly by the fold
+
+        new_struct = struct[:start] + tail + struct[stop:]
+        if prof is not None: prof.lap('proposal', t)
+        return new_struct
@@ -2,12 +2,24 @@
 """
 @author: Tommaso Giacometti
 """
-import matplotlib.pyplot as plt
-from matplotlib.animation import PillowWriter
 import random
 import utils
+import progress
 import math
 import numpy as np
+import pickle
+import os
+import time
+from collections import namedtuple
+from array import array
+from history import History
+from cache import ConformationCache
+from profiler import EvolutionProfiler
+
+
+# fold proposed by Protein.propose_fold: new structure, moved monomers (start to stop-1),
+# contacts broken and created by the fold and variation of the number of H-H contacts
+Fold = namedtuple('Fold', ['struct', 'start', 'stop', 'old_pairs', 'new_pairs', 'd_hh'])
 
 
 class Protein():
@@ -26,6 +38,7 @@ class Protein():
 
     def __init__(self, config : utils.Configuration) -> None:
         
+        self._contacts = set() # topological contacts (i,j) with i<j, kept in sync with self.struct
         if utils.is_valid_sequence(config.seq): # check that the sequence is valid (contains only HP)
             self.seq = config.seq
         else:
@@ -35,13 +48,15 @@ class Protein():
         self.n = len(config.seq) # length of the sequence
         
         if not config.use_struct: # linear structur assumed if struct is not specified as input
-            self.struct = utils.linear_struct(self.seq)
+            self.struct = self._linear_struct()
         else:
-            try: # check that sequence has the right length
-                assert len(config.struct) == self.n
-            except:
-                raise AssertionError('The lengths of the sequence and the structure are not the same')
+            self._check_struct(config.struct) # check that sequence has the right length
             self.struct = config.struct
+
+        # contiguous (n,2) integer array, folded with the vectorised tail_fold_array. It is not faster than the list:
+        # the occupancy map and the contacts need the sites as Python ints, so the moved rows are converted at each step
+        if config.engine == 'array':
+            self.struct = np.array(self.struct, dtype=int)
         
         if not utils.is_valid_struct(self.struct): # check that the sequence is valid
             raise AssertionError('The structure is not a self avoid walk (SAW) or the distances between consecutive points are different from 1')
@@ -51,14 +66,135 @@ class Protein():
         self.T_in = config.T
         self.steps = config.folds
         self.gif = config.gif
-        self.gif_struct = []
+        self.debug = config.debug # if True the incremental energy is checked against the full computation
+        self.pivot_weight = config.pivot_weight # weight of the tail_fold moves (pivots and diagonal) in the move mix
+        self.pull_weight = config.pull_weight # weight of the pull moves in the move mix
+        self.multiple_try = config.multiple_try # candidates of each step (1 = plain Metropolis, >1 = multiple try Metropolis)
+        # LRU cache of the validity and H-H contacts of the batched folds, keyed on the canonical conformation (None = no cache)
+        self.cache = ConformationCache(config.cache_size) if config.cache_size else None
+        self.record_stride = config.record_stride # steps between two records of the energy, compactness and T
+        self.record_aggregate = config.record_aggregate # if True record also min, mean and max of each window
+        self.trajectory = None # optional trajectory.TrajectoryWriter where the structures are saved during the evolution
+        self.checkpoint = config.checkpoint # file of the checkpoints of the evolution (None = no checkpoints)
+        self.checkpoint_interval = config.checkpoint_interval # steps between two checkpoints
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval) # progress of the evolution
+        # per-phase timers and counters of the evolution (None = not profiled, see profiler.EvolutionProfiler)
+        self.profiler = EvolutionProfiler(config.profile_cprofile, config.profile_tracemalloc) if config.profile else None
+
+        self._lattice_setup()
+        self.reset_records()
+
 
+    def _linear_struct(self) -> list:
+        '''
+        Linear initial structure of the lattice (used if the structure is not given in the configuration).
+        '''
+        return utils.linear_struct(self.seq)
+
+
+    def _check_struct(self, struct : list) -> None:
+        '''
+        Check the shape of the structure given in the configuration (the self avoiding walk is checked later).
+        '''
+        if len(struct) != self.n:
+            raise AssertionError('The lengths of the sequence and the structure are not the same')
+
+
+    def _lattice_setup(self) -> None:
+        '''
+        Restrict the parameters of the evolution to the moves available in the lattice (all of them in the square one).
+        '''
+        pass
+
+
+    def reset_records(self) -> None:
+        '''
+        Initialise the records of the evolution (energy, compactness, temperature and best structures)
+        starting from the current structure.
+        '''
         self.min_en_struct = self.struct # variable to record the min energy structure (for now is the only structure)
-        self.en_evo = [self.energy()] # list to keep track of the energy evolution
-        self.T = [] # list to keep track of the temperature evolution
-        self.counter = [] # counter of number of folding per step
-        self.comp_evo = [self.compactness()] # list to keep track of the compactness evolution
+        self.min_en = self.energy() # running min energy (energy of min_en_struct)
+        self.counter = array('l') # counter of number of folding per step
         self.max_comp_struct = self.struct # variable to record the max compact structure (for now is the only structure)
+        self.max_comp = self.compactness() # running max compactness (compactness of max_comp_struct)
+        self.min_en_comp = self.max_comp # compactness of min_en_struct
+        self.max_comp_en = self.min_en # energy of max_comp_struct
+        self.history = History(self.steps, self.record_stride, self.record_aggregate) # energy, compactness and T evolution
+        self.gif_struct = []
+        self.evo_step = 0 # steps done by the current evolution (> 0 only for an interrupted evolution to resume)
+        self.evo_T = self.T_in # temperature of the current evolution
+        self.evo_first = 0 # step of the history at which the current evolution started
+
+
+    @property
+    def en_evo(self) -> np.ndarray:
+        '''
+        Recorded energy evolution (energy of the accepted state every record_stride steps).
+        '''
+        return self.history.energy
+
+    @property
+    def comp_evo(self) -> np.ndarray:
+        '''
+        Recorded compactness evolution (compactness of the accepted state every record_stride steps).
+        '''
+        return self.history.compactness
+
+    @property
+    def T(self) -> np.ndarray:
+        '''
+        Recorded temperature evolution (every record_stride steps).
+        '''
+        return self.history.T
+
+
+    @property
+    def struct(self) -> list:
+        '''
+        Protein structure: list of the x and y coordinates of each monomer, or (n,2) integer numpy array.\n
+        Assigning a new structure rebuilds the occupancy map used for the neighbours lookup (keyed on the sites
+        encoded by _site_keys) and the contacts.
+        '''
+        return self._struct
+
+    @struct.setter
+    def struct(self, struct : list) -> None:
+        self._struct = struct
+        keys = self._site_keys(struct)
+        self._occupancy = {key : i for i,key in enumerate(keys)} # lattice site -> monomer index
+        self._contacts = set()
+        for i,key in enumerate(keys): # each contact is found from its lower index monomer
+            for site in self._neighbour_keys(key):
+                j = self._occupancy.get(site)
+                if j is not None and j > i+1:
+                    self._contacts.add((i,j))
+        self._hh = None # number of H-H contacts, counted when the energy is required
+
+    def _site_keys(self, struct) -> list:
+        '''
+        Keys of the occupancy map of the sites of the structure: (x,y) tuples of Python ints.
+        '''
+        return [(x,y) for x,y in _rows(struct, 0, len(struct))]
+
+    def _neighbour_keys(self, key) -> tuple:
+        '''
+        Keys of the sites next to the site key in the lattice.
+        '''
+        x, y = key
+        return ((x-1,y),(x,y-1),(x+1,y),(x,y+1))
+
+    @property
+    def seq(self) -> str:
+        '''
+        HP sequence of the protein. Assigning a new sequence invalidates the H-H contacts counter.
+        '''
+        return self._seq
+
+    @seq.setter
+    def seq(self, seq : str) -> None:
+        self._seq = seq
+        self._hh = None
+        self._h = np.array([mon == 'H' for mon in seq]) # mask of the H monomers, for the batched folds
 
         
     def evolution(self):
@@ -66,7 +202,14 @@ class Protein():
         Let the system evolving for a certain number of steps. 
         New structures are accepted following the Metropolis algorithm (this function basically apply the Metropolis alg).\n
         All the parameters are taken from the initial configuration.\n
-        The energy evolution values, min energy structure and compactness conformations are saved.
+        The energy and compactness of the current (accepted) structure and the temperature are recorded in
+        self.history every record_stride steps, while the min energy and max compactness structures are
+        checked at each step. If a trajectory writer is attached to self.trajectory, the structure is appended
+        to it every trajectory.stride steps (and the structures for the gif are not kept in memory).\n
+        If self.checkpoint is a file, the whole state of the evolution (random generator included) is saved in it
+        every checkpoint_interval steps, and an evolution restored by load_checkpoint continues from the last
+        checkpoint exactly as it was never interrupted.\n
+        If self.profiler is set, the time of each phase of the steps is added to it (see profiler.EvolutionProfiler).
 
         Parameters
         ----------
@@ -76,44 +219,138 @@ class Protein():
         -------
         None.
         '''
-        T = self.T_in
-        self.T.append(T) # initial temperature
-        m = -T/self.steps # angolar coefficient for the annealing
+        m = -self.T_in/self.steps # angolar coefficient for the annealing
 
-        for i in range(self.steps):
-            utils.progress_bar(i+1,self.steps) # print the progress bar of the evolution
+        en = self.energy() # current protein energy, carried forward step by step
+        history = self.history
+        traj = self.trajectory
+        if self.evo_step == 0: # new evolution (otherwise it is resumed from a checkpoint)
+            self.evo_T = self.T_in
+            if not len(history): # initial state
+                history.record(0, en, self.compactness(), self.evo_T)
+                if traj is not None:
+                    traj.append(0, self.struct, en, self.evo_T)
+            self.evo_first = int(history.step[-1]) # step of the last record, the evolution continues from it
+        T = self.evo_T
+        first = self.evo_first
+        reporter = self.reporter
+        reporter.start(self.steps, self.evo_step)
+        accepted = 0 # accepted moves, for the acceptance rate reported
+        prof = self.profiler
+        if prof is not None:
+            folds, start_step = len(self.counter), self.evo_step # the proposals and steps of this evolution
+            prof.start()
 
+        for i in range(self.evo_step, self.steps):
             if self.annealing and T > 0.002 : T = m*(i - self.steps) # temperature decrease linearly w.r.t. the steps, if annealing is True
-            en = self.energy() # current protein energy
-            init_str = self.struct # current protein structure
-            self.struct = self.random_fold() # new structure is generated
-            new_en = self.energy() # the energy of the new structure is computed
-            
-            if new_en > en: # if the new energy is higher to the previus one, the new structure is accepted following the Metropolis alg
-                d_en = new_en - en # energy difference of the two states
-                r = random.uniform(0, 1)
-                p = math.exp(-d_en/T) # probability to accept the new structure
-                if r > p:
-                    self.struct = init_str # the new structure is not accepted (overwrite the initial structure)
+            if self.multiple_try > 1: # the fold is chosen among multiple_try candidates and accepted with the MTM rule
+                if prof is not None: t = time.perf_counter()
+                fold = self.multiple_try_fold(T)
+                if prof is not None: t = prof.lap('proposal', t)
+                accept = fold is not None
+                new_en = en - fold.d_hh if accept else en
+            else:
+                fold = self.propose_fold() # new structure is generated
+                if prof is not None: t = time.perf_counter() # proposal, collisions and energy are timed by propose_fold
+                new_en = en - fold.d_hh # only the contacts of the moved monomers are recomputed
+
+                accept = True
+                if new_en > en: # if the new energy is higher to the previus one, the new structure is accepted following the Metropolis alg
+                    d_en = new_en - en # energy difference of the two states
+                    r = random.uniform(0, 1)
+                    p = math.exp(-d_en/T) # probability to accept the new structure
+                    if r > p:
+                        accept = False # the new structure is not accepted (the current structure and contacts are left untouched)
+
+            if accept:
+                self.accept_fold(fold)
+                en = new_en
+                accepted += 1
+            if prof is not None: t = prof.lap('acceptance', t)
+
+            if self.debug: # validation of the incremental energy and contacts against the full computation
+                self._check_contacts(en)
                     
-            if new_en < min(self.en_evo): # to save the min enrergy and structure
+            comp = self.compactness()
+            if en < self.min_en: # to save the min enrergy and structure
+                self.min_en = en
                 self.min_en_struct = self.struct
-            self.en_evo.append(new_en) # record the energy evolution
-
-            self.comp_evo.append(self.compactness()) # save the compactness
-            if self.comp_evo[-1] > max(self.comp_evo[:-1]):
+                self.min_en_comp = comp
+            if comp > self.max_comp:
+                self.max_comp = comp
                 self.max_comp_struct = self.struct
+                self.max_comp_en = en
 
-            self.T.append(T) # record the T evolution
+            history.add(first + i+1, en, comp, T) # record the energy, compactness and T evolution
 
-            if self.gif:
+            if traj is not None:
+                if (first + i+1) % traj.stride == 0:
+                    traj.append(first + i+1, self.struct, en, T)
+            elif self.gif:
                 if i%(int(self.steps/100)) == 0:
                     self.gif_struct.append(self.struct)
+
+            if self.checkpoint is not None and (i+1) % self.checkpoint_interval == 0:
+                self.evo_step, self.evo_T = i+1, T
+                self.save_checkpoint(self.checkpoint)
+
+            if prof is not None: t = prof.lap('bookkeeping', t)
+            reporter.update(i+1, accepted, en, self.min_en, T) # rate limited report of the progress
+            if prof is not None: prof.lap('progress', t)
+
+        reporter.finish()
+        if prof is not None:
+            steps = self.steps - start_step
+            prof.stop(steps, sum(self.counter[folds:]), steps*self.multiple_try, accepted)
+        history.flush() # last incomplete window
+        self.evo_step = 0
+
+
+    def save_checkpoint(self, path : str) -> None:
+        '''
+        Save the state of the protein and of its evolution (structures, records, step, temperature, attached
+        trajectory) together with the state of the random generator. The file is written atomically: the
+        checkpoint is first written in a temporary file which then replaces the old one.
+
+        Parameters
+        ----------
+        path : str
+            File of the checkpoint.
+        '''
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'protein' : self, 'random_state' : random.getstate()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+    @staticmethod
+    def load_checkpoint(path : str):
+        '''
+        Load a protein saved by save_checkpoint and restore the state of the random generator, so that
+        calling evolution continues the interrupted evolution.
+
+        Parameters
+        ----------
+        path : str
+            File of the checkpoint.
+
+        Returns
+        -------
+        Protein
+            The protein (Protein or subclass) at the step of the checkpoint.
+        '''
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        random.setstate(state['random_state'])
+        return state['protein']
     
     
     def energy(self, e = 1.) -> float:
         '''
-        Function to compute the energy of the protein structure. The binding energy can be changed.
+        Function to compute the energy of the protein structure. The binding energy can be changed.\n
+        The H-H contacts are kept updated with the structure, so the energy is read from their counter.
 
         Parameters
         ----------
@@ -126,17 +363,237 @@ class Protein():
         float
             The energy of the protein structure.
         '''
-        count_h = 0 # counter of H-H neighbor pairs (exluding protein's backbone bonds)
-        
-        for i,seq in enumerate(self.seq):
-            if seq == 'H':
-                neig = self.get_neig_of(i) # string of neighbors of i-th monomer (exluding protein's backbone bonds)
-                count_h += neig.count('H') 
+        if self._hh is None:
+            self._hh = self._count_hh(self._contacts)
         
-        tot_en = -e*count_h/2 # total energy of the prot struct (/2 because each bond is counted twice)
+        tot_en = -e*self._hh # total energy of the prot struct
         return tot_en
     
     
+    def _moved_contacts(self, struct : list, start : int, stop : int, rigid : bool) -> list:
+        '''
+        List the contacts (i,j), i<j, that involve the monomers from start to stop-1 placed as in struct
+        (the other monomers are placed as in the current structure). If the segment is moved rigidly the contacts
+        inside it are not listed, since they cannot change.
+        '''
+        pairs = self._cross_contacts(struct, start, stop)
+        if not rigid:
+            segment = {(x,y) : i for i,(x,y) in enumerate(_rows(struct, start, stop), start)}
+            for (x,y),i in segment.items():
+                for site in ((x-1,y),(x,y-1),(x+1,y),(x,y+1)):
+                    j = segment.get(site)
+                    if j is not None and j > i+1:
+                        pairs.append((i,j))
+        return pairs
+
+
+    def _cross_contacts(self, struct : list, start : int, stop : int) -> list:
+        '''
+        List the contacts (i,j), i<j, between the monomers from start to stop-1, placed as in struct, and the other
+        monomers, placed as in the current structure (backbone bonds excluded).
+        '''
+        pairs = []
+        occ = self._occupancy # fixed monomers have the same site in both the structures
+
+        for i,(x,y) in enumerate(_rows(struct, start, stop), start):
+            for site in ((x-1,y),(x,y-1),(x+1,y),(x,y+1)):
+                j = occ.get(site)
+                if j is not None and (j < start or j >= stop) and abs(j - i) != 1:
+                    pairs.append((j,i) if j < i else (i,j))
+
+        return pairs
+
+
+    def _count_hh(self, pairs) -> int:
+        '''
+        Count the H-H contacts among the given pairs of monomers.
+        '''
+        seq = self.seq
+        return sum(1 for i,j in pairs if seq[i] == 'H' and seq[j] == 'H')
+
+
+    def propose_fold(self) -> 'Fold':
+        '''
+        Generate a new structure with random_fold and compute the contacts that the fold breaks and creates,
+        without changing the current structure. The energy difference of the fold is -d_hh (binding energy 1).
+
+        Returns
+        -------
+        Fold
+            The proposed fold, to be passed to accept_fold if accepted.
+        '''
+        new_struct = self.random_fold()
+        if self.profiler is not None: t = time.perf_counter()
+        start, stop, rigid = self._moved
+        old_pairs = self._moved_contacts(self.struct, start, stop, rigid) # contacts broken by the fold
+        new_pairs = self._moved_contacts(new_struct, start, stop, rigid) # contacts created by the fold
+        d_hh = self._count_hh(new_pairs) - self._count_hh(old_pairs) # variation of the H-H contacts
+        if self.profiler is not None: self.profiler.lap('energy', t)
+        return Fold(new_struct, start, stop, old_pairs, new_pairs, d_hh)
+
+
+    def multiple_try_fold(self, T : float):
+        '''
+        Step of the multiple try Metropolis (Liu, Liang and Wong 2000) at temperature T with multiple_try = K candidates.\n
+        K valid pivot/diagonal folds of the current structure x are generated and evaluated in vectorised batches
+        (see batch_tail_folds) and one of them, y, is selected with probability proportional to its weight exp(-E/T).
+        Then K-1 reference folds are generated from y and the move is accepted with probability min(1, W(y)/W(x)),
+        where W(y) is the sum of the weights of the candidates and W(x) the one of the reference folds plus x itself.
+        The weights are relative to the energy of x and summed with the log-sum-exp, so they do not overflow at low T.\n
+        The folds are proposed as in random_fold (repeated until a valid structure is found), so with K = 1 the step
+        is the one of the plain Metropolis.
+
+        Parameters
+        ----------
+        T : float
+            Temperature of the step.
+
+        Returns
+        -------
+        Fold or None
+            The accepted fold (to be passed to accept_fold), None if the move is rejected.
+        '''
+        k = self.multiple_try
+        x = np.asarray(self.struct)
+        hh = -self.energy() # H-H contacts of x (binding energy 1)
+
+        indices, methods, candidates, hh_cand = self.batch_tail_folds(x, k)
+        log_w = (hh_cand - hh)/T # log of the weights relative to x
+        log_w_max = log_w.max()
+        w = np.exp(log_w - log_w_max)
+        j = min(int(np.searchsorted(np.cumsum(w), random.random()*w.sum(), side='right')), k-1) # selected candidate
+        log_w_y = log_w_max + math.log(w.sum())
+
+        y = candidates[j]
+        hh_ref = self.batch_tail_folds(y, k-1, count=False)[3]
+        log_w_ref = np.append((hh_ref - hh)/T, 0.) # the last reference is x itself
+        log_w_ref_max = log_w_ref.max()
+        log_w_x = log_w_ref_max + math.log(np.exp(log_w_ref - log_w_ref_max).sum())
+        if log_w_y < log_w_x and random.random() >= math.exp(log_w_y - log_w_x):
+            return None
+
+        index = int(indices[j])
+        start, stop = (index, index+1) if methods[j] == 8 else (index+1, self.n)
+        tail = y[start:stop] if isinstance(self.struct, np.ndarray) else y[start:stop].tolist()
+        new_struct = self._new_struct(start, stop, tail)
+        old_pairs = self._moved_contacts(self.struct, start, stop, True) # contacts broken by the fold
+        new_pairs = self._moved_contacts(new_struct, start, stop, True) # contacts created by the fold
+        return Fold(new_struct, start, stop, old_pairs, new_pairs, int(hh_cand[j] - hh))
+
+
+    def batch_tail_folds(self, struct : np.ndarray, k : int, count : bool = True) -> tuple:
+        '''
+        Generate k valid random pivot/diagonal folds of struct (not necessarily the current structure), drawn as in
+        random_fold: a random monomer (ends excluded) and a random method, the diagonal move only if the monomers
+        before and after it are not aligned. The folds are transformed and checked in vectorised batches
+        (utils.tail_fold_batch and utils.batch_contacts) and the missing ones are drawn again, in a batch
+        enlarged by the fraction of invalid folds of the previous one (few batches also for compact structures).
+        If self.cache is set, the folds already evaluated are read from it (see _cached_contacts).
+
+        Parameters
+        ----------
+        struct : np.ndarray
+            Structure folded, with shape (n,2).
+        k : int
+            Number of folds.
+        count : bool, optional
+            If True the number of folds tried is appended to self.counter. The default is True.
+
+        Returns
+        -------
+        tuple
+            Monomers (k,), methods (k,), new structures (k,n,2) and their H-H contacts (k,).
+        '''
+        indices, methods, structs, hh = [], [], [], []
+        found = tried = 0
+        size = k # folds of the batch
+        while found < k:
+            index = np.array([random.randint(1, self.n-2) for _ in range(size)])
+            corner = np.all(np.abs(struct[index+1] - struct[index-1]) == 1, axis=1) # not aligned
+            method = np.array([random.randint(1, 8) if c else random.randint(1, 7) for c in corner.tolist()])
+            batch = utils.tail_fold_batch(struct, index, method)
+            valid, contacts = utils.batch_contacts(batch, self._h) if self.cache is None else self._cached_contacts(batch)
+            valid = np.flatnonzero(valid)
+            rate = len(valid)/size # fraction of valid folds
+            valid = valid[:k-found] # the first valid folds needed
+            tried += int(valid[-1]) + 1 if found + len(valid) == k else size
+            for arr, val in ((indices, index), (methods, method), (structs, batch), (hh, contacts)):
+                arr.append(val[valid])
+            found += len(valid)
+            size = min(math.ceil(1.5*(k - found)/max(rate, 1/size)), 64*k)
+        if count:
+            self.counter.append(tried)
+        return tuple(np.concatenate(arr) for arr in (indices, methods, structs, hh))
+
+
+    def _cached_contacts(self, batch : np.ndarray) -> tuple:
+        '''
+        Same as utils.batch_contacts, but the validity and H-H contacts of the conformations already seen
+        (or of their rigid images) are read from self.cache: only the missing ones are evaluated and then stored.
+        The compactness is not stored: the candidates need only their energy, and the one of the accepted
+        structure is read from the contact set in O(1) (see compactness).
+        '''
+        keys = utils.canonical_keys(batch)
+        valid = np.empty(len(keys), dtype=bool)
+        contacts = np.empty(len(keys), dtype=int)
+        missing = []
+        for i,key in enumerate(keys):
+            entry = self.cache.get(key)
+            if entry is None:
+                missing.append(i)
+            else:
+                valid[i], contacts[i] = entry
+        if missing:
+            valid[missing], contacts[missing] = utils.batch_contacts(batch[missing], self._h)
+            for i in missing:
+                self.cache.put(keys[i], (bool(valid[i]), int(contacts[i])))
+        return valid, contacts
+
+
+    def accept_fold(self, fold : 'Fold') -> None:
+        '''
+        Accept a fold generated by propose_fold: the occupancy map and the contact set are updated only for
+        the moved monomers.
+
+        Parameters
+        ----------
+        fold : Fold
+            Fold proposed for the current structure.
+        '''
+        occ = self._occupancy
+        for x,y in _rows(self._struct, fold.start, fold.stop):
+            del occ[(x,y)]
+        for i,(x,y) in enumerate(_rows(fold.struct, fold.start, fold.stop), fold.start):
+            occ[(x,y)] = i
+        self._struct = fold.struct
+        self._contacts.difference_update(fold.old_pairs)
+        self._contacts.update(fold.new_pairs)
+        if self._hh is not None:
+            self._hh += fold.d_hh
+
+
+    def _check_contacts(self, en : float) -> None:
+        '''
+        Compare the incrementally updated energy, contacts and occupancy map with a full computation from the sites
+        of self.struct (debug only): the occupancy map is rebuilt, so a stale one cannot hide an error.
+        '''
+        keys = self._site_keys(self.struct)
+        occ = {key : i for i,key in enumerate(keys)}
+        contacts = set()
+        for i,key in enumerate(keys):
+            for site in self._neighbour_keys(key):
+                j = occ.get(site)
+                if j is not None and j > i+1:
+                    contacts.add((i,j))
+        count_h = self._count_hh(contacts)
+        if not math.isclose(en, -count_h) or not math.isclose(self.energy(), en):
+            raise AssertionError(f'Incremental energy {en} differs from the full computation {-count_h}')
+        if contacts != self._contacts or occ != self._occupancy:
+            raise AssertionError('Incremental contacts or occupancy differ from the ones of the structure')
+        if 2*len(contacts) != self.compactness():
+            raise AssertionError(f'Incremental compactness {self.compactness()} differs from the full computation {2*len(contacts)}')
+
+
     def compactness(self) -> int:
         '''
         Function to compute the compactness of the structure.
@@ -153,12 +610,7 @@ class Protein():
         int :
             The total number of neighbours counted (doubled)
         '''
-        count_neig = 0 
-        
-        for i,seq in enumerate(self.seq):
-            count_neig += len(self.get_neig_of(i)) 
-        
-        return count_neig
+        return 2*len(self._contacts) # each contact is a neighbour of both its monomers
                 
     
     def get_neig_of(self, i : int) -> str:
@@ -180,17 +632,11 @@ class Protein():
         neig = '' # string to save the neighbors
         x,y = self.struct[i] # coordinates of the monomer
 
-        possible_neig = [[x-1,y],[x,y-1],[x+1,y],[x,y+1]]
+        possible_neig = ((x-1,y),(x,y-1),(x+1,y),(x,y+1))
 
-        if i > 0: # if we are not in the starting monomer we remove the prevous monomer from the list
-            possible_neig.remove(self.struct[i-1])
-
-        if i < (self.n - 1): # if we are not in the ending monomer we remove the following monomer from the list
-            possible_neig.remove(self.struct[i+1])
-
-        for monomer in possible_neig: # check if the remaning points in the list contains some monomers (some neighbours)
-            if monomer in self.struct:
-                ind = self.struct.index(monomer) # get the position on the sequence of the neighbor
+        for monomer in possible_neig: # check if the points in the list contains some monomers (some neighbours)
+            ind = self._occupancy.get(monomer) # get the position on the sequence of the neighbor (O(1) lookup)
+            if ind is not None and abs(ind - i) != 1: # bounded monomers are not neighbours
                 neig += self.seq[ind] # get the H/P monomer
 
         return neig
@@ -199,46 +645,191 @@ class Protein():
     def random_fold(self) -> list:
         '''
         Randomly choose a monomer in the protein (exluding the first and the last) and fold the protein with a
-        random method using the tail_fold function. If the structure generated is not valid
-        the process is repited until a valid structure is found.
+        random method of tail_fold. If the structure generated is not valid the process is repited until a valid
+        structure is found.\n
+        The moved monomers are checked one by one against the occupancy map of the fixed ones, and the proposal is
+        discarded at the first collision: the new structure is built only for the valid proposals.\n
+        If pull_weight is not zero, a pull move (see pull_move) is proposed instead with probability
+        pull_weight/(pivot_weight + pull_weight).
 
         Returns
         -------
         list
             The new rotein streucture randomly folded (valid).
+            If the structure is stored as numpy array, a new array is returned.
         '''
         c = 0 # counter of the number of folding until a valid sequence is founded
+        struct = self.struct
+        occ = self._occupancy
+        p_pull = self.pull_weight/(self.pivot_weight + self.pull_weight) # probability of a pull move
+        prof = self.profiler
+        if prof is not None: t = time.perf_counter()
         
         while True: # cycle valid until a valid structure is found
+            c += 1
+            if prof is not None and c > 1: t = prof.lap('collisions', t) # the previous fold was discarded
+
+            if p_pull and random.random() < p_pull: # pull move of a random monomer (ends included) in a random direction
+                move = self._pull(random.randint(0, self.n-1), random.choice((-1, 1)))
+                if move is None: # the pull is not possible
+                    continue
+                start, stop, tail = move
+                rigid = False
+                break
+
             index = random.randint(1, self.n-2) # select a random monomer where start the folding
-            x, y = self.struct[index] 
-            tail = self.struct[index:] # tail of the structure that will be folded
+            (x_prev, y_prev), (x, y), (x_foll, y_foll) = _rows(struct, index-1, index+2)
 
             # Excluding diagonal move is the sequence cannot support it (the previous and following monomer are aligned)
-            distance_sur = utils.get_dist(self.struct[index-1],self.struct[index+1])
-            diag_move = True if math.isclose(distance_sur,math.sqrt(2)) else False
-            
-            for i,mon in enumerate(tail): # shifting the tail start in [0,0] for the folding
-                tail[i] = [mon[0]-x, mon[1]-y]
-            previous = self.struct[index-1] # recording the prev monomer
-            previous = [previous[0]-x, previous[1]-y]
-                
+            diag_move = abs(x_prev - x_foll) == 1 and abs(y_prev - y_foll) == 1
+
             # choose a random method for the protein folding
             method = random.randint(1, 8) if diag_move else random.randint(1, 7) # exclude diagonal move if the conditions don't match
-            tail = utils.tail_fold(struct=tail, method=method, previous=previous) # fold the tail with a random method
-            
-            for i,mon in enumerate(tail): # shifting the folded tail in the correct position
-                tail[i] = [mon[0]+x, mon[1]+y]
-            
-            new_struct = self.struct[:index] # construction of the new structure generated
-            for mon in tail: # pasting the new tail
-                new_struct.append(mon)
-                
-            c += 1
-                
-            if utils.is_valid_struct(new_struct): # if the structure is valid and the cycle 
-                break
+
+            if method == 8: # only the selected monomer moves, on the diagonal
+                x_new, y_new = utils.diagonal_move([[0,0],[x_foll-x, y_foll-y]], [x_prev-x, y_prev-y])[0]
+                site = (x_new+x, y_new+y)
+                if site in occ: # collision
+                    continue
+                start, stop, tail = index, index+1, [list(site)]
+            else: # rigid transformation of the tail after the selected monomer (the pivot)
+                tail = self._fold_tail(index, method)
+                if tail is None: # collision
+                    continue
+                start, stop = index+1, self.n
+            rigid = True
+            break
             
         self.counter.append(c) # counter of the number of foldings
+        self._moved = (start, stop, rigid) # monomers moved by the fold
 
+        new_struct = self._new_struct(start, stop, tail)
+        if prof is not None: prof.lap('proposal', t)
         return new_struct
+
+
+    def pull_move(self, index : int, direction : int):
+        '''
+        Pull move (Lesh et al. 2003) of the index-th monomer. The monomer is moved to a free site L, adjacent to its
+        bonded neighbour on the opposite side of the pull and diagonal to its current site; the following monomers
+        in the pull direction take the site C adjacent to L and then the sites left free two positions before,
+        until the chain is connected again. The end monomers are pulled by two free adjacent sites.
+
+        Parameters
+        ----------
+        index : int
+            Monomer pulled.
+        direction : int
+            -1 to drag the monomers before index (towards the start of the sequence), 1 to drag the ones after.
+
+        Returns
+        -------
+        list or None
+            The new protein structure (valid), or None if the pull is not possible.
+        '''
+        move = self._pull(index, direction)
+        if move is None:
+            return None
+        start, stop, tail = move
+        self._moved = (start, stop, False)
+        return self._new_struct(start, stop, tail)
+
+
+    def _pull(self, i : int, s : int):
+        '''
+        Compute the pull move of the i-th monomer dragging the monomers in direction s (-1 or 1).
+        Return the moved segment as (start, stop, new sites of the monomers from start to stop-1), or None
+        if the needed sites are not free. The sites L and C are chosen at random among the possible ones.
+        '''
+        n = self.n
+        occ = self._occupancy
+        rows = _rows(self.struct, 0, n)
+        x, y = rows[i]
+
+        if 0 <= i-s < n: # internal monomer (or end monomer dragged along the chain): anchored to the (i-s)-th monomer
+            x_a, y_a = rows[i-s]
+            w_x, w_y = random.choice(((y-y_a, x-x_a), (y_a-y, x_a-x))) # directions perpendicular to the anchor bond
+            site_l = (x_a+w_x, y_a+w_y)
+            site_c = (x+w_x, y+w_y)
+            if site_l in occ:
+                return None
+            if not 0 <= i+s < n or tuple(rows[i+s]) == site_c: # corner case: only the i-th monomer moves
+                return (i, i+1, [list(site_l)])
+            if site_c in occ:
+                return None
+        else: # end monomer pulled along two free adjacent sites
+            free_c = [c for c in ((x-1,y),(x,y-1),(x+1,y),(x,y+1)) if c not in occ]
+            if not free_c:
+                return None
+            site_c = random.choice(free_c)
+            x_c, y_c = site_c
+            free_l = [l for l in ((x_c-1,y_c),(x_c,y_c-1),(x_c+1,y_c),(x_c,y_c+1)) if l not in occ]
+            if not free_l:
+                return None
+            site_l = random.choice(free_l)
+
+        new = {i : list(site_l), i+s : list(site_c)} # new sites of the moved monomers
+        j = i + 2*s
+        while 0 <= j < n: # the other monomers follow until the chain is connected again
+            x_j, y_j = rows[j]
+            x_f, y_f = new[j-s]
+            if abs(x_j-x_f) + abs(y_j-y_f) == 1:
+                break
+            new[j] = list(rows[j-2*s])
+            j += s
+
+        start, stop = (j-s, i+1) if s < 0 else (i, j) # j-s is the last monomer moved
+        return (start, stop, [new[k] for k in range(start, stop)])
+
+
+    def _new_struct(self, start : int, stop : int, tail : list):
+        '''
+        Build the new structure replacing the sites of the monomers from start to stop-1 with tail.
+        '''
+        struct = self.struct
+        if isinstance(struct, np.ndarray):
+            new_struct = struct.copy()
+            new_struct[start:stop] = tail
+        else:
+            new_struct = struct[:start] + tail + struct[stop:]
+        return new_struct
+
+
+    def _fold_tail(self, index : int, method : int) -> list:
+        '''
+        Apply the rigid transformation method (1-7 of tail_fold) to the monomers after the index-th one, using it as pivot.
+        The transformed monomers are checked in order against the sites of the fixed ones (up to index) and
+        None is returned at the first collision.
+        '''
+        struct = self.struct
+        occ = self._occupancy
+
+        if isinstance(struct, np.ndarray): # vectorised transformation, then check of the sites
+            pivot = struct[index]
+            tail = utils.tail_fold_array(struct[index+1:] - pivot, method, None) + pivot
+            for site in map(tuple, tail.tolist()):
+                j = occ.get(site)
+                if j is not None and j <= index:
+                    return None
+            return tail
+
+        (a, b), (c, d) = utils.FOLD_MATRICES[method].tolist()
+        x, y = struct[index]
+        tail = []
+        for x_t, y_t in struct[index+1:]: # the monomers are transformed one at a time, up to the first collision
+            dx, dy = x_t-x, y_t-y
+            site = (x + a*dx + b*dy, y + c*dx + d*dy)
+            j = occ.get(site)
+            if j is not None and j <= index:
+                return None
+            tail.append(list(site))
+        return tail
+
+
+def _rows(struct, start : int, stop : int) -> list:
+    '''
+    Coordinates of the monomers from start to stop-1 as Python ints (also for numpy structures),
+    used as keys of the occupancy map.
+    '''
+    rows = struct[start:stop]
+    return rows.tolist() if isinstance(rows, np.ndarray) else rows
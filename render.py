@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from multiprocessing import Pool
+import io
+import os
+import numpy as np
+import progress
+
+
+_RENDERER = None # StructureRenderer used by each worker process (built once per process)
+
+
+class StructureRenderer():
+    '''
+    Renderer of the frames of the structures of a protein (square lattice) for the gif and the snapshots.\n
+    The figure is drawn on an Agg canvas (no pyplot and no display needed) and its artists are built once:
+    the backbone line, one scatter collection for the H monomers and one for the P monomers. Each frame only
+    updates their data, so the number of artists does not grow with the frames or with the length of the protein.\n
+    The frames of the gif are mapped on the palette of the first one (the colors of the artists do not change),
+    which is much faster than computing an adaptive palette for each frame. The palette can be given, e.g. the one
+    of the first frame rendered by another process.
+
+    Parameters
+    ----------
+    seq : str
+        HP sequence of the protein.
+    dpi : int, optional
+        Resolution of the frames. The default is 200.
+    palette : list, optional
+        RGB values of the palette of the gif frames (see palette). The default is None (palette of the first frame).
+    '''
+
+    def __init__(self, seq : str, dpi : int = 200, palette : list = None) -> None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.dpi = dpi
+        self.fig = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.h = np.array([mon == 'H' for mon in seq])
+        self.line, = self.ax.plot([], [], alpha = 0.5)
+        self.h_mon = self.ax.scatter([], [], marker='$H$', s=20, color = 'red')
+        self.p_mon = self.ax.scatter([], [], marker='$P$', s=20, color = 'red')
+        self.ax.grid(alpha=0.2)
+        self.title = self.ax.set_title('')
+        self._palette = None # palette image of the gif frames
+        if palette is not None:
+            from PIL import Image
+            self._palette = Image.new('P', (1, 1))
+            self._palette.putpalette(palette)
+
+
+    def draw(self, struct, title : str = '') -> None:
+        '''
+        Update the artists with the structure and draw the figure.
+        '''
+        struct = np.asarray(struct)
+        x = struct[:,0]
+        y = struct[:,1]
+        self.line.set_data(x, y)
+        self.h_mon.set_offsets(struct[self.h])
+        self.p_mon.set_offsets(struct[~self.h])
+        self.ax.set_xlim(x.min()-6, x.max()+6)
+        self.ax.set_ylim(y.min()-6, y.max()+6)
+        self.title.set_text(title)
+        self.canvas.draw()
+
+
+    def image(self, struct, title : str = ''):
+        '''
+        Frame of the structure as RGB PIL image.
+        '''
+        from PIL import Image
+        self.draw(struct, title)
+        return Image.frombuffer('RGBA', self.canvas.get_width_height(), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+
+
+    def gif_frame(self, struct, title : str = ''):
+        '''
+        Frame of the structure as palette (P mode) PIL image, ready for the gif.
+        '''
+        from PIL import Image
+        image = self.image(struct, title)
+        if self._palette is None:
+            self._palette = image.quantize(method=Image.Quantize.FASTOCTREE)
+            return self._palette
+        return image.quantize(palette=self._palette, dither=Image.Dither.NONE)
+
+
+    def palette(self) -> list:
+        '''
+        RGB values of the palette of the gif frames (None before the first frame).
+        '''
+        return None if self._palette is None else self._palette.getpalette()
+
+
+    def png(self, struct, title : str = '') -> bytes:
+        '''
+        Frame of the structure encoded as png.
+        '''
+        buffer = io.BytesIO()
+        self.image(struct, title).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+
+def render_frames(seq : str, structures, titles : list = None, dpi : int = 200, workers : int = 1, reporter = None,
+                  fmt : str = 'gif') -> list:
+    '''
+    Render the frames of the structures, splitting them among a pool of processes if workers > 1.
+    The first gif frame is rendered in this process and its palette is passed to the workers, so all the frames
+    share it whatever the number of workers.
+
+    Parameters
+    ----------
+    seq : str
+        HP sequence of the protein.
+    structures : iterable
+        Structures of the frames (lists or arrays).
+    titles : list, optional
+        Title of each frame. The default is None (no titles).
+    dpi : int, optional
+        Resolution of the frames. The default is 200.
+    workers : int, optional
+        Number of processes, 1 renders in this process and 0 means one per core. The default is 1.
+    reporter : progress.Reporter, optional
+        Progress reporter. The default is None (silent).
+    fmt : str, optional
+        'gif' for palette PIL images (see save_gif) or 'png' for png encoded bytes. The default is 'gif'.
+
+    Returns
+    -------
+    list
+        Frames in the order of the structures.
+    '''
+    structures = [np.asarray(struct, dtype=np.int16) for struct in structures] # compact frames for the workers
+    titles = titles if titles is not None else ['']*len(structures)
+    reporter = reporter if reporter is not None else progress.get_reporter('silent')
+    reporter.start(len(structures))
+    workers = workers if workers > 0 else os.cpu_count() or 1
+
+    if workers == 1 or len(structures) < 2:
+        renderer = StructureRenderer(seq, dpi)
+        render = renderer.gif_frame if fmt == 'gif' else renderer.png
+        frames = []
+        for i,(struct, title) in enumerate(zip(structures, titles)):
+            frames.append(render(struct, title))
+            reporter.update(i+1)
+    else:
+        frames = []
+        palette = None
+        if fmt == 'gif': # the palette of the first frame is shared with the workers
+            renderer = StructureRenderer(seq, dpi)
+            frames.append(renderer.gif_frame(structures[0], titles[0]))
+            palette = renderer.palette()
+            reporter.update(1)
+        first = len(frames)
+        size = max(1, (len(structures) - first)//(4*workers)) # a few batches per worker to balance the load
+        batches = [(fmt, list(zip(structures[k:k+size], titles[k:k+size]))) for k in range(first, len(structures), size)]
+        with Pool(min(workers, len(batches)), initializer=_init_worker, initargs=(seq, dpi, palette)) as pool:
+            for batch in pool.imap(_render_batch, batches):
+                frames.extend(batch)
+                reporter.update(len(frames))
+    reporter.finish()
+    return frames
+
+
+def save_gif(frames : list, filename : str, fps : int = 5) -> None:
+    '''
+    Assemble the frames rendered by render_frames in a gif (looping, fps frames per second).
+    The palette optimisation of Pillow is skipped: the frames already share the palette of the first one.
+    '''
+    frames[0].save(filename, save_all=True, append_images=frames[1:], duration=int(1000/fps), loop=0, optimize=False)
+
+
+def save_snapshots(seq : str, structures, steps : list, folder : str, dpi : int = 100, workers : int = 1) -> list:
+    '''
+    Save the structures as a series of png files folder/structure_step_{step}.png.
+
+    Parameters
+    ----------
+    seq : str
+        HP sequence of the protein.
+    structures : iterable
+        Structures to save.
+    steps : list
+        Step of each structure, used in the file names and in the titles.
+    folder : str
+        Folder of the files (created if missing).
+    dpi : int, optional
+        Resolution of the files. The default is 100.
+    workers : int, optional
+        Number of processes (see render_frames). The default is 1.
+
+    Returns
+    -------
+    list
+        Names of the saved files.
+    '''
+    os.makedirs(folder, exist_ok=True)
+    frames = render_frames(seq, structures, [f'Step {step}' for step in steps], dpi, workers, fmt='png')
+    filenames = []
+    for step, frame in zip(steps, frames):
+        filenames.append(os.path.join(folder, f'structure_step_{step}.png'))
+        with open(filenames[-1], 'wb') as f:
+            f.write(frame)
+    return filenames
+
+
+def _init_worker(seq : str, dpi : int, palette : list = None) -> None:
+    '''
+    Build the renderer used by the worker process, with the palette of the gif frames.
+    '''
+    global _RENDERER
+    _RENDERER = StructureRenderer(seq, dpi, palette)
+
+
+def _render_batch(task : tuple) -> list:
+    '''
+    Render a batch of (structure, title) as frames of the format fmt (see render_frames).
+    '''
+    fmt, batch = task
+    render = _RENDERER.gif_frame if fmt == 'gif' else _RENDERER.png
+    return [render(struct, title) for struct,title in batch]
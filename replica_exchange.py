@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from protein_class import Protein
+from multiprocessing import Pool
+import contextlib
+import random
+import math
+import sys
+import os
+import io
+import numpy as np
+import utils
+import progress
+
+
+_PROTEIN = None # Protein used by each worker process to evolve the replicas (built once per process)
+
+
+class ReplicaExchange():
+    '''
+    Replica exchange (parallel tempering) of the protein.\n
+    N replicas of the same sequence evolve with the Metropolis algorithm at fixed temperatures, geometrically spaced
+    between T_min and T_max, in a pool of processes. Every swap_interval steps the replicas at adjacent temperatures
+    try to exchange their structures, accepted with probability min(1, exp((1/T_k - 1/T_k+1)(E_k - E_k+1))).\n
+    The structures are exchanged between the processes as compact int16 arrays.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def __init__(self, config : utils.Configuration) -> None:
+        self.config = config
+        self.n_replicas = config.replicas
+        if self.n_replicas < 2:
+            raise ValueError('The replica exchange needs at least 2 replicas')
+        self.steps = config.folds # steps of each replica
+        self.swap_interval = config.swap_interval
+        self.workers = config.workers if config.workers > 0 else min(self.n_replicas, os.cpu_count() or 1)
+        self.seed = config.seed
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval) # progress of the rounds
+
+        ratio = (config.T_max/config.T_min)**(1/(self.n_replicas - 1))
+        self.temperatures = [config.T_min*ratio**k for k in range(self.n_replicas)] # temperature ladder
+
+        self.swap_attempts = [0]*(self.n_replicas - 1) # swap attempts between the temperatures k and k+1
+        self.swap_accepts = [0]*(self.n_replicas - 1) # accepted swaps between the temperatures k and k+1
+        self.best_energy = None # global min energy found by the replicas
+        self.best_struct = None # global min energy structure (list)
+        self.energies = [] # energies of the replicas (ordered by temperature) at the end of the run
+
+
+    def run(self) -> None:
+        '''
+        Evolve the replicas for the configured number of steps, attempting the swaps every swap_interval steps.
+
+        Returns
+        -------
+        None.
+        '''
+        with contextlib.redirect_stdout(io.StringIO()): # the initial structure is built silently
+            prot = Protein(self.config)
+        states = [_pack(prot.struct)]*self.n_replicas # structures ordered by temperature
+        self.energies = [prot.energy()]*self.n_replicas
+        self.best_energy = prot.energy()
+        self.best_struct = _unpack(states[0]).tolist()
+
+        rng = random.Random(self.seed) # random generator of the swaps
+        rounds = math.ceil(self.steps/self.swap_interval)
+
+        reporter = self.reporter
+        reporter.start(rounds)
+        with Pool(self.workers, initializer=_init_worker, initargs=(self.config,)) as pool:
+            for r in range(rounds):
+                steps = min(self.swap_interval, self.steps - r*self.swap_interval)
+                tasks = [(states[k], self.temperatures[k], steps, _segment_seed(self.seed, r, k)) for k in range(self.n_replicas)]
+                results = pool.map(_evolve_segment, tasks)
+
+                for k,(state, en, min_en, min_state) in enumerate(results):
+                    states[k] = state
+                    self.energies[k] = en
+                    if min_en < self.best_energy:
+                        self.best_energy = min_en
+                        self.best_struct = _unpack(min_state).tolist()
+
+                for k in range(r % 2, self.n_replicas - 1, 2): # even and odd pairs alternate
+                    self.swap_attempts[k] += 1
+                    delta = (1/self.temperatures[k] - 1/self.temperatures[k+1])*(self.energies[k] - self.energies[k+1])
+                    if delta >= 0 or rng.random() < math.exp(delta):
+                        self.swap_accepts[k] += 1
+                        states[k], states[k+1] = states[k+1], states[k]
+                        self.energies[k], self.energies[k+1] = self.energies[k+1], self.energies[k]
+                reporter.update(r+1, en=self.energies[0], best=self.best_energy, T=self.temperatures[0])
+        reporter.finish()
+
+
+    def swap_acceptance(self) -> list:
+        '''
+        Acceptance rate of the swaps for each pair of adjacent temperatures.
+
+        Returns
+        -------
+        list
+            Acceptance rate of the pair (k, k+1) in the k-th position.
+        '''
+        return [acc/att if att else 0. for acc,att in zip(self.swap_accepts, self.swap_attempts)]
+
+
+    def report(self) -> None:
+        '''
+        Print on terminal the swap acceptance of each pair of temperatures (the global min energy is printed by main
+        with the results of every mode).
+        '''
+        print('Swap acceptance:')
+        for k,rate in enumerate(self.swap_acceptance()):
+            print(f'  T = {self.temperatures[k]:.3f} <-> {self.temperatures[k+1]:.3f} : {rate:.2f}')
+
+
+def _pack(struct) -> bytes:
+    '''
+    Compact representation of a structure exchanged between processes: int16 coordinates.
+    '''
+    return np.asarray(struct, dtype=np.int16).tobytes()
+
+
+def _unpack(state : bytes) -> np.ndarray:
+    '''
+    Inverse of _pack: (n,2) integer array.
+    '''
+    return np.frombuffer(state, dtype=np.int16).reshape(-1, 2).astype(int)
+
+
+def _segment_seed(seed : int, r : int, k : int) -> int:
+    '''
+    Seed of the k-th replica in the r-th round, independent from the process that runs it.
+    '''
+    return int(np.random.SeedSequence([seed, r, k]).generate_state(1)[0])
+
+
+def _init_worker(config : utils.Configuration) -> None:
+    '''
+    Build the Protein used by the worker process. The output of the worker is discarded, and no checkpoint is
+    saved: the worker evolves a different replica at each segment, so its state is not the one of a run.
+    '''
+    global _PROTEIN
+    sys.stdout = open(os.devnull, 'w')
+    _PROTEIN = Protein(config)
+    _PROTEIN.annealing = False
+    _PROTEIN.gif = False
+    _PROTEIN.checkpoint = None
+    _PROTEIN.reporter = progress.get_reporter('silent')
+
+
+def _evolve_segment(task : tuple) -> tuple:
+    '''
+    Evolve a replica at fixed temperature for the given number of steps.
+
+    Parameters
+    ----------
+    task : tuple
+        Packed structure, temperature, number of steps and random seed.
+
+    Returns
+    -------
+    tuple
+        Packed final structure, its energy, min energy found and packed min energy structure.
+    '''
+    state, T, steps, seed = task
+    random.seed(seed)
+    prot = _PROTEIN
+    struct = _unpack(state)
+    prot.struct = struct if isinstance(prot.struct, np.ndarray) else struct.tolist()
+    prot.T_in = T
+    prot.steps = steps # before the records, which are preallocated for the steps of the segment
+    prot.reset_records()
+    prot.evolution()
+    return (_pack(prot.struct), prot.energy(), prot.min_en, _pack(prot.min_en_struct))
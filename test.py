@@ -9,6 +9,26 @@ import configparser
 from math import isclose, sqrt
 import random
 import hypothesis
+import pytest
+import numpy as np
+from replica_exchange import ReplicaExchange
+import ensemble
+from wang_landau import WangLandau
+from perm import PERM
+from exact import ExactEnumeration
+from branch_bound import BranchAndBound
+import benchmark
+from protein_3d import Protein3D
+from history import History, reduce_windows, minmax_indices
+from cache import ConformationCache
+from trajectory import TrajectoryWriter, TrajectoryReader
+import progress
+import pickle
+import json
+import io
+import subprocess
+import render
+import sys
 
 configuration = configparser.ConfigParser()
 configuration.read('config_test.txt')
@@ -668,3 +688,1200 @@ def test_evolution_maximize_compactness():
     prot1.evolution()
     # asserts for the energy minimization after the evolution (energy shoul not be grater than zero)
     assert prot1.compactness() >= comp1
+
+
+def test_occupancy_in_sync_after_evolution():
+    '''
+    Test that the occupancy map used for the neighbours lookup follows the structure during the evolution,
+    including the rejected folds.
+
+    GIVEN: a linear protein structure
+    WHEN: I evolve the system for a certain number of steps
+    THEN: I expect the occupancy map to contain exactly the sites of the final structure
+    '''
+    random.seed(1234)
+    prot1 = p.Protein(config)
+    prot1.seq = seq
+    prot1.struct = utils.linear_struct(prot1.seq)
+    prot1.n = len(seq)
+    prot1.steps = 200
+    prot1.evolution()
+    assert prot1._occupancy == {tuple(mon) : i for i,mon in enumerate(prot1.struct)}
+
+
+def reference_energy(prot) -> float:
+    '''
+    Reference energy computed with a plain double loop over the monomers (no occupancy map).
+    '''
+    count_h = 0
+    for i in range(prot.n):
+        for j in range(i+2, prot.n):
+            if prot.seq[i] == 'H' and prot.seq[j] == 'H' and isclose(utils.get_dist(prot.struct[i], prot.struct[j]), 1):
+                count_h += 1
+    return -float(count_h)
+
+
+def test_incremental_energy_matches_full_energy():
+    '''
+    Test that the incremental energy used in the evolution is equal to the full energy computation.
+    With debug = True the evolution raises an error as soon as the two energies differ.
+
+    GIVEN: a protein with a long HP sequence
+    WHEN: I evolve the system with the debug flag active
+    THEN: I expect the evolution to end without errors and the last recorded energy equal to the full one
+    '''
+    random.seed(9876)
+    prot1 = p.Protein(config)
+    prot1.seq = seq1
+    prot1.struct = utils.linear_struct(prot1.seq)
+    prot1.n = len(seq1)
+    prot1.steps = 500
+    prot1.debug = True
+    prot1.evolution()
+    assert isclose(prot1.energy(), reference_energy(prot1))
+
+
+
+def test_check_contacts_rebuilds_occupancy():
+    '''
+    Test that the debug check of the contacts does not trust the incremental occupancy map.
+
+    GIVEN: a protein whose structure is replaced without updating the occupancy map and the contacts
+    WHEN: I run the debug check
+    THEN: I expect an AssertionError, and no error after assigning the structure through the setter
+    '''
+    prot1 = p.Protein(config)
+    prot1.seq = seq
+    prot1.n = len(seq)
+    prot1.struct = utils.linear_struct(seq)
+    prot1._struct = correct_structure # occupancy and contacts of the linear structure, consistent with each other
+    with pytest.raises(AssertionError):
+        prot1._check_contacts(prot1.energy())
+    prot1.struct = correct_structure
+    prot1._check_contacts(prot1.energy())
+
+
+def test_contacts_in_sync_after_evolution():
+    '''
+    Test that the contact set updated fold by fold during the evolution is the same obtained from scratch.
+
+    GIVEN: a protein with a long HP sequence
+    WHEN: I evolve the system and then I rebuild the contacts assigning the final structure again
+    THEN: I expect the same contacts, energy and compactness
+    '''
+    random.seed(555)
+    prot1 = p.Protein(config)
+    prot1.seq = seq1
+    prot1.struct = utils.linear_struct(prot1.seq)
+    prot1.n = len(seq1)
+    prot1.steps = 500
+    prot1.evolution()
+    contacts, en, comp = set(prot1._contacts), prot1.energy(), prot1.compactness()
+    prot1.struct = prot1.struct
+    assert contacts == prot1._contacts
+    assert isclose(en, prot1.energy())
+    assert comp == prot1.compactness()
+    assert isclose(en, reference_energy(prot1))
+
+
+def test_evolution_records_accepted_states():
+    '''
+    Test that the recorded energy and compactness series follow the accepted structures and that
+    the running min energy and max compactness agree with the records.
+
+    GIVEN: a protein with a long HP sequence
+    WHEN: I evolve the system for a certain number of steps
+    THEN: I expect the last records equal to the final structure values and the best structures consistent with the records
+    '''
+    random.seed(2468)
+    prot1 = p.Protein(config)
+    prot1.seq = seq1
+    prot1.struct = utils.linear_struct(prot1.seq)
+    prot1.n = len(seq1)
+    prot1.steps = 500
+    prot1.evolution()
+    assert isclose(prot1.en_evo[-1], prot1.energy())
+    assert prot1.comp_evo[-1] == prot1.compactness()
+    assert isclose(prot1.min_en, min(prot1.en_evo))
+    assert prot1.max_comp == max(prot1.comp_evo)
+    prot1.struct = prot1.min_en_struct
+    assert isclose(prot1.energy(), prot1.min_en)
+    prot1.struct = prot1.max_comp_struct
+    assert prot1.compactness() == prot1.max_comp
+
+
+def test_is_valid_struct_array():
+    '''
+    Test that is_valid_struct gives the same answer for structures stored as numpy arrays.
+
+    GIVEN: the correct and wrong structures defined above as (n,2) integer arrays
+    WHEN: I want to verify if the structures are valid
+    THEN: I expect the same responses of the list version
+    '''
+    assert utils.is_valid_struct(np.array([[0,0],[0,1],[1,1],[1,2],[1,3],[2,3],[2,2],[2,1],[2,0],[2,-1],[1,-1]]))
+    for wrong in (wrong_str_double_point, wrong_str_skip_step_square, wrong_str_skip_step_linear, wrong_str_return_point):
+        assert not utils.is_valid_struct(np.array(wrong))
+
+
+def test_tail_fold_array_same_as_list():
+    '''
+    Test that the matrix table of tail_fold_array reproduces the rigid transformations of tail_fold.
+
+    GIVEN: a structure starting in [0,0]
+    WHEN: I fold it with each of the methods 1-7 as list and as numpy array
+    THEN: I expect the same folded structure
+    '''
+    struct = [[0,0],[1,0],[1,1],[2,1],[2,2],[3,2],[3,3]]
+    for method in range(1, 8):
+        folded = utils.tail_fold_array(np.array(struct), method, [-1,0])
+        assert folded.tolist() == utils.tail_fold(struct, method, [-1,0])
+
+
+def test_evolution_array_same_as_list():
+    '''
+    Test that the numpy array engine follows exactly the same evolution of the list engine.
+
+    GIVEN: the same protein stored as list and as numpy array
+    WHEN: I evolve both the systems with the same random seed
+    THEN: I expect the same final structure and the same energy evolution
+    '''
+    prots = []
+    for struct in (utils.linear_struct(seq1), np.array(utils.linear_struct(seq1))):
+        random.seed(31)
+        prot1 = p.Protein(config)
+        prot1.seq = seq1
+        prot1.struct = struct
+        prot1.n = len(seq1)
+        prot1.steps = 300
+        prot1.evolution()
+        prots.append(prot1)
+    assert isinstance(prots[1].struct, np.ndarray)
+    assert prots[1].struct.tolist() == prots[0].struct
+    assert np.array_equal(prots[1].en_evo, prots[0].en_evo)
+
+
+def test_random_fold_compact_struct_counter():
+    '''
+    Test that random_fold on a compact structure (many collisions) returns a valid structure,
+    leaves the current structure untouched and records the number of attempts.
+
+    GIVEN: a compact protein structure stored as list and as numpy array
+    WHEN: I randomly fold the protein many times
+    THEN: I expect valid structures, an unchanged current structure and one counter entry per fold
+    '''
+    compact = [[0,0],[1,0],[1,1],[0,1],[0,2],[1,2],[2,2],[2,1],[2,0],[3,0],[3,1],[3,2],[3,3]]
+    for struct in (compact, np.array(compact)):
+        random.seed(10)
+        prot = p.Protein(config)
+        prot.seq = seq
+        prot.struct = struct
+        prot.n = len(seq)
+        prot.counter = []
+        for i in range(200):
+            new_struct = prot.random_fold()
+            assert utils.is_valid_struct(new_struct)
+        assert np.array_equal(prot.struct, compact)
+        assert len(prot.counter) == 200
+        assert max(prot.counter) > 1
+
+
+def test_pull_move_valid_struct():
+    '''
+    Test that the pull moves give valid structures, for internal and end monomers in both directions.
+
+    GIVEN: a valid composite protein structure
+    WHEN: I pull random monomers many times
+    THEN: I expect a valid protein structure every time the pull is possible
+    '''
+    random.seed(8080)
+    prot = p.Protein(config)
+    prot.seq = seq1
+    prot.struct = utils.linear_struct(seq1)
+    prot.n = len(seq1)
+    for i in range(2000):
+        new_struct = prot.pull_move(random.randint(0, prot.n-1), random.choice((-1, 1)))
+        if new_struct is not None:
+            assert utils.is_valid_struct(new_struct)
+            prot.struct = new_struct
+
+
+def test_pull_move_corner():
+    '''
+    Test the two possible pull moves of a corner monomer: if the dragged neighbour is already in C only the monomer moves.
+
+    GIVEN: a structure with a corner in the monomer 1
+    WHEN: I pull the monomer 1 towards the start of the sequence
+    THEN: I expect either the monomer 1 moved on the opposite corner, or the monomers 0 and 1 moved to the free side
+    '''
+    prot = p.Protein(config)
+    prot.seq = 'HPHP'
+    prot.struct = [[0,0],[1,0],[1,1],[1,2]]
+    prot.n = 4
+    random.seed(0)
+    results = [prot.pull_move(1, -1) for i in range(20)] # L is chosen at random between the two possible sites
+    assert [[0,0],[0,1],[1,1],[1,2]] in results # corner move: C is the site of the monomer 0
+    for new_struct in results:
+        assert new_struct in ([[0,0],[0,1],[1,1],[1,2]], [[2,0],[2,1],[1,1],[1,2]])
+
+
+def test_evolution_with_pull_moves():
+    '''
+    Test the evolution with both pivot and pull moves, checking the incremental energy at each step.
+
+    GIVEN: a protein with a long HP sequence and a move mix with pull moves
+    WHEN: I evolve the system with the debug flag active
+    THEN: I expect the evolution to end without errors with a valid structure and the correct energy
+    '''
+    random.seed(4242)
+    prot1 = p.Protein(config)
+    prot1.seq = seq1
+    prot1.struct = utils.linear_struct(prot1.seq)
+    prot1.n = len(seq1)
+    prot1.steps = 500
+    prot1.pivot_weight = 1.
+    prot1.pull_weight = 2.
+    prot1.debug = True
+    prot1.evolution()
+    assert utils.is_valid_struct(prot1.struct)
+    assert isclose(prot1.energy(), reference_energy(prot1))
+
+
+def test_replica_exchange_best_struct():
+    '''
+    Test the replica exchange: the min energy structure must be valid, with the reported energy,
+    and the swap acceptance rates must be probabilities.
+
+    GIVEN: the test configuration with a short sequence and 3 replicas in 1 process
+    WHEN: I run the replica exchange
+    THEN: I expect a valid best structure with the best energy and acceptance rates in [0,1]
+    '''
+    rex_config = utils.Configuration(configuration)
+    rex_config.seq = seq1
+    rex_config.folds = 300
+    rex_config.replicas = 3
+    rex_config.swap_interval = 50
+    rex_config.workers = 1
+    rex_config.seed = 12
+    rex = ReplicaExchange(rex_config)
+    rex.run()
+    assert utils.is_valid_struct(rex.best_struct)
+    prot = p.Protein(rex_config)
+    prot.struct = rex.best_struct
+    assert isclose(prot.energy(), rex.best_energy)
+    assert rex.best_energy <= min(rex.energies)
+    assert all(0 <= rate <= 1 for rate in rex.swap_acceptance())
+    assert sum(rex.swap_attempts) == 6
+
+
+def test_ensemble_reproducible():
+    '''
+    Test that the ensemble runs have independent seeds and that the ensemble is reproducible.
+
+    GIVEN: the test configuration with a short sequence and a fixed seed
+    WHEN: I run the same ensemble twice
+    THEN: I expect different seeds for the runs, the same results in the two ensembles and valid best structures
+    '''
+    ens_config = utils.Configuration(configuration)
+    ens_config.seq = seq1
+    ens_config.folds = 200
+    ens_config.seed = 77
+    summary1 = ensemble.run_ensemble(ens_config, runs=3, workers=1)
+    summary2 = ensemble.run_ensemble(ens_config, runs=3, workers=2)
+    seeds = [res['seed'] for res in summary1['runs']]
+    assert len(set(seeds)) == 3
+    assert seeds == ensemble.run_seeds(77, 3)
+    for res1, res2 in zip(summary1['runs'], summary2['runs']):
+        assert res1['best_struct'] == res2['best_struct']
+        assert isclose(res1['best_energy'], res2['best_energy'])
+        assert utils.is_valid_struct(res1['best_struct'])
+    assert isclose(summary1['best_energy'], min(res['best_energy'] for res in summary1['runs']))
+
+
+def test_ensemble_with_checkpoint(tmp_path):
+    '''
+    Test an ensemble and a replica exchange in a pool of processes with the checkpoints enabled.
+
+    GIVEN: the test configuration with a checkpoint file saved every 50 steps
+    WHEN: I run an ensemble of 3 runs in 2 processes and a replica exchange in 2 processes
+    THEN: I expect no errors, a checkpoint file for each run of the ensemble and none written by the replicas
+    '''
+    ens_config = utils.Configuration(configuration)
+    ens_config.seq = seq1
+    ens_config.folds = 200
+    ens_config.seed = 77
+    ens_config.checkpoint = str(tmp_path/'ens.pkl')
+    ens_config.checkpoint_interval = 50
+    summary = ensemble.run_ensemble(ens_config, runs=3, workers=2)
+    assert len(summary['runs']) == 3
+    for k in range(3):
+        prot = p.Protein.load_checkpoint(str(tmp_path/f'ens.pkl.{k}'))
+        assert prot.evo_step == 200
+    assert not (tmp_path/'ens.pkl').exists()
+
+    ens_config.checkpoint = str(tmp_path/'rex.pkl')
+    ens_config.replicas = 2
+    ens_config.swap_interval = 50
+    ens_config.workers = 2
+    ReplicaExchange(ens_config).run()
+    assert list(tmp_path.glob('rex.pkl*')) == []
+
+
+def test_max_hh_contacts():
+    '''
+    Test the upper bound of the H-H contacts used for the energy range of the density of states.
+
+    GIVEN: sequences for which the bound is known
+    WHEN: I compute the max number of H-H contacts
+    THEN: I expect the bound from the parity of the H monomers
+    '''
+    assert utils.max_hh_contacts('PPPPP') == 0
+    assert utils.max_hh_contacts('HHHH') == 5 # even H: 0 (end, 3) and 2 (2) / odd H: 1 (2) and 3 (end, 3)
+    assert utils.max_hh_contacts('HPPPH') == 0 # only even H
+    assert utils.max_hh_contacts(seq) >= 2 # the energy of correct_structure is -2
+
+
+def test_wang_landau_thermodynamics():
+    '''
+    Test the Wang-Landau sampling on a short sequence: the visited energies must include the linear structure one,
+    the min energy structure must be valid with the reported energy, and the thermodynamics must be consistent.
+
+    GIVEN: a short HP sequence
+    WHEN: I run the Wang-Landau sampling and compute the thermodynamics
+    THEN: I expect the mean energy increasing with T, non negative specific heat and the energy in the sampled range
+    '''
+    random.seed(321)
+    wl_config = utils.Configuration(configuration)
+    wl_config.seq = 'HPHPPHHPHPPH'
+    wl_config.wl_ln_f_final = 1e-2
+    wl_config.wl_check_interval = 2000
+    wl = WangLandau(wl_config)
+    wl.run()
+    assert 0. in wl.energies
+    assert wl.log_dos.min() == 0.
+    assert wl.energies.min() >= -utils.max_hh_contacts(wl_config.seq)
+    prot = p.Protein(wl_config)
+    prot.struct = wl.min_en_struct
+    assert isclose(prot.energy(), wl.min_en)
+    thermo = wl.thermodynamics([0.2, 0.5, 1., 2.])
+    assert np.all(np.diff(thermo['U']) > 0)
+    assert np.all(thermo['C'] >= 0)
+    assert np.all((thermo['U'] >= wl.energies.min()) & (thermo['U'] <= 0))
+
+
+def test_perm_best_structs():
+    '''
+    Test the PERM chain growth: the best structures must be valid Protein structures, ordered by energy,
+    with the energy computed by the Protein class.
+
+    GIVEN: the sequence of correct_structure (energy -2)
+    WHEN: I grow the chains with PERM
+    THEN: I expect valid structures, ordered by energy, with the min energy not higher than -2
+    '''
+    random.seed(99)
+    perm_config = utils.Configuration(configuration)
+    perm_config.seq = seq
+    perm_config.perm_tours = 300
+    perm_config.perm_keep = 5
+    growth = PERM(perm_config)
+    growth.run()
+    assert growth.best_energy <= -2
+    assert len(growth.best_structs) == 5
+    energies = [en for en,struct in growth.best]
+    assert energies == sorted(energies)
+    prot = p.Protein(perm_config)
+    for en, struct in growth.best:
+        assert utils.is_valid_struct(struct)
+        prot.struct = struct
+        assert isclose(prot.energy(), en)
+
+
+def brute_force_walks(n : int) -> list:
+    '''
+    All the self avoiding walks of n monomers starting in [0,0] (all the orientations), by brute force.
+    '''
+    walks = [[(0,0)]]
+    for _ in range(n-1):
+        walks = [w + [(w[-1][0]+dx, w[-1][1]+dy)] for w in walks for dx,dy in ((1,0),(0,1),(-1,0),(0,-1))
+                 if (w[-1][0]+dx, w[-1][1]+dy) not in w]
+    return walks
+
+
+def test_exact_enumeration_ground_state():
+    '''
+    Test the exact enumeration against a brute force enumeration of all the walks.
+
+    GIVEN: a short HP sequence
+    WHEN: I enumerate its conformations modulo the lattice symmetries
+    THEN: I expect the number of walks of the brute force reduced by the 8 symmetries (the 4 straight walks
+    only by the rotations), the same min energy and the ground state structures valid, with that energy and
+    all different up to the symmetries
+    '''
+    exact_config = utils.Configuration(configuration)
+    exact_config.seq = 'HPHPPHHPH'
+    exact_config.exact_workers = 1
+    exact_config.progress = 'silent'
+    enum = ExactEnumeration(exact_config)
+    enum.run()
+
+    prot = p.Protein(exact_config)
+    energies = []
+    walks = brute_force_walks(len(exact_config.seq))
+    for walk in walks:
+        prot.struct = [list(site) for site in walk]
+        energies.append(prot.energy())
+    assert enum.walks == (len(walks) - 4)//8 + 1
+    assert enum.min_energy == min(energies)
+    assert enum.degeneracy == len(enum.structs) > 0
+    for struct in enum.structs:
+        assert utils.is_valid_struct(struct)
+        prot.struct = struct
+        assert prot.energy() == enum.min_energy
+    assert len({utils.canonical_key(struct) for struct in enum.structs}) == enum.degeneracy
+
+
+def test_exact_enumeration_pool():
+    '''
+    Test that the exact enumeration split among a pool of processes gives the same results of a single process.
+
+    GIVEN: the default sequence of the configuration (11 monomers)
+    WHEN: I enumerate it with 1 and 2 workers
+    THEN: I expect the same counts per energy (5513 conformations), degeneracy and ground state structures
+    '''
+    results = []
+    for workers in (1, 2):
+        exact_config = utils.Configuration(configuration)
+        exact_config.seq = 'MKLYETAMTPS'
+        exact_config.exact_workers = workers
+        exact_config.progress = 'silent'
+        enum = ExactEnumeration(exact_config)
+        enum.run()
+        results.append(enum)
+    assert results[0].walks == 5513
+    assert results[0].counts == results[1].counts
+    assert results[0].degeneracy == results[1].degeneracy
+    assert results[0].structs == results[1].structs
+
+
+@hypothesis.given(seq = hypothesis.strategies.text(alphabet = 'HP', min_size = 4, max_size = 11))
+@hypothesis.settings(max_examples = 20, deadline = None)
+def test_branch_bound_exact_ground_state(seq):
+    '''
+    Test that the branch and bound proves the ground state found by the exact enumeration.
+
+    GIVEN: a short random HP sequence
+    WHEN: I search its ground state with the branch and bound and enumerate all its conformations
+    THEN: I expect the search to end before the time limit with a valid structure of the exact ground state energy,
+    equal to the proven lower bound
+    '''
+    bb_config = utils.Configuration(configuration)
+    bb_config.seq = seq
+    bb_config.exact_workers = 1
+    bb_config.progress = 'silent'
+    search = BranchAndBound(bb_config)
+    search.run()
+    enum = ExactEnumeration(bb_config)
+    enum.run()
+    assert search.optimal
+    assert search.best_energy == search.lower_bound == enum.min_energy
+    assert utils.is_valid_struct(search.best_struct)
+    prot = p.Protein(bb_config)
+    prot.struct = search.best_struct
+    assert prot.energy() == search.best_energy
+
+
+def test_branch_bound_time_limit():
+    '''
+    Test the bound reported when the search is stopped by the time limit.
+
+    GIVEN: a long sequence and no time to search
+    WHEN: I run the branch and bound
+    THEN: I expect it not to be proven optimal, with a valid best structure (the first descent is completed), a
+    lower bound not above its energy and not below the max number of H-H contacts
+    '''
+    bb_config = utils.Configuration(configuration)
+    bb_config.seq = 'PPPHHPPHHPPPPPHHHHHHHPPHHPPPPHHPPHPP'
+    bb_config.bb_time_limit = 0.
+    bb_config.progress = 'silent'
+    search = BranchAndBound(bb_config)
+    search.run()
+    assert not search.optimal
+    assert utils.is_valid_struct(search.best_struct)
+    assert len(search.best_struct) == len(bb_config.seq)
+    assert search.lower_bound <= search.best_energy
+    assert search.lower_bound >= -utils.max_hh_contacts(bb_config.seq)
+
+
+def test_protein_3d_evolution_valid_struct():
+    '''
+    Test the evolution in the cubic lattice: the structure must stay a valid 3D SAW and the incremental energy
+    must be equal to the full one (checked at each step by the debug flag).
+
+    GIVEN: a protein of a long HP sequence in the cubic lattice
+    WHEN: I evolve the system with the debug flag active
+    THEN: I expect a valid structure with x, y, z coordinates and the energy equal to the reference one
+    '''
+    random.seed(2024)
+    config_3d = utils.Configuration(configuration)
+    config_3d.seq = seq1
+    config_3d.use_struct = False
+    config_3d.folds = 1000
+    config_3d.debug = True
+    prot = Protein3D(config_3d)
+    prot.evolution()
+    assert utils.is_valid_struct(prot.struct)
+    assert utils.is_valid_struct(np.array(prot.struct))
+    assert all(len(mon) == 3 for mon in prot.struct)
+    assert prot.min_en < 0
+    assert isclose(prot.energy(), reference_energy(prot))
+    assert prot.get_z_coordinates() == [mon[2] for mon in prot.struct]
+
+
+def test_protein_3d_get_neig():
+    '''
+    Test the neighbours in the cubic lattice, which can also be along the z axis.
+
+    GIVEN: the structure of a 3D cube corner (0,0,0)-(1,0,0)-(1,1,0)-(1,1,1)-(0,1,1)-(0,0,1) of HHPHPH
+    WHEN: I look for the neighbors of the first monomer
+    THEN: I expect the last monomer (z axis) and the 5th (diagonal, not a neighbour) excluded
+    '''
+    config_3d = utils.Configuration(configuration)
+    config_3d.seq = 'HHPHPH'
+    config_3d.use_struct = True
+    config_3d.struct = [[0,0,0],[1,0,0],[1,1,0],[1,1,1],[0,1,1],[0,0,1]]
+    prot = Protein3D(config_3d)
+    assert prot.get_neig_of(0) == 'H'
+    assert prot.get_neig_of(1) == ''
+    assert isclose(prot.energy(), -1.)
+
+
+def test_history_stride_aggregate():
+    '''
+    Test the records of the evolution taken every record_stride steps with the aggregation of the windows.
+
+    GIVEN: the same protein evolved with the same seed recording every step and every 7 steps (aggregated)
+    WHEN: I compare the two histories
+    THEN: I expect the strided records equal to the state at the end of each window (and at the last step),
+    with the min, mean and max equal to the ones of the full records in the window
+    '''
+    prots = []
+    for stride in (1, 7):
+        random.seed(77)
+        hist_config = utils.Configuration(configuration)
+        hist_config.seq = seq1
+        hist_config.use_struct = False
+        hist_config.folds = 100
+        hist_config.record_stride = stride
+        hist_config.record_aggregate = stride > 1
+        prot = p.Protein(hist_config)
+        prot.evolution()
+        prots.append(prot)
+    full, strided = prots[0].history, prots[1].history
+    assert len(full) == 101
+    assert strided.step.tolist() == list(range(0, 100, 7)) + [100]
+    assert np.array_equal(strided.energy, full.energy[strided.step])
+    assert np.array_equal(strided.T, full.T[strided.step])
+    for k in range(1, len(strided)):
+        window = full.energy[strided.step[k-1]+1 : strided.step[k]+1]
+        assert strided.energy_min[k] == window.min()
+        assert strided.energy_max[k] == window.max()
+        assert isclose(strided.energy_mean[k], window.mean())
+
+
+def test_history_grows():
+    '''
+    Test that the preallocated arrays of the history are enlarged when more records than expected are added.
+
+    GIVEN: a history preallocated for 3 steps
+    WHEN: I add 10 steps
+    THEN: I expect all the 10 records
+    '''
+    history = History(3)
+    for i in range(10):
+        history.add(i, -float(i), 2.*i, 1.)
+    assert len(history) == 10
+    assert history.energy.tolist() == [-float(i) for i in range(10)]
+    assert history.step.dtype == np.int64
+
+
+def test_history_pickles_records_only():
+    '''
+    Test that a pickled history saves only its records and gets back its capacity when loaded.
+
+    GIVEN: a history preallocated for 100000 steps with 5 records
+    WHEN: I pickle and load it, then add more steps
+    THEN: I expect a pickle much smaller than the preallocated arrays, the same records and aggregates,
+    the same capacity and the new records after the loaded ones
+    '''
+    history = History(100000, stride=2, aggregate=True)
+    for i in range(11):
+        history.add(i, -float(i), 2.*i, 1.)
+    data = pickle.dumps(history)
+    assert len(data) < 10000
+    loaded = pickle.loads(data)
+    assert len(loaded) == 5
+    for name in History.FIELDS + History.AGGREGATES:
+        assert getattr(loaded, name).tolist() == getattr(history, name).tolist()
+    assert len(loaded._arrays['energy']) == len(history._arrays['energy'])
+    loaded.add(11, -11., 22., 1.)
+    loaded.flush()
+    assert loaded.step.tolist() == [1, 3, 5, 7, 9, 11]
+    assert loaded.energy_min[-1] == -11.
+
+
+def test_batch_contacts_matches_protein():
+    '''
+    Test the vectorised validity check and H-H contacts count of a batch of folds.
+
+    GIVEN: the structures of an evolving protein and batches of random pivot/diagonal folds of them
+    WHEN: I evaluate each batch with tail_fold_batch and batch_contacts
+    THEN: I expect the validity given by is_valid_struct and the contacts of the reference energy for the valid ones,
+    and only valid folds from batch_tail_folds
+    '''
+    random.seed(246)
+    prot = p.Protein(config)
+    prot.seq = seq1
+    prot.struct = utils.linear_struct(seq1)
+    prot.n = len(seq1)
+    h = np.array([mon == 'H' for mon in seq1])
+    for _ in range(30):
+        struct = np.array(prot.struct)
+        indices = np.array([random.randint(1, prot.n-2) for _ in range(8)])
+        corner = np.all(np.abs(struct[indices+1] - struct[indices-1]) == 1, axis=1)
+        methods = np.array([random.randint(1, 8) if c else random.randint(1, 7) for c in corner])
+        batch = utils.tail_fold_batch(struct, indices, methods)
+        valid, hh = utils.batch_contacts(batch, h)
+        for new_struct, is_valid, count in zip(batch.tolist(), valid, hh):
+            assert is_valid == utils.is_valid_struct(new_struct)
+            if is_valid:
+                prot.struct = new_struct
+                assert -count == reference_energy(prot)
+        prot.struct = struct.tolist()
+        for new_struct in prot.batch_tail_folds(struct, 8)[2]:
+            assert utils.is_valid_struct(new_struct)
+        prot.struct = prot.random_fold()
+
+
+@pytest.mark.parametrize('engine', ['list', 'array'])
+def test_multiple_try_evolution(engine):
+    '''
+    Test the evolution with the multiple try Metropolis.
+
+    GIVEN: a protein evolved choosing each fold among 4 candidates, with the debug check of the incremental energy
+    WHEN: the evolution ends
+    THEN: I expect a valid structure with the reference energy, at least 4 folds counted per step and a lower
+    energy than the initial one
+    '''
+    random.seed(1357)
+    mtm_config = utils.Configuration(configuration)
+    mtm_config.seq = seq1
+    mtm_config.use_struct = False
+    mtm_config.folds = 500
+    mtm_config.engine = engine
+    mtm_config.pull_weight = 0.
+    mtm_config.multiple_try = 4
+    prot = p.Protein(mtm_config)
+    prot.debug = True
+    prot.evolution()
+    assert utils.is_valid_struct(prot.struct)
+    assert isclose(prot.energy(), reference_energy(prot))
+    assert min(prot.counter) >= 4
+    assert prot.min_en < 0
+
+
+def test_multiple_try_requires_pivot_moves():
+    '''
+    Test that the multiple try Metropolis cannot be configured with the pull moves.
+
+    GIVEN: a configuration with pull moves and 4 candidates per step
+    WHEN: I read it
+    THEN: I expect a ValueError
+    '''
+    mtm_configuration = configparser.ConfigParser()
+    mtm_configuration.read('config_test.txt')
+    mtm_configuration['PROCESS']['multiple_try'] = '4'
+    with pytest.raises(ValueError):
+        utils.Configuration(mtm_configuration)
+
+
+def test_canonical_key_symmetries():
+    '''
+    Test that the canonical key identifies the conformations up to the symmetries of the square lattice.
+
+    GIVEN: a valid structure
+    WHEN: I compute the canonical key of its images by the 8 symmetries of the lattice (translated)
+    and of a different structure
+    THEN: I expect the same key for all the images and a different key for the other structure
+    '''
+    struct = np.array([[0,0],[0,1],[1,1],[1,2],[1,3],[2,3],[2,2],[2,1],[2,0],[2,-1],[1,-1],[0,-1],[-1,-1]])
+    key = utils.canonical_key(struct)
+    for matrix in list(utils.FOLD_MATRICES):
+        assert utils.canonical_key(struct @ matrix.T + [3, -7]) == key
+    other = struct.copy()
+    other[-1] = [0, -2] # last monomer moved on another free site
+    assert utils.is_valid_struct(other)
+    assert utils.canonical_key(other) != key
+
+
+def test_conformation_cache_lru():
+    '''
+    Test the eviction and the statistics of the conformation cache.
+
+    GIVEN: a cache of 2 entries
+    WHEN: I store 3 entries, reading the first one before storing the third
+    THEN: I expect the second one discarded (least recently used) and the hits and misses counted
+    '''
+    cache = ConformationCache(2)
+    cache.put(b'a', 1)
+    cache.put(b'b', 2)
+    assert cache.get(b'a') == 1
+    cache.put(b'c', 3)
+    assert cache.get(b'b') is None
+    assert b'a' in cache and b'c' in cache and len(cache) == 2
+    assert cache.stats() == {'size' : 2, 'maxsize' : 2, 'hits' : 1, 'misses' : 1, 'hit_rate' : 0.5}
+
+
+def test_multiple_try_cache_same_evolution():
+    '''
+    Test that the conformation cache does not change the multiple try evolution.
+
+    GIVEN: the same protein evolved with the multiple try Metropolis with and without the cache, with the same seed
+    WHEN: the evolutions end
+    THEN: I expect the same energies and final structure, and some hits of the cache
+    '''
+    prots = []
+    for cache_size in (0, 1000):
+        random.seed(2468)
+        mtm_config = utils.Configuration(configuration)
+        mtm_config.seq = seq
+        mtm_config.use_struct = False
+        mtm_config.folds = 300
+        mtm_config.T = 0.5
+        mtm_config.annealing = False
+        mtm_config.pull_weight = 0.
+        mtm_config.multiple_try = 4
+        mtm_config.cache_size = cache_size
+        prot = p.Protein(mtm_config)
+        prot.evolution()
+        prots.append(prot)
+    assert np.array_equal(prots[0].en_evo, prots[1].en_evo)
+    assert prots[0].struct == prots[1].struct
+    assert prots[0].cache is None and prots[1].cache.hits > 0
+
+
+def test_reduce_windows_ragged_tail():
+    '''
+    Test the reduction of the windows of a series whose length is not a multiple of the window.
+
+    GIVEN: a series of 10 values and windows of 4 values
+    WHEN: I reduce the windows with the mean, min, max and last value
+    THEN: I expect 3 windows, the last one with the remaining 2 values
+    '''
+    values = np.array([3., 1., 4., 1., 5., 9., 2., 6., 5., 3.])
+    assert np.allclose(reduce_windows(values, 4, 'mean'), [9/4, 22/4, 4.])
+    assert reduce_windows(values, 4, 'min').tolist() == [1., 2., 3.]
+    assert reduce_windows(values, 4, 'max').tolist() == [4., 9., 5.]
+    assert reduce_windows(values, 4, 'last').tolist() == [1., 6., 3.]
+    assert reduce_windows(values, 1, 'mean') is values
+
+
+@hypothesis.given(n = hypothesis.strategies.integers(1, 5000), buckets = hypothesis.strategies.integers(1, 300))
+@hypothesis.settings(max_examples = 50, deadline = None)
+def test_minmax_indices_keep_extremes(n, buckets):
+    '''
+    Test the downsampling of the series for the plots.
+
+    GIVEN: a random series of n values
+    WHEN: I take the min max indices with the given number of buckets
+    THEN: I expect at most 2*buckets sorted indices in the series (all of them if the series is short),
+    including the ones of the global min and max
+    '''
+    values = np.random.default_rng(n).normal(size=n)
+    indices = minmax_indices(values, buckets)
+    assert len(indices) <= max(n if n <= 2*buckets else 0, 2*buckets)
+    assert np.all(np.diff(indices) > 0)
+    assert 0 <= indices[0] and indices[-1] < n
+    assert values[indices].min() == values.min()
+    assert values[indices].max() == values.max()
+
+
+def test_trajectory_evolution_round_trip(tmp_path):
+    '''
+    Test that the trajectory saved during the evolution can be read back, chunk by chunk and at random frames.
+
+    GIVEN: a protein evolved with a trajectory writer (a frame every 10 steps, chunks of 4 frames)
+    WHEN: I read the trajectory file
+    THEN: I expect the frames at the steps multiple of 10, with the energy and T of the history, valid structures
+    and the last frame equal to the final structure
+    '''
+    random.seed(4321)
+    prot = p.Protein(config)
+    prot.seq = seq1
+    prot.struct = utils.linear_struct(prot.seq)
+    prot.n = len(seq1)
+    prot.steps = 200
+    prot.reset_records()
+    path = str(tmp_path / 'traj.bin')
+    with TrajectoryWriter(path, prot.seq, stride=10, chunk_size=4) as writer:
+        prot.trajectory = writer
+        prot.evolution()
+    reader = TrajectoryReader(path)
+    assert reader.seq == seq1
+    assert len(reader) == 21
+    assert reader.counts == [4, 4, 4, 4, 4, 1]
+    steps = np.concatenate([chunk['step'] for chunk in reader.chunks()])
+    assert steps.tolist() == list(range(0, 201, 10))
+    energies = np.concatenate([chunk['energy'] for chunk in reader.chunks()])
+    assert np.array_equal(energies, prot.en_evo[steps])
+    for step, en, T, coords in reader.frames():
+        assert utils.is_valid_struct(coords)
+    assert reader[-1][3].tolist() == prot.struct
+    assert reader[7][0] == 70
+
+
+def test_trajectory_interrupted(tmp_path):
+    '''
+    Test that a trajectory file without the index (interrupted run) is read up to the last complete chunk.
+
+    GIVEN: a trajectory writer with chunks of 2 frames, not closed after 5 frames
+    WHEN: I read the file
+    THEN: I expect the 4 frames of the 2 complete chunks
+    '''
+    path = str(tmp_path / 'traj.bin')
+    writer = TrajectoryWriter(path, seq, chunk_size=2)
+    for k in range(5):
+        writer.append(k, correct_structure, -float(k), 1.)
+    reader = TrajectoryReader(path)
+    assert len(reader) == 4
+    assert reader[3][1] == -3.
+    assert reader[0][3].tolist() == correct_structure
+    writer.close()
+    assert len(TrajectoryReader(path)) == 5
+
+
+class InterruptedProtein(p.Protein):
+    '''
+    Protein whose evolution is interrupted (KeyboardInterrupt) after stop_after proposed folds.
+    '''
+    stop_after = None
+
+    def propose_fold(self):
+        if self.stop_after is not None:
+            if self.stop_after == 0:
+                raise KeyboardInterrupt
+            self.stop_after -= 1
+        return super().propose_fold()
+
+
+def test_checkpoint_resume_same_evolution(tmp_path):
+    '''
+    Test that an evolution interrupted and resumed from its last checkpoint is identical to an uninterrupted one,
+    also for the trajectory saved on disk.
+
+    GIVEN: the same protein evolved with the same seed, once without interruptions and once interrupted at the
+    step 250 with checkpoints every 100 steps
+    WHEN: I resume the interrupted evolution from the checkpoint (step 200)
+    THEN: I expect the same final structure, records, best structures and trajectory
+    '''
+    runs = []
+    for interrupted in (False, True):
+        random.seed(555)
+        prot = InterruptedProtein(config)
+        prot.seq = seq1
+        prot.struct = utils.linear_struct(prot.seq)
+        prot.n = len(seq1)
+        prot.steps = 300
+        prot.reset_records()
+        prot.trajectory = TrajectoryWriter(str(tmp_path / f'traj_{interrupted}.bin'), prot.seq, stride=7, chunk_size=5)
+        if interrupted:
+            prot.checkpoint = str(tmp_path / 'checkpoint.pkl')
+            prot.checkpoint_interval = 100
+            prot.stop_after = 250
+            try:
+                prot.evolution()
+            except KeyboardInterrupt:
+                pass
+            random.seed(0) # the random state is restored by the checkpoint
+            prot = p.Protein.load_checkpoint(prot.checkpoint)
+            assert prot.evo_step == 200
+            prot.stop_after = None
+        prot.evolution()
+        prot.trajectory.close()
+        runs.append(prot)
+    assert runs[1].struct == runs[0].struct
+    assert np.array_equal(runs[1].en_evo, runs[0].en_evo)
+    assert np.array_equal(runs[1].T, runs[0].T)
+    assert runs[1].min_en_struct == runs[0].min_en_struct
+    assert runs[1].counter == runs[0].counter
+    traj = [open(tmp_path / f'traj_{interrupted}.bin', 'rb').read() for interrupted in (False, True)]
+    assert traj[1] == traj[0]
+
+
+def test_log_reporter_rate_limited():
+    '''
+    Test the structured progress report of the evolution: with a long interval only the last step is reported.
+
+    GIVEN: a protein evolved with a log reporter with an interval of 1000 seconds
+    WHEN: I read the lines written by the reporter
+    THEN: I expect one json line for the last step with the acceptance rate and the energies of the protein
+    '''
+    random.seed(8)
+    prot = p.Protein(config)
+    prot.steps = 300
+    stream = io.StringIO()
+    prot.reporter = progress.LogReporter(interval=1000., stream=stream)
+    prot.evolution()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    report = json.loads(lines[0])
+    assert report['step'] == report['total'] == 300
+    assert 0 < report['acceptance'] <= 1
+    assert report['energy'] == prot.energy()
+    assert report['best_energy'] == prot.min_en
+    assert report['steps_per_second'] > 0
+
+
+def test_silent_reporter(capsys):
+    '''
+    Test that the silent reporter does not print anything during the evolution.
+
+    GIVEN: a protein with the silent reporter
+    WHEN: I evolve it
+    THEN: I expect no output on terminal
+    '''
+    prot = p.Protein(config)
+    prot.reporter = progress.get_reporter('silent')
+    capsys.readouterr()
+    prot.evolution()
+    assert capsys.readouterr().out == ''
+
+
+def test_sampling_modes_reporters(capsys):
+    '''
+    Test that the sampling modes report their progress with the configured reporter.
+
+    GIVEN: the test configuration with the log reporter and a long interval, and then with the silent one
+    WHEN: I run PERM, Wang-Landau and the replica exchange
+    THEN: I expect one json line for the last tour, stage or round of each mode with the best energy found,
+    and no output with the silent reporter
+    '''
+    random.seed(5)
+    mode_config = utils.Configuration(configuration)
+    mode_config.seq = 'HPHPPHHPHPPH'
+    mode_config.progress, mode_config.progress_interval = 'log', 1000.
+    mode_config.perm_tours = 50
+    mode_config.wl_ln_f_final = 0.1
+    mode_config.wl_check_interval = 1000
+    mode_config.folds, mode_config.replicas, mode_config.swap_interval, mode_config.workers = 100, 2, 50, 1
+    capsys.readouterr()
+    for mode, total in ((PERM(mode_config), 50), (WangLandau(mode_config), 4), (ReplicaExchange(mode_config), 2)):
+        capsys.readouterr()
+        mode.run()
+        lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+        assert len(lines) == 1
+        report = json.loads(lines[0])
+        assert report['step'] == report['total'] == total
+        assert report['best_energy'] <= 0
+
+    mode_config.progress = 'silent'
+    for mode in (PERM(mode_config), WangLandau(mode_config), ReplicaExchange(mode_config)):
+        capsys.readouterr()
+        mode.run()
+        assert capsys.readouterr().out == ''
+
+
+def test_cli_fold_headless(tmp_path):
+    '''
+    Test that the fold command of the command line interface runs without importing matplotlib and saves the results.
+
+    GIVEN: the test configuration
+    WHEN: I run python -m main fold in a new process, without plots
+    THEN: I expect matplotlib not imported and the results saved, with a valid min energy structure
+    '''
+    code = ('import sys, main; main.main(["fold", "config_test.txt", "--output", sys.argv[1]]); '
+            'assert "matplotlib" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code, str(tmp_path)], check=True, capture_output=True)
+    with open(tmp_path / 'results.json') as f:
+        results = json.load(f)
+    assert results['mode'] == 'metropolis'
+    assert utils.is_valid_struct(results['min_en_struct'])
+    prot = p.Protein.load_checkpoint(str(tmp_path / 'protein.pkl'))
+    assert prot.min_en == results['min_energy']
+
+
+def test_render_frames_reuse_artists(tmp_path):
+    '''
+    Test that the renderer reuses its artists and that the frames rendered in a pool of processes are the same
+    rendered in the main process.
+
+    GIVEN: a few structures of the same protein
+    WHEN: I render them with 1 and 2 workers, save them as snapshots and as gif
+    THEN: I expect png frames identical in the two cases, a constant number of artists, one file per step and a gif
+    '''
+    structures = [correct_structure, utils.linear_struct(seq), correct_structure[::-1]]
+    renderer = render.StructureRenderer(seq, dpi=50)
+    n_artists = len(renderer.ax.get_children())
+    for struct in structures:
+        renderer.draw(struct)
+    assert len(renderer.ax.get_children()) == n_artists
+    frames = render.render_frames(seq, structures, dpi=50, fmt='png')
+    assert all(frame[:8] == b'\x89PNG\r\n\x1a\n' for frame in frames)
+    assert render.render_frames(seq, structures, dpi=50, workers=2, fmt='png') == frames
+    files = render.save_snapshots(seq, structures, [0, 10, 20], str(tmp_path), dpi=50)
+    assert [f.split('/')[-1] for f in files] == ['structure_step_0.png', 'structure_step_10.png', 'structure_step_20.png']
+    render.save_gif(render.render_frames(seq, structures, dpi=50, workers=2), str(tmp_path / 'evo.gif'))
+    assert open(tmp_path / 'evo.gif', 'rb').read(6) == b'GIF89a'
+
+
+def test_benchmark_json_results():
+    '''
+    Test the benchmark suite on a short chain with few calls.
+
+    GIVEN: the sequence of the test configuration
+    WHEN: I benchmark its first 11 monomers and compare the results with themselves
+    THEN: I expect json serializable results with a positive rate for each hot path and evolution, and a speedup of
+    1 for each benchmark
+    '''
+    bench_config = utils.Configuration(configuration)
+    results = benchmark.run_benchmarks(bench_config, (11,), seed=1, warmup=100, steps=50, number=10, repeat=2)
+    results = json.loads(json.dumps(results))
+    names = ('energy', 'compactness', 'get_neig_of', 'random_fold', 'is_valid_struct', 'tail_fold') + \
+        tuple(benchmark.EVOLUTIONS)
+    rates = benchmark.rates(results)
+    for name in names:
+        assert rates[('11', name)] > 0
+    speedup = benchmark.compare(results, results)
+    assert len(speedup) == len(names)
+    assert all(ratio == pytest.approx(1.) for ratio in speedup.values())
+
+
+@pytest.mark.parametrize('multiple_try', [1, 4])
+def test_profiled_evolution(multiple_try, tmp_path):
+    '''
+    Test the per-phase profiling of the evolution.
+
+    GIVEN: two proteins evolved with the same seed, one of them with the profiler (cProfile included) and
+    checkpoints saved during the evolution
+    WHEN: the evolutions end
+    THEN: I expect the same evolution, the counters consistent with Protein.counter and the accepted moves, the
+    phases measured within the wall time and the cProfile functions reported
+    '''
+    prots = []
+    for profile in (False, True):
+        random.seed(2468)
+        prof_config = utils.Configuration(configuration)
+        prof_config.seq = seq1
+        prof_config.use_struct = False
+        prof_config.folds = 300
+        prof_config.pull_weight = 0.
+        prof_config.multiple_try = multiple_try
+        prof_config.profile = profile
+        prof_config.profile_cprofile = profile
+        prof_config.checkpoint = str(tmp_path / 'checkpoint.pkl') if profile else None
+        prof_config.checkpoint_interval = 100
+        prot = p.Protein(prof_config)
+        prot.evolution()
+        prots.append(prot)
+    assert prots[0].profiler is None
+    assert np.array_equal(prots[0].en_evo, prots[1].en_evo)
+
+    report = prots[1].profiler.report()
+    assert report['steps'] == 300
+    assert report['proposals'] == sum(prots[1].counter)
+    assert report['collisions'] == sum(prots[1].counter) - 300*multiple_try
+    assert report['accepted'] + report['metropolis_rejections'] == 300
+    assert sum(report['times'].values()) == pytest.approx(report['wall_time'])
+    assert all(t >= 0 for t in report['times'].values())
+    assert report['times']['proposal'] > 0 and report['times']['bookkeeping'] > 0
+    assert any('random_fold' in f['function'] or 'batch_tail_folds' in f['function'] for f in report['functions'])
+    json.dumps(report)
+
+
+def test_branch_bound_requires_positive_time_limit():
+    '''
+    Test that the branch and bound cannot be configured without time to search.
+
+    GIVEN: a configuration with a null time limit of the branch and bound
+    WHEN: I read it
+    THEN: I expect a ValueError
+    '''
+    bb_configuration = configparser.ConfigParser()
+    bb_configuration.read('config_test.txt')
+    bb_configuration['branch_bound']['time_limit'] = '0'
+    with pytest.raises(ValueError):
+        utils.Configuration(bb_configuration)
+
+
+@pytest.mark.parametrize('key, value', [('keep', '0'), ('tours', '0'), ('time_limit', '0')])
+def test_perm_config_ranges(key, value):
+    '''
+    Test that the PERM cannot be configured without structures to keep, tours or time.
+
+    GIVEN: a configuration with a null keep, tours or time limit of the PERM
+    WHEN: I read it
+    THEN: I expect a ValueError
+    '''
+    perm_configuration = configparser.ConfigParser()
+    perm_configuration.read('config_test.txt')
+    perm_configuration['perm'][key] = value
+    with pytest.raises(ValueError):
+        utils.Configuration(perm_configuration)
+
+
+def test_trajectory_writer_closed_pickle(tmp_path):
+    '''
+    Test that a protein with a closed trajectory writer is loaded without its trajectory file.
+
+    GIVEN: a protein saved with the writer of its trajectory, already closed, and the trajectory file deleted
+    WHEN: I load the protein
+    THEN: I expect no error, the path of the trajectory kept and closing the writer again doing nothing
+    '''
+    prot = p.Protein(config)
+    path = str(tmp_path / 'traj.bin')
+    prot.trajectory = TrajectoryWriter(path, prot.seq, chunk_size=2)
+    prot.trajectory.append(0, prot.struct, prot.energy(), 1.)
+    prot.trajectory.close()
+    prot.save_checkpoint(str(tmp_path / 'protein.pkl'))
+    (tmp_path / 'traj.bin').unlink()
+    loaded = p.Protein.load_checkpoint(str(tmp_path / 'protein.pkl'))
+    assert loaded.trajectory.path == path
+    loaded.trajectory.close()
+    assert not (tmp_path / 'traj.bin').exists()
+
+
+def test_render_gif_frames_shared_palette():
+    '''
+    Test that the gif frames rendered in a pool of processes share the palette of the first frame.
+
+    GIVEN: a few structures of the same protein
+    WHEN: I render them as gif frames with 1 and 3 workers
+    THEN: I expect the same palette for all the frames and the same frames in the two cases
+    '''
+    structures = [correct_structure, utils.linear_struct(seq), correct_structure[::-1], utils.linear_struct(seq)]
+    serial = render.render_frames(seq, structures, dpi=50)
+    pooled = render.render_frames(seq, structures, dpi=50, workers=3)
+    palette = serial[0].getpalette()
+    for frame_serial, frame_pooled in zip(serial, pooled):
+        assert frame_pooled.getpalette() == palette
+        assert frame_pooled.tobytes() == frame_serial.tobytes()
+
+
+@pytest.mark.parametrize('section, key, value', [('wang_landau', 'flatness', '1'), ('wang_landau', 'flatness', '0'),
+                                                 ('wang_landau', 'ln_f_final', '0'), ('perm', 'c_minus', '5'),
+                                                 ('exact', 'max_structs', '0'), ('perm', 'tours', 'many'),
+                                                 ('replica_exchange', 'swap_interval', '0'),
+                                                 ('replica_exchange', 'T_min', '0'), ('replica_exchange', 'T_max', '0.1'),
+                                                 ('replica_exchange', 'replicas', '1'),
+                                                 ('replica_exchange', 'workers', '-1')])
+def test_config_section_ranges(section, key, value):
+    '''
+    Test the typed reading and the range checks of the parameters of the sampling modes.
+
+    GIVEN: a configuration with a parameter of a mode out of its range or not a number
+    WHEN: I read it
+    THEN: I expect a ValueError
+    '''
+    mode_configuration = configparser.ConfigParser()
+    mode_configuration.read('config_test.txt')
+    mode_configuration[section][key] = value
+    with pytest.raises(ValueError):
+        utils.Configuration(mode_configuration)
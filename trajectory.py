@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from bisect import bisect_right
+import struct as _struct
+import os
+import numpy as np
+
+
+# Binary trajectory file (little endian):
+#   header : MAGIC, n (int32), dimension (int32), HP sequence (n bytes)
+#   chunks : count (int64), step (int64 x count), energy (float64 x count), T (float64 x count),
+#            coordinates (int16 x count*n*dimension)
+#   index  : number of chunks (int64), offsets of the chunks (int64 each), counts of the chunks (int64 each)
+#   footer : offset of the index (int64), INDEX_MAGIC
+# The index is written when the file is closed; a file without it (interrupted run) is indexed by scanning the chunks.
+MAGIC = b'HPTRAJ1\0'
+INDEX_MAGIC = b'HPTRIDX\0'
+_FOOTER = 16 # bytes of the footer
+
+
+class TrajectoryWriter():
+    '''
+    Streaming writer of the trajectory of a protein: every stride steps the evolution appends the step, the
+    structure (int16 coordinates), the energy and the temperature. The frames are buffered in preallocated arrays
+    and written on disk in chunks of chunk_size frames, so the memory used does not grow with the run.\n
+    It can be used as a context manager, the file is completed with the index of the chunks when closed.
+
+    Parameters
+    ----------
+    path : str
+        File of the trajectory (overwritten).
+    seq : str
+        HP sequence of the protein.
+    dimension : int, optional
+        Number of coordinates of each monomer (2 or 3). The default is 2.
+    stride : int, optional
+        Steps between two frames, used by Protein.evolution. The default is 100.
+    chunk_size : int, optional
+        Frames of each chunk. The default is 1000.
+    '''
+
+    def __init__(self, path : str, seq : str, dimension : int = 2, stride : int = 100, chunk_size : int = 1000) -> None:
+        if stride < 1 or chunk_size < 1:
+            raise ValueError('The stride and the chunk size of the trajectory must be at least 1')
+        self.path = path
+        self.n = len(seq)
+        self.dimension = dimension
+        self.stride = stride
+        self.chunk_size = chunk_size
+        self.frames = 0 # frames written (or buffered)
+        self._offsets = [] # offsets of the chunks in the file
+        self._counts = [] # frames of each chunk
+        self._step = np.empty(chunk_size, dtype='<i8')
+        self._energy = np.empty(chunk_size, dtype='<f8')
+        self._T = np.empty(chunk_size, dtype='<f8')
+        self._coords = np.empty((chunk_size, self.n, dimension), dtype='<i2')
+        self._count = 0 # frames in the buffer
+        self._closed = False
+        self._position = None # size of the file at the checkpoint, for a writer restored and not reopened yet
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + _struct.pack('<ii', self.n, dimension) + seq.encode('ascii'))
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+    def __getstate__(self) -> dict:
+        '''
+        State saved in the checkpoints of the evolution (and in the protein saved by the fold): the open file is
+        replaced by its current size. The restored writer reopens the file only when it writes again (a resumed
+        evolution), so a closed writer, e.g. the one of a protein loaded to plot it, never needs the file.
+        '''
+        state = self.__dict__.copy()
+        state['_file'] = None
+        if self._file is not None and not self._closed:
+            self._file.flush()
+            state['_position'] = self._file.tell()
+        return state
+
+
+    def _reopen(self) -> None:
+        '''
+        Reopen the file of a restored writer, discarding what was written after the checkpoint.
+        '''
+        if self._file is None:
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(self._position)
+            self._file.seek(self._position)
+            self._position = None
+
+
+    def append(self, step : int, struct, en : float, T : float) -> None:
+        '''
+        Append a frame to the trajectory.
+
+        Parameters
+        ----------
+        step : int
+            Step of the evolution.
+        struct : list or np.ndarray
+            Structure of the protein (coordinates in the int16 range).
+        en : float
+            Energy of the structure.
+        T : float
+            Temperature at the step.
+        '''
+        coords = np.asarray(struct)
+        if np.abs(coords).max() > np.iinfo(np.int16).max:
+            raise ValueError('The coordinates of the structure are out of the int16 range of the trajectory')
+        k = self._count
+        self._step[k] = step
+        self._energy[k] = en
+        self._T[k] = T
+        self._coords[k] = coords
+        self._count += 1
+        self.frames += 1
+        if self._count == self.chunk_size:
+            self._write_chunk()
+
+
+    def _write_chunk(self) -> None:
+        '''
+        Write the buffered frames as a chunk (flushed, so an interrupted run keeps the complete chunks).
+        '''
+        k = self._count
+        if k == 0:
+            return
+        self._reopen()
+        self._offsets.append(self._file.tell())
+        self._counts.append(k)
+        self._file.write(_struct.pack('<q', k))
+        for arr in (self._step, self._energy, self._T, self._coords):
+            self._file.write(arr[:k].tobytes())
+        self._file.flush()
+        self._count = 0
+
+
+    def close(self) -> None:
+        '''
+        Write the last chunk, the index of the chunks and close the file.
+        '''
+        if self._closed:
+            return
+        self._reopen()
+        self._write_chunk()
+        index_offset = self._file.tell()
+        n_chunks = len(self._offsets)
+        self._file.write(_struct.pack(f'<q{n_chunks}q{n_chunks}q', n_chunks, *self._offsets, *self._counts))
+        self._file.write(_struct.pack('<q', index_offset) + INDEX_MAGIC)
+        self._file.close()
+        self._closed = True
+
+
+class TrajectoryReader():
+    '''
+    Reader of a trajectory written by TrajectoryWriter. Nothing is loaded when it is opened: the chunks are
+    memory mapped when required, so a long trajectory can be replayed chunk by chunk or accessed at random frames.
+
+    Parameters
+    ----------
+    path : str
+        File of the trajectory.
+    '''
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            head = f.read(len(MAGIC) + 8)
+            if head[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{path} is not a trajectory file')
+            self.n, self.dimension = _struct.unpack('<ii', head[len(MAGIC):])
+            self.seq = f.read(self.n).decode('ascii')
+            self._data_start = f.tell()
+            self.offsets, self.counts = self._read_index(f)
+        self._first = np.concatenate(([0], np.cumsum(self.counts, dtype=np.int64))).tolist() # first frame of each chunk
+
+
+    def _read_index(self, f) -> tuple:
+        '''
+        Offsets and counts of the chunks, from the index or scanning the chunks if the file was not closed.
+        '''
+        size = os.fstat(f.fileno()).st_size
+        if size >= self._data_start + _FOOTER:
+            f.seek(size - _FOOTER)
+            footer = f.read(_FOOTER)
+            if footer[8:] == INDEX_MAGIC:
+                f.seek(_struct.unpack('<q', footer[:8])[0])
+                n_chunks = _struct.unpack('<q', f.read(8))[0]
+                index = _struct.unpack(f'<{2*n_chunks}q', f.read(16*n_chunks))
+                return list(index[:n_chunks]), list(index[n_chunks:])
+
+        offsets, counts = [], [] # interrupted run: only the complete chunks are used
+        offset = self._data_start
+        while offset + 8 <= size:
+            f.seek(offset)
+            k = _struct.unpack('<q', f.read(8))[0]
+            end = offset + 8 + k*self._frame_bytes
+            if k <= 0 or end > size:
+                break
+            offsets.append(offset)
+            counts.append(k)
+            offset = end
+        return offsets, counts
+
+
+    @property
+    def _frame_bytes(self) -> int:
+        return 8 + 8 + 8 + 2*self.n*self.dimension
+
+
+    def __len__(self) -> int:
+        return self._first[-1]
+
+
+    def chunk(self, c : int) -> dict:
+        '''
+        Memory mapped arrays of the c-th chunk: 'step', 'energy', 'T' and 'coords' (frames, n, dimension).
+        '''
+        k = self.counts[c]
+        offset = self.offsets[c] + 8
+        arrays = {}
+        for name,dtype,shape in (('step', '<i8', (k,)), ('energy', '<f8', (k,)), ('T', '<f8', (k,)),
+                                 ('coords', '<i2', (k, self.n, self.dimension))):
+            arrays[name] = np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            offset += arrays[name].nbytes
+        return arrays
+
+
+    def chunks(self):
+        '''
+        Generator of the chunks of the trajectory (see chunk), read lazily one at a time.
+        '''
+        for c in range(len(self.counts)):
+            yield self.chunk(c)
+
+
+    def frames(self):
+        '''
+        Generator of the frames of the trajectory as (step, energy, T, coordinates).
+        '''
+        for chunk in self.chunks():
+            for k in range(len(chunk['step'])):
+                yield int(chunk['step'][k]), float(chunk['energy'][k]), float(chunk['T'][k]), np.array(chunk['coords'][k])
+
+
+    def __getitem__(self, i : int) -> tuple:
+        '''
+        Random access to the i-th frame as (step, energy, T, coordinates).
+        '''
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Frame index out of range')
+        c = bisect_right(self._first, i) - 1
+        chunk = self.chunk(c)
+        k = i - self._first[c]
+        return int(chunk['step'][k]), float(chunk['energy'][k]), float(chunk['T'][k]), np.array(chunk['coords'][k])
@@ -5,30 +5,50 @@
 from math import sqrt, isclose
 import random
 import json
+import numpy as np
+
+
+# 2x2 integer matrices of the rigid transformations of tail_fold (index = method, 0 is the identity).
+# They act on the coordinates as column vectors, so a (n,2) structure is transformed as struct @ FOLD_MATRICES[method].T
+FOLD_MATRICES = np.array([
+    [[1, 0], [0, 1]], # 0: identity
+    [[0, 1], [-1, 0]], # 1: 90° clockwise rotation
+    [[0, -1], [1, 0]], # 2: 90° anticlockwise rotation
+    [[-1, 0], [0, -1]], # 3: 180° rotation
+    [[1, 0], [0, -1]], # 4: x-axis reflection
+    [[-1, 0], [0, 1]], # 5: y-axis reflection
+    [[0, -1], [-1, 0]], # 6: 1 and 3 quadrant bisector symmetry
+    [[0, 1], [1, 0]], # 7: 2 and 4 quadrant bisector symmetry
+])
 
 
 def is_valid_struct(struct : list) -> bool:
     '''
-    Check if the structure inserted is valid: is SAW (self avoid walk) and distances between consecutive elements are 1.
+    Check if the structure inserted is valid: is SAW (self avoid walk) and distances between consecutive elements are 1.\n
+    The structure can also be a (n,2) integer numpy array, in this case the check is vectorised.
 
     Parameters
     ----------
-    struct : list
-        Structur of the protein containing x and y coordinate in a list.
+    struct : list or np.ndarray
+        Structur of the protein containing x and y (and z for the cubic lattice) coordinate in a list.
 
     Returns
     -------
     bool
         True if the structure is valid, False if is not.
     '''
-    unique_struct = [] # counter of the monomer positions
+    if isinstance(struct, np.ndarray):
+        return _is_valid_struct_array(struct)
+
+    unique_struct = set() # counter of the monomer positions
     n = len(struct) # length of the sequence
     
     for i in range(n):
-        if struct[i] in unique_struct:
+        site = tuple(struct[i])
+        if site in unique_struct:
             return False
         else:
-            unique_struct.append(struct[i])
+            unique_struct.add(site)
         
         if (i<n-1): # check distance between the monomer i and the following one
             if not isclose(get_dist(struct[i], struct[i+1]),1):
@@ -37,6 +57,18 @@ def is_valid_struct(struct : list) -> bool:
     return True
 
 
+def _is_valid_struct_array(struct : np.ndarray) -> bool:
+    '''
+    Vectorised version of is_valid_struct for a (n,2) integer array.
+    '''
+    n = len(struct)
+    if n > 1 and not np.all(np.abs(np.diff(struct, axis=0)).sum(axis=1) == 1): # unit steps only
+        return False
+    rel = struct - struct[0] + (n - 1) # with unit steps every coordinate is in [0, 2n-2]
+    keys = np.ravel_multi_index(rel.T, (2*n - 1,)*struct.shape[1]) # one integer key per lattice site
+    return len(np.unique(keys)) == n
+
+
 def is_valid_sequence(seq : str) -> bool:
     '''
     Check if the protein sequence contains only H and/or P and its lengths is almost 3.
@@ -93,21 +125,21 @@ def linear_struct(seq : str) -> list:
 
 def get_dist(coord1 : list, coord2 : list) -> float:
     '''
-    Compute the distance of two points in the lattice
+    Compute the distance of two points in the lattice (square or cubic)
 
     Parameters
     ----------
     coord1 : list
-        a and y coordinate in the lattice of the first monomer.
+        x and y (and z) coordinates in the lattice of the first monomer.
     coord2 : list
-        a and y coordinate in the lattice of the second monomer.
+        x and y (and z) coordinates in the lattice of the second monomer.
 
     Returns
     -------
     float
         Euclidean distance as a float.
     '''
-    dist = sqrt((coord1[0]-coord2[0])**2 + (coord1[1]-coord2[1])**2)
+    dist = sqrt(sum((c1-c2)**2 for c1,c2 in zip(coord1, coord2)))
     return dist
 
 
@@ -194,6 +226,148 @@ def tail_fold(struct : list, method : int, previous : list) -> list:
     return new_tail
 
 
+def tail_fold_array(struct : np.ndarray, method : int, previous) -> np.ndarray:
+    '''
+    Same as tail_fold, but for a structure stored as a (n,2) integer numpy array.\n
+    The rigid transformations (methods 1-7) are applied in one vectorised operation using the FOLD_MATRICES table.
+
+    Parameters
+    ----------
+    struct : np.ndarray
+        Structure of the sequence starting in [0,0], with shape (n,2).
+    method : int
+        The method to apply to the structure (see tail_fold).
+    previous : list
+        x and y coordinates of the previous monomer shifted such that the first monomer of struct is [0,0]
+
+    Returns
+    -------
+    np.ndarray
+        The structure transformed (new array).
+    '''
+    if method == 8: # movement on the digonal
+        return diagonal_move(struct.copy(), previous)
+    return struct @ FOLD_MATRICES[method].T
+
+
+def tail_fold_batch(struct : np.ndarray, indices : np.ndarray, methods : np.ndarray) -> np.ndarray:
+    '''
+    Apply a batch of K folds to the same structure in one vectorised operation: the k-th fold transforms the tail
+    after the monomer indices[k] with methods[k] (1-7, see tail_fold) or moves only that monomer on the
+    diagonal (8, the monomers before and after it must not be aligned). The validity is not checked (see batch_contacts).
+
+    Parameters
+    ----------
+    struct : np.ndarray
+        Structure of the protein, with shape (n,2).
+    indices : np.ndarray
+        Pivot (or diagonally moved) monomer of each fold, in [1, n-2].
+    methods : np.ndarray
+        Method of each fold (1-8).
+
+    Returns
+    -------
+    np.ndarray
+        The K new structures, with shape (K,n,2).
+    '''
+    struct = np.asarray(struct)
+    indices = np.asarray(indices)
+    methods = np.asarray(methods)
+    (a, b), (c, d) = FOLD_MATRICES[np.where(methods == 8, 0, methods)].transpose(1,2,0)[:,:,:,None] # (K,1) each, identity for the diagonal moves
+    x_p, y_p = struct[indices].T[:,:,None] # pivots (K,1)
+    dx = struct[:,0] - x_p
+    dy = struct[:,1] - y_p
+    tail = (np.arange(len(struct)) > indices[:,None]) & (methods != 8)[:,None]
+    new = np.empty((len(indices), len(struct), 2), dtype=struct.dtype)
+    new[:,:,0] = np.where(tail, a*dx + b*dy + x_p, struct[:,0])
+    new[:,:,1] = np.where(tail, c*dx + d*dy + y_p, struct[:,1])
+    diag = np.flatnonzero(methods == 8)
+    if len(diag): # corner flip: the monomer goes to the opposite corner of the square with its neighbours
+        i = indices[diag]
+        new[diag, i] = struct[i-1] + struct[i+1] - struct[i]
+    return new
+
+
+def batch_contacts(structs : np.ndarray, h : np.ndarray) -> tuple:
+    '''
+    Check the self avoidance and count the H-H topological contacts of a batch of structures with unit steps
+    (e.g. generated by tail_fold_batch) in a few vectorised operations on the whole batch.\n
+    The sites of each structure are mapped on a flat grid covering the bounding box of the batch (one grid for each
+    structure, plus a border for the neighbours). Each monomer writes its id in its cell: a structure is valid if
+    every monomer reads back its own id. The contacts are the neighbour cells of the H monomers occupied by
+    H monomers, minus the H-H bonds of the backbone.
+
+    Parameters
+    ----------
+    structs : np.ndarray
+        Structures, with shape (K,n,2).
+    h : np.ndarray
+        Boolean mask of the H monomers of the sequence, with shape (n,).
+
+    Returns
+    -------
+    tuple
+        valid (bool array of shape (K,)) and H-H contacts (int array of shape (K,), meaningful only for the valid ones).
+    '''
+    structs = np.asarray(structs)
+    h = np.asarray(h, dtype=bool)
+    n_str, n = structs.shape[:2]
+    x = structs[:,:,0]
+    y = structs[:,:,1]
+    x_min, y_min = x.min(), y.min()
+    side_x = x.max() - x_min + 3 # bounding box of the whole batch, coordinates from 1 (0 is the border)
+    side_y = y.max() - y_min + 3
+    keys = (x - (x_min - 1))*side_y + (y - (y_min - 1)) + (np.arange(n_str)*side_x*side_y)[:,None]
+
+    ids = np.arange(1, n_str*n + 1, dtype=np.int32).reshape(n_str, n)
+    grid = np.zeros(n_str*side_x*side_y, dtype=np.int32)
+    grid[keys] = ids # with a collision only one of the monomers on the site keeps its id
+    valid = np.all(grid[keys] == ids, axis=1)
+
+    grid_h = np.zeros(len(grid), dtype=bool)
+    keys_h = keys[:,h]
+    grid_h[keys_h] = True
+    neig = keys_h[:,:,None] + np.array([side_y, -side_y, 1, -1]) # neighbour cells of the H monomers
+    count = grid_h[neig].reshape(n_str, -1).sum(axis=1) # each H-H pair is counted twice
+    bonds = np.count_nonzero(h[1:] & h[:-1]) # H-H backbone bonds (always neighbours)
+    return valid, count//2 - bonds
+
+
+def canonical_keys(structs : np.ndarray) -> list:
+    '''
+    Canonical keys of a batch of structures of the square lattice, equal for the structures that are images of
+    each other by a translation and one of the 8 symmetries of the lattice (rotations and reflections).\n
+    The key is the sequence of the relative turns of the chain (0 right, 1 straight, 2 left, from the cross product
+    of consecutive bonds, and 4 for a bond going back), invariant under translations and rotations. A reflection
+    swaps left and right, so the key is the smaller (as bytes, one per turn) of the turns and of their mirror image.
+
+    Parameters
+    ----------
+    structs : np.ndarray
+        Structures with unit steps, with shape (K,n,2).
+
+    Returns
+    -------
+    list
+        Keys (bytes) of the structures.
+    '''
+    structs = np.asarray(structs)
+    bonds = structs[:,1:] - structs[:,:-1]
+    b_x, b_y = bonds[:,:,0], bonds[:,:,1]
+    turns = b_x[:,:-1]*b_y[:,1:] - b_y[:,:-1]*b_x[:,1:] + 1 # (K,n-2) in {0,1,2}
+    turns[b_x[:,:-1]*b_x[:,1:] + b_y[:,:-1]*b_y[:,1:] < 0] = 4 # reversed bond (not a valid walk)
+    turns = turns.astype(np.int8)
+    mirror = np.where(turns == 4, turns, 2 - turns)
+    return [min(t, m) for t,m in zip(map(bytes, turns), map(bytes, mirror))]
+
+
+def canonical_key(struct : list) -> bytes:
+    '''
+    Canonical key of a structure of the square lattice (list or (n,2) array), see canonical_keys.
+    '''
+    return canonical_keys(np.asarray(struct)[None])[0]
+
+
 def hp_sequence_transform(seq : str) -> str :
     '''
     Transform a compleate sequence of 20 amino-acids into the HP sequence used in the code as model.
@@ -225,6 +399,30 @@ def hp_sequence_transform(seq : str) -> str :
     return hp_seq
 
 
+def max_hh_contacts(seq : str) -> int:
+    '''
+    Upper bound of the number of H-H contacts of a sequence on the square lattice.
+    A contact is possible only between monomers with indices of different parity, and each monomer can have
+    at most 2 contacts (3 at the ends of the chain): the bound is the smaller total of the two parities.
+
+    Parameters
+    ----------
+    seq : str
+        HP sequence.
+
+    Returns
+    -------
+    int
+        Max number of H-H contacts.
+    '''
+    n = len(seq)
+    bound = [0, 0] # max contacts of the even and odd H monomers
+    for i,mon in enumerate(seq):
+        if mon == 'H':
+            bound[i % 2] += 3 if i in (0, n-1) else 2
+    return min(bound)
+
+
 def progress_bar(progress : int, total : int) -> None:
     '''
     Print a progress bar on terminal when used inside a loop.
@@ -266,6 +464,18 @@ class Configuration():
     def __init__(self, config) -> None:
         self.seq = config['SEQUENCE']['sequence'] # selected sequence
         self.folds = config['PROCESS'].getint('folding_steps') # number of folds
+        self.pivot_weight = config['PROCESS'].getfloat('pivot_weight', fallback=1.) # weight of the pivot/diagonal moves
+        self.pull_weight = config['PROCESS'].getfloat('pull_weight', fallback=0.) # weight of the pull moves
+        if self.pivot_weight < 0 or self.pull_weight < 0 or self.pivot_weight + self.pull_weight <= 0:
+            raise ValueError('The move weights must be non negative and not both zero')
+        self.multiple_try = config['PROCESS'].getint('multiple_try', fallback=1) # candidates per step (1 = plain Metropolis)
+        if self.multiple_try < 1:
+            raise ValueError('The number of candidates of the multiple try Metropolis must be at least 1')
+        if self.multiple_try > 1 and self.pull_weight > 0:
+            raise ValueError('The multiple try Metropolis uses only the pivot/diagonal moves, set pull_weight = 0')
+        self.cache_size = config['PROCESS'].getint('cache_size', fallback=0) # conformations in the LRU cache (0 = no cache)
+        if self.cache_size < 0:
+            raise ValueError('The size of the conformation cache must be non negative')
         self.use_struct = config['optional'].getboolean('use_structure') # if use the structure present in config file or use linear structure
         self.annealing = config['optional'].getboolean('annealing') # if use annealing or not
         self.T = config['optional'].getfloat('T') # starting temperature
@@ -273,7 +483,87 @@ class Configuration():
             struct = config['optional']['structure'] # structure if TRUE in input file
             self.struct = json.loads(struct)
         self.gif = config['optional'].getboolean('create_gif')
+        self.debug = config['optional'].getboolean('debug', fallback=False) # check the incremental energy against the full one
+        self.engine = config['optional'].get('engine', fallback='list') # structure storage: list of lists or numpy array
+        if self.engine not in ('list', 'array'):
+            raise ValueError(f'Engine {self.engine} not recognized, it must be list or array')
+        self.record_stride = config['optional'].getint('record_stride', fallback=1) # steps between two records of the evolution
+        if self.record_stride < 1:
+            raise ValueError('The record stride must be at least 1')
+        self.record_aggregate = config['optional'].getboolean('record_aggregate', fallback=False) # min/mean/max of each window
+        self.trajectory = config['optional'].get('trajectory', fallback='') or None # file of the trajectory (None = not saved)
+        self.trajectory_stride = config['optional'].getint('trajectory_stride', fallback=100) # steps between two frames
+        self.checkpoint = config['optional'].get('checkpoint', fallback='') or None # file of the checkpoints (None = not saved)
+        self.checkpoint_interval = config['optional'].getint('checkpoint_interval', fallback=10000) # steps between two checkpoints
+        if self.checkpoint_interval < 1:
+            raise ValueError('The checkpoint interval must be at least 1')
+        self.progress = config['optional'].get('progress', fallback='bar') # report of the progress: bar, log or silent
+        if self.progress not in ('bar', 'log', 'silent'):
+            raise ValueError(f'Progress {self.progress} not recognized, it must be bar, log or silent')
+        self.progress_interval = config['optional'].getfloat('progress_interval', fallback=0.2) # seconds between two reports
+        self.render_workers = config['optional'].getint('render_workers', fallback=1) # processes rendering the gif (0 = one per core)
+        self.profile = config['optional'].getboolean('profile', fallback=False) # per-phase timers and counters of the evolution
+        self.profile_cprofile = config['optional'].getboolean('profile_cprofile', fallback=False) # cProfile of the evolution
+        self.profile_tracemalloc = config['optional'].getboolean('profile_tracemalloc', fallback=False) # memory allocations
+        self.dimension = config['optional'].getint('dimension', fallback=2) # square (2) or cubic (3) lattice
+        if self.dimension not in (2, 3):
+            raise ValueError(f'Dimension {self.dimension} not recognized, it must be 2 or 3')
         self.seed = config['random_seed']['seed'] # get the random seed
         if self.seed == 'None': # generate a random seed if None
             self.seed = random.randint(0,10000)
-        self.seed = int(self.seed) # convers the seed to int in any case
\ No newline at end of file
+        self.seed = int(self.seed) # convers the seed to int in any case
+        self.mode = config['PROCESS'].get('mode', fallback='metropolis') # single Metropolis chain or replica exchange
+        if self.mode not in ('metropolis', 'replica', 'wang_landau', 'perm', 'exact', 'branch_bound'):
+            raise ValueError(f'Mode {self.mode} not recognized, it must be metropolis, replica, wang_landau, perm, exact '
+                             'or branch_bound')
+        if self.dimension == 3 and (self.mode != 'metropolis' or self.engine != 'list'):
+            raise ValueError('The cubic lattice is available only with the metropolis mode and the list engine')
+        if self.dimension == 3 and self.multiple_try > 1:
+            raise ValueError('The multiple try Metropolis is available only in the square lattice')
+        # parameters of the replica exchange (parallel tempering) mode
+        self.replicas = config.getint('replica_exchange', 'replicas', fallback=8) # number of replicas (temperatures)
+        self.T_min = config.getfloat('replica_exchange', 'T_min', fallback=0.2) # lowest temperature of the ladder
+        self.T_max = config.getfloat('replica_exchange', 'T_max', fallback=max(self.T, self.T_min)) # highest temperature of the ladder
+        self.swap_interval = config.getint('replica_exchange', 'swap_interval', fallback=100) # steps between two swap attempts
+        self.workers = config.getint('replica_exchange', 'workers', fallback=0) # processes of the pool (0 = one per core, up to the replicas)
+        if self.replicas < 2:
+            raise ValueError('The replica exchange needs at least 2 replicas')
+        if self.T_min <= 0 or self.T_max < self.T_min:
+            raise ValueError('The temperatures of the replica exchange must satisfy 0 < T_min <= T_max')
+        if self.swap_interval < 1 or self.workers < 0:
+            raise ValueError('The replica exchange needs swap_interval >= 1 and workers >= 0')
+        # parameters of the Wang-Landau sampling
+        self.wl_flatness = config.getfloat('wang_landau', 'flatness', fallback=0.8) # min histogram count / mean count to consider it flat
+        self.wl_ln_f_final = config.getfloat('wang_landau', 'ln_f_final', fallback=1e-4) # final ln of the modification factor
+        self.wl_check_interval = config.getint('wang_landau', 'check_interval', fallback=10000) # steps between two flatness checks
+        self.wl_max_steps = config.getint('wang_landau', 'max_steps', fallback=10000000) # max number of steps
+        if not 0 < self.wl_flatness < 1:
+            raise ValueError('The flatness of the Wang-Landau histogram must be between 0 and 1')
+        if self.wl_ln_f_final <= 0:
+            raise ValueError('The final ln f of the Wang-Landau sampling must be positive')
+        if self.wl_check_interval < 1 or self.wl_max_steps < 1:
+            raise ValueError('The check interval and the max steps of the Wang-Landau sampling must be at least 1')
+        # parameters of the PERM chain growth
+        self.perm_T = config.getfloat('perm', 'T', fallback=0.3) # temperature of the Boltzmann factors of the growth
+        self.perm_tours = config.getint('perm', 'tours', fallback=100000) # max number of tours
+        self.perm_time_limit = config.getfloat('perm', 'time_limit', fallback=60.) # max time in seconds
+        self.perm_c_plus = config.getfloat('perm', 'c_plus', fallback=3.) # enrichment threshold (times the mean weight)
+        self.perm_c_minus = config.getfloat('perm', 'c_minus', fallback=0.3) # pruning threshold (times the mean weight)
+        self.perm_keep = config.getint('perm', 'keep', fallback=10) # number of best structures kept
+        if self.perm_T <= 0:
+            raise ValueError('The temperature of the PERM must be positive')
+        if self.perm_tours < 1 or self.perm_time_limit <= 0:
+            raise ValueError('The PERM needs at least 1 tour and a positive time limit')
+        if not 0 < self.perm_c_minus < self.perm_c_plus:
+            raise ValueError('The PERM thresholds must satisfy 0 < c_minus < c_plus')
+        if self.perm_keep < 1:
+            raise ValueError('The PERM must keep at least 1 structure')
+        # parameters of the exact enumeration
+        self.exact_workers = config.getint('exact', 'workers', fallback=0) # processes of the pool (0 = one per core)
+        self.exact_max_structs = config.getint('exact', 'max_structs', fallback=10000) # max number of ground state structures kept
+        if self.exact_workers < 0 or self.exact_max_structs < 1:
+            raise ValueError('The exact enumeration needs workers >= 0 and max_structs >= 1')
+        # parameters of the branch and bound
+        self.bb_time_limit = config.getfloat('branch_bound', 'time_limit', fallback=60.) # max time in seconds
+        if self.bb_time_limit <= 0:
+            raise ValueError('The time limit of the branch and bound must be positive')
\ No newline at end of file
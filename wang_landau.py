@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tommaso Giacometti
+"""
+from protein_class import Protein
+import random
+import math
+import numpy as np
+import utils
+import progress
+
+
+class WangLandau():
+    '''
+    Wang-Landau estimation of the density of states g(E) of the protein.\n
+    The structures are generated with the same moves of the Metropolis evolution (Protein.propose_fold) and
+    accepted with probability min(1, g(E_old)/g(E_new)). At each step ln g of the current energy is increased by
+    ln f and its histogram is updated. When the histogram is flat (all the visited energies have at least
+    flatness times the mean count) ln f is halved and the histogram reset, until ln f < ln_f_final.\n
+    From g(E) the thermodynamic quantities can be computed at any temperature with the thermodynamics method.
+
+    Parameters
+    ----------
+    config : utils.Configuration
+        Configuration class already assigned using the selected input file.
+    '''
+
+    def __init__(self, config : utils.Configuration) -> None:
+        self.protein = Protein(config)
+        self.protein.gif = False
+        self.flatness = config.wl_flatness
+        self.ln_f_final = config.wl_ln_f_final
+        self.check_interval = config.wl_check_interval
+        self.max_steps = config.wl_max_steps
+        self.reporter = progress.get_reporter(config.progress, config.progress_interval)
+
+        self.max_contacts = utils.max_hh_contacts(self.protein.seq) # upper bound of the H-H contacts: E >= -max_contacts
+        self.ln_g = np.zeros(self.max_contacts + 1) # ln g(E) with E = -k in the k-th position
+        self.hist = np.zeros(self.max_contacts + 1, dtype=np.int64) # histogram of the current stage
+        self.visited = np.zeros(self.max_contacts + 1, dtype=bool) # energies visited at least once
+        self.ln_f = 1. # ln of the modification factor
+        self.steps = 0 # total steps done
+        self.stages = 0 # number of times that ln f has been reduced
+        self.min_en = self.protein.energy()
+        self.min_en_struct = self.protein.struct
+
+
+    def run(self) -> None:
+        '''
+        Run the Wang-Landau sampling until the modification factor is lower than the final one
+        (or the max number of steps is reached).
+
+        Returns
+        -------
+        None.
+        '''
+        prot = self.protein
+        k = int(round(-prot.energy())) # current number of H-H contacts
+        n_stages = max(1, math.ceil(math.log2(self.ln_f/self.ln_f_final))) # stages needed to reach ln_f_final
+        self.reporter.start(n_stages)
+
+        while self.ln_f >= self.ln_f_final and self.steps < self.max_steps:
+            for i in range(self.check_interval):
+                fold = prot.propose_fold()
+                k_new = k + fold.d_hh
+                d_ln_g = self.ln_g[k] - self.ln_g[k_new]
+                if d_ln_g >= 0 or random.random() < math.exp(d_ln_g): # acceptance min(1, g(E_old)/g(E_new))
+                    prot.accept_fold(fold)
+                    k = k_new
+                    if -k < self.min_en:
+                        self.min_en = float(-k)
+                        self.min_en_struct = prot.struct
+                self.ln_g[k] += self.ln_f
+                self.hist[k] += 1
+                self.visited[k] = True
+            self.steps += self.check_interval
+            if self.is_flat():
+                self.ln_f /= 2
+                self.hist[:] = 0
+                self.stages += 1
+            self.reporter.update(min(self.stages, n_stages), en=float(-k), best=self.min_en)
+        self.reporter.finish()
+
+        if self.stages < n_stages:
+            print(f'\nWang-Landau stopped after {self.steps} steps with ln f = {self.ln_f:.2e} (not converged)')
+        self.ln_g[self.visited] -= self.ln_g[self.visited].min() # ln g defined up to a constant: min set to 0
+
+
+    def is_flat(self) -> bool:
+        '''
+        Check if the histogram of the visited energies is flat: all the counts are at least flatness times the mean.
+
+        Returns
+        -------
+        bool
+            True if the histogram is flat.
+        '''
+        hist = self.hist[self.visited]
+        return bool(hist.min() >= self.flatness*hist.mean())
+
+
+    @property
+    def energies(self) -> np.ndarray:
+        '''
+        Visited energies (increasing order).
+        '''
+        return -np.flatnonzero(self.visited)[::-1].astype(float)
+
+
+    @property
+    def log_dos(self) -> np.ndarray:
+        '''
+        ln g(E) of the visited energies, in the same order of energies.
+        '''
+        return self.ln_g[np.flatnonzero(self.visited)[::-1]]
+
+
+    def thermodynamics(self, T) -> dict:
+        '''
+        Compute the canonical thermodynamic quantities from the density of states at the temperatures T.
+
+        Parameters
+        ----------
+        T : float or array_like
+            Temperatures (positive).
+
+        Returns
+        -------
+        dict
+            'T', mean energy 'U', specific heat 'C', free energy 'F' and entropy 'S', as numpy arrays
+            (F and S are defined up to the constant of ln g).
+        '''
+        T = np.atleast_1d(np.asarray(T, dtype=float))
+        E = self.energies
+        ln_w = self.log_dos[None,:] - E[None,:]/T[:,None] # ln of the Boltzmann weights of each energy
+        ln_z = np.logaddexp.reduce(ln_w, axis=1) # ln Z
+        p = np.exp(ln_w - ln_z[:,None]) # canonical distribution of the energy
+        U = p @ E
+        C = (p @ E**2 - U**2)/T**2
+        F = -T*ln_z
+        S = (U - F)/T
+        return {'T' : T, 'U' : U, 'C' : C, 'F' : F, 'S' : S}
+